@@ -4,6 +4,8 @@ from datetime import date, timedelta
 import requests
 from lxml import etree
 
+from push_endpoint import metrics
+
 
 NAMESPACES = {'dc': 'http://purl.org/dc/elements/1.1/',
               'oai_dc': 'http://www.openarchives.org/OAI/2.0/',
@@ -36,7 +38,8 @@ def get_oai_properties(base_url):
 
     # request 1 for the setSpecs available
     set_url = base_url + '?verb=ListSets'
-    set_data_request = requests.get(set_url)
+    with metrics.outbound(metrics.OAI):
+        set_data_request = requests.get(set_url)
     all_content = etree.XML(set_data_request.content)
     set_names = all_content.xpath('//oai_dc:setSpec/node()', namespaces=NAMESPACES)
     set_names = [name.replace('publication:', '') for name in set_names]
@@ -52,7 +55,8 @@ def get_oai_properties(base_url):
     # request 2 for records 30 days back just in case
     start_date = str(date.today() - timedelta(30))
     prop_url = base_url + '?verb=ListRecords&metadataPrefix=oai_dc&from={}T00:00:00Z'.format(start_date)
-    prop_data_request = requests.get(prop_url)
+    with metrics.outbound(metrics.OAI):
+        prop_data_request = requests.get(prop_url)
     all_prop_content = etree.XML(prop_data_request.content)
     pre_names = all_prop_content.xpath('//ns0:metadata', namespaces=NAMESPACES)[0].getchildren()[0].getchildren()
     all_names = [name.tag.replace('{' + NAMESPACES['dc'] + '}', '') for name in pre_names]
@@ -4,6 +4,8 @@ import requests
 from lxml import etree
 from django import forms
 
+from push_endpoint import metrics
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -16,7 +18,8 @@ class URLResolves(object):
     def __call__(self, value):
         ''' value is the serialized data to be validated '''
         try:
-            data = requests.get(value)
+            with metrics.outbound(metrics.OAI):
+                data = requests.get(value)
         except requests.exceptions.ConnectionError:
             raise forms.ValidationError('URL does not resolve, please enter  a valid URL')
         if data.status_code == 404:
@@ -29,7 +32,8 @@ class ValidOAIURL(object):
 
         url = value + IDENTIFY
 
-        data = requests.get(url)
+        with metrics.outbound(metrics.OAI):
+            data = requests.get(url)
         if data.status_code == 404:
             raise forms.ValidationError('URL does not resolve, please enter  a valid URL')
 
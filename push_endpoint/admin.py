@@ -1,5 +1,26 @@
 from django.contrib import admin
-from push_endpoint.models import PushedData
+from push_endpoint.models import PushedData, DOIResolution, PushBatch, SourceLimit
+
+
+class DOIResolutionAdmin(admin.ModelAdmin):
+    list_display = ('doi', 'resolves', 'date_checked', 'last_used', 'hits', 'misses')
+    list_filter = ['resolves']
+    search_fields = ['doi']
+
+
+class PushBatchAdmin(admin.ModelAdmin):
+    list_display = ('id', 'source', 'status', 'upsert', 'date_created', 'date_finished')
+    list_filter = ['status']
+
+
+class SourceLimitAdmin(admin.ModelAdmin):
+    list_display = ('source', 'exempt', 'requests_per_second', 'request_burst', 'items_per_second',
+                    'item_burst', 'doi_lookups_per_second', 'doi_lookup_burst')
+    list_filter = ['exempt']
+    search_fields = ['source__username']
+    raw_id_fields = ['source']
 
 admin.site.register(PushedData)
-# Register your models here.
+admin.site.register(DOIResolution, DOIResolutionAdmin)
+admin.site.register(PushBatch, PushBatchAdmin)
+admin.site.register(SourceLimit, SourceLimitAdmin)
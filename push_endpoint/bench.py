@@ -0,0 +1,68 @@
+## shared helpers for the bench_* and loadtest management commands
+import time
+import random
+
+from django.contrib.auth.models import User
+
+BENCH_USER = 'benchmark'
+
+
+def bench_user(number=None):
+    username = BENCH_USER if number is None else '{}-{}'.format(BENCH_USER, number)
+    user, _ = User.objects.get_or_create(username=username)
+    return user
+
+
+def fake_row(i):
+    return {
+        'description': 'Ducks, their calls, and their habbits. Part {}'.format(i),
+        'contributors': 'Shawn Michaels',
+        'tags': 'ducks, hunting',
+        'title': 'All About Ducks {}'.format(i),
+        'url': 'http://dudley.net/{}'.format(i),
+        'serviceID': 'DuckID{}'.format(i),
+        'doi': '10.1000/duck.{}'.format(i)
+    }
+
+
+def fake_rows(count, start=0):
+    return [fake_row(i) for i in range(start, start + count)]
+
+
+WORDS = ('duck', 'goose', 'swan', 'heron', 'crane', 'wetland', 'migration', 'plumage', 'nesting',
+         'survey', 'population', 'habitat', 'census', 'banding', 'flyway', 'wintering', 'decline')
+
+
+def payloads(count, seed=0, start=0, prefix='10.5555/bench'):
+    """ count synthetic pushes, the same ones for the same seed. Titles,
+    descriptions, contributors and tags vary in length and content, DOIs
+    are prefix.start to prefix.start + count - 1.
+    """
+    rng = random.Random('{}:{}'.format(seed, start))
+
+    def words(low, high):
+        return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+    return [{
+        'description': words(10, 120).capitalize() + '.',
+        'contributors': ', '.join(words(2, 2).title() for _ in range(rng.randint(1, 6))),
+        'tags': ', '.join(sorted(set(rng.choice(WORDS) for _ in range(rng.randint(0, 5))))),
+        'title': words(3, 12).title(),
+        'url': 'http://example.org/{}/{}'.format(seed, i),
+        'serviceID': 'Bench{}'.format(i),
+        'doi': '{}.{}'.format(prefix, i)
+    } for i in range(start, start + count)]
+
+
+def best_of(repeat, run, cleanup=None):
+    """ Fastest of repeat timed calls to run, in seconds. cleanup runs
+    untimed after each call.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        run()
+        timings.append(time.time() - start)
+        if cleanup:
+            cleanup()
+    return min(timings)
@@ -0,0 +1,213 @@
+## gzip, deflate and optionally brotli and zstd bodies in both directions
+import zlib
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# responses smaller than this go out as they are
+MIN_SIZE = getattr(settings, 'PUSHED_DATA_COMPRESS_MIN_SIZE', 1024)
+LEVEL = getattr(settings, 'PUSHED_DATA_COMPRESS_LEVEL', 6)
+# the most a compressed request body may decompress to
+MAX_BODY_SIZE = getattr(settings, 'PUSHED_DATA_MAX_BODY_SIZE', 100 * 1024 * 1024)
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript',
+                      'application/xml', 'application/msgpack', 'text/')
+
+READ_SIZE = 64 * 1024
+
+
+class BodyTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Request body decompresses to more than the allowed size'
+
+
+class ZlibDecoder(object):
+    def __init__(self, wbits):
+        self.decompressor = zlib.decompressobj(wbits)
+
+    def decode(self, data, max_length):
+        # max_length keeps a bomb from inflating in one call, the rest of
+        # the input waits in unconsumed_tail
+        data = self.decompressor.unconsumed_tail + data
+        return self.decompressor.decompress(data, max_length)
+
+    def pending(self):
+        return bool(self.decompressor.unconsumed_tail)
+
+    def flush(self):
+        return self.decompressor.flush()
+
+
+class ProcessDecoder(object):
+    """ brotli and zstd have no output limit per call, inputs are fed in
+    small pieces instead and the cap is checked between them
+    """
+    def __init__(self, decompressor, method):
+        self.decompressor = decompressor
+        self.method = method
+
+    def decode(self, data, max_length):
+        return getattr(self.decompressor, self.method)(data)
+
+    def pending(self):
+        return False
+
+    def flush(self):
+        return b''
+
+
+def gzip_encoder():
+    return zlib.compressobj(LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def deflate_encoder():
+    return zlib.compressobj(LEVEL)
+
+
+DECODERS = {
+    'gzip': lambda: ZlibDecoder(16 + zlib.MAX_WBITS),
+    'x-gzip': lambda: ZlibDecoder(16 + zlib.MAX_WBITS),
+    'deflate': lambda: ZlibDecoder(zlib.MAX_WBITS),
+}
+# best first, the response gets the first one the client accepts
+ENCODERS = [
+    ('gzip', gzip_encoder),
+    ('deflate', deflate_encoder),
+]
+
+if brotli is not None:
+    DECODERS['br'] = lambda: ProcessDecoder(brotli.Decompressor(), 'process')
+    ENCODERS.insert(0, ('br', lambda: brotli.Compressor(quality=LEVEL)))
+
+if zstandard is not None:
+    DECODERS['zstd'] = lambda: ProcessDecoder(zstandard.ZstdDecompressor().decompressobj(), 'decompress')
+    ENCODERS.insert(0, ('zstd', lambda: zstandard.ZstdCompressor(level=LEVEL).compressobj()))
+
+
+def compress_chunk(encoder, data):
+    if hasattr(encoder, 'process'):
+        return encoder.process(data)
+    return encoder.compress(data)
+
+
+def finish(encoder):
+    if hasattr(encoder, 'finish'):
+        return encoder.finish()
+    return encoder.flush()
+
+
+class DecodedStream(object):
+    """
+    File-like view of a compressed request body that decompresses as it
+    is read, so a large push is never held compressed and decompressed
+    at once, and that fails once the output passes max_size
+    """
+    def __init__(self, raw, encoding, max_size=None):
+        self.raw = raw
+        self.decoder = DECODERS[encoding]()
+        self.max_size = max_size or MAX_BODY_SIZE
+        self.size = 0
+        self.buffer = b''
+        self.finished = False
+
+    def fill(self, wanted):
+        """ Decompress until the buffer holds wanted bytes or the body ends
+        """
+        while not self.finished and (wanted < 0 or len(self.buffer) < wanted):
+            data = b'' if self.decoder.pending() else self.raw.read(READ_SIZE // 8)
+            try:
+                if data or self.decoder.pending():
+                    output = self.decoder.decode(data, self.max_size - self.size + 1)
+                else:
+                    output = self.decoder.flush()
+                    self.finished = True
+            except (zlib.error, ValueError, getattr(brotli, 'error', ValueError),
+                    getattr(zstandard, 'ZstdError', ValueError)):
+                raise ParseError('Request body is not valid for its Content-Encoding')
+
+            self.size += len(output)
+            if self.size > self.max_size:
+                raise BodyTooLarge()
+            self.buffer += output
+
+    def read(self, size=-1):
+        size = -1 if size is None else size
+        self.fill(size)
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while b'\n' not in self.buffer and not self.finished:
+            self.fill(len(self.buffer) + READ_SIZE)
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+def accepted_encodings(header):
+    """ The codings an Accept-Encoding header allows, by name
+    """
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    return set(name for name, quality in accepted.items() if quality > 0)
+
+
+def negotiate(header):
+    """ Name and encoder factory of the best coding the client accepts,
+    or None
+    """
+    accepted = accepted_encodings(header or '')
+    for name, encoder in ENCODERS:
+        if name in accepted or '*' in accepted:
+            return name, encoder
+    return None
+
+
+def compress(data, encoder):
+    encoder = encoder()
+    return compress_chunk(encoder, data) + finish(encoder)
+
+
+def compress_stream(chunks, encoder):
+    encoder = encoder()
+    for chunk in chunks:
+        data = compress_chunk(encoder, chunk)
+        if data:
+            yield data
+    yield finish(encoder)
+
+
+def compressible(content_type):
+    content_type = content_type.split(';')[0].strip().lower()
+    return any(content_type.startswith(allowed) for allowed in COMPRESSIBLE_TYPES)
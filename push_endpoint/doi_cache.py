@@ -0,0 +1,261 @@
+## shared DOI resolution cache
+import logging
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from push_endpoint import metrics
+from push_endpoint import profiling
+from push_endpoint import throttling
+from push_endpoint.models import DOICacheTotals, DOIResolution
+from push_endpoint.utils import chunks
+
+logger = logging.getLogger(__name__)
+
+DOI_URL = 'https://dx.doi.org/'
+# where DOIs are resolved, a stub resolver stands in for it in load tests
+RESOLVER_URL = getattr(settings, 'DOI_RESOLVER_URL', DOI_URL)
+
+# seconds a resolving DOI is trusted before being checked again
+POSITIVE_TTL = getattr(settings, 'DOI_CACHE_POSITIVE_TTL', 60 * 60 * 24 * 30)
+# seconds a non-resolving DOI is remembered, kept short so new DOIs show up
+NEGATIVE_TTL = getattr(settings, 'DOI_CACHE_NEGATIVE_TTL', 60 * 60)
+MAX_ENTRIES = getattr(settings, 'DOI_CACHE_MAX_ENTRIES', 100000)
+# new entries a process stores between two checks of the cache's size
+EVICT_INTERVAL = getattr(settings, 'DOI_CACHE_EVICT_INTERVAL', 100)
+# upper bound on concurrent requests to the resolver for one bulk push
+RESOLVER_WORKERS = getattr(settings, 'DOI_RESOLVER_WORKERS', 10)
+
+# keep-alive connections to the resolver, shared by every lookup
+session = requests.Session()
+session.mount(RESOLVER_URL, HTTPAdapter(pool_connections=1, pool_maxsize=RESOLVER_WORKERS))
+
+# entries this process stored since it last checked the cache's size
+_unchecked = [0]
+
+
+def set_resolver(url):
+    """ Resolve DOIs against url from now on, in this process
+    """
+    global RESOLVER_URL
+    RESOLVER_URL = url
+    session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=RESOLVER_WORKERS))
+
+
+def normalize(doi):
+    """ Strip the resolver prefix so both spellings of a DOI share an entry
+    """
+    doi = doi.strip()
+    if doi.startswith(DOI_URL):
+        doi = doi[len(DOI_URL):]
+    return doi
+
+
+def resolver_url(doi):
+    return RESOLVER_URL + normalize(doi)
+
+
+def fetch(doi):
+    """ Ask the DOI resolver directly. True when it redirects to the DOI's
+    target, False when it answers with a 404, and None when it gives no
+    definite answer: an error status, a 429 or no answer at all.
+    """
+    try:
+        with metrics.outbound(metrics.DOI):
+            # the resolver's own answer settles it, the target is not fetched
+            response = session.get(resolver_url(doi), allow_redirects=False)
+    except requests.RequestException as exc:
+        logger.warning('DOI resolver unavailable for {}: {}'.format(doi, exc))
+        return None
+
+    if response.status_code == 404:
+        return False
+    if 200 <= response.status_code < 400:
+        return True
+    logger.warning('DOI resolver answered {} for {}'.format(response.status_code, doi))
+    return None
+
+
+def settle(resolves):
+    """ Whether a DOI is valid given what fetch() said. DOIs the resolver
+    gave no definite answer for are let through, but never cached.
+    """
+    return resolves is not False
+
+
+def is_fresh(entry, now=None):
+    now = now or timezone.now()
+    ttl = POSITIVE_TTL if entry.resolves else NEGATIVE_TTL
+    return (now - entry.date_checked).total_seconds() < ttl
+
+
+def lookup(doi):
+    """ Return the cached resolution for a DOI, or None when it is unknown
+    or expired. Records a hit and refreshes the LRU timestamp.
+    """
+    doi = normalize(doi)
+    now = timezone.now()
+    try:
+        entry = DOIResolution.objects.get(doi=doi)
+    except DOIResolution.DoesNotExist:
+        return None
+
+    if not is_fresh(entry, now):
+        return None
+
+    DOIResolution.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used=now)
+    return entry.resolves
+
+
+def store(doi, resolves):
+    """ Record a fresh resolver answer for a DOI, returning whether it
+    added an entry
+    """
+    doi = normalize(doi)
+    now = timezone.now()
+    values = {'resolves': resolves, 'date_checked': now, 'last_used': now}
+
+    updated = DOIResolution.objects.filter(doi=doi).update(misses=F('misses') + 1, **values)
+    if updated:
+        return False
+
+    try:
+        with transaction.atomic():
+            DOIResolution.objects.create(doi=doi, misses=1, **values)
+    except IntegrityError:
+        # another worker stored the same DOI first
+        return False
+    return True
+
+
+def stored(count):
+    """ Note count new entries, and evict once EVICT_INTERVAL of them were
+    stored since the last check, so the COUNT(*) of the cache runs once
+    per so many entries instead of for each
+    """
+    _unchecked[0] += count
+    if _unchecked[0] >= EVICT_INTERVAL:
+        _unchecked[0] = 0
+        evict()
+
+
+def evict(max_entries=None):
+    """ Drop the least recently used entries beyond max_entries, adding
+    their hits and misses to DOICacheTotals
+    """
+    max_entries = MAX_ENTRIES if max_entries is None else max_entries
+    excess = DOIResolution.objects.count() - max_entries
+    if excess <= 0:
+        return 0
+
+    stale = list(DOIResolution.objects.order_by('last_used').values_list('pk', flat=True)[:excess])
+    hits = misses = 0
+    with transaction.atomic():
+        for batch in chunks(stale):
+            entries = DOIResolution.objects.filter(pk__in=batch)
+            totals = entries.aggregate(hits=Sum('hits'), misses=Sum('misses'))
+            hits += totals['hits'] or 0
+            misses += totals['misses'] or 0
+            entries.delete()
+        add_totals(hits, misses)
+    logger.info('Evicted {} DOI cache entries'.format(len(stale)))
+    return len(stale)
+
+
+def add_totals(hits, misses):
+    totals = DOICacheTotals.objects.filter(pk=1)
+    if totals.update(hits=F('hits') + hits, misses=F('misses') + misses):
+        return
+    try:
+        with transaction.atomic():
+            DOICacheTotals.objects.create(pk=1, hits=hits, misses=misses)
+    except IntegrityError:
+        # another worker created the row first
+        totals.update(hits=F('hits') + hits, misses=F('misses') + misses)
+
+
+def resolve(doi, source=None):
+    """ Return whether a DOI resolves, going to the network only on a miss.
+    The lookup is charged to source's DOI lookup budget, see resolve_many.
+    """
+    resolves = lookup(doi)
+    cached = resolves is not None
+    if not cached:
+        throttling.admit(source, throttling.DOI_LOOKUPS)
+        resolves = fetch(doi)
+        if resolves is not None and store(doi, resolves):
+            stored(1)
+    metrics.count_doi(resolves, cached)
+    return settle(resolves)
+
+
+def resolve_many(dois, workers=None, source=None):
+    """ Resolve a batch of DOIs at once, returning a dict keyed by the
+    normalized DOI. Cached answers come from a single query and the rest
+    are fetched concurrently over the shared session, at most workers
+    (default RESOLVER_WORKERS) at a time.
+
+    The fetches are charged to source's DOI lookup budget, which raises
+    Throttled when it cannot cover them. Cached answers are free.
+    """
+    dois = set(normalize(doi) for doi in dois)
+    if not dois:
+        return {}
+
+    now = timezone.now()
+    resolutions = {}
+    for batch in chunks(dois):
+        cached = [entry for entry in DOIResolution.objects.filter(doi__in=batch) if is_fresh(entry, now)]
+        for entry in cached:
+            resolutions[entry.doi] = entry.resolves
+            metrics.count_doi(entry.resolves, cached=True)
+        if cached:
+            DOIResolution.objects.filter(pk__in=[entry.pk for entry in cached]).update(
+                hits=F('hits') + 1, last_used=now
+            )
+
+    missing = list(dois - set(resolutions))
+    if missing:
+        throttling.admit(source, throttling.DOI_LOOKUPS, len(missing))
+        # only the network calls run in the pool, the database writes stay
+        # on this thread and its connection, the lookups still count in
+        # the request's profile
+        pool = ThreadPool(min(workers or RESOLVER_WORKERS, len(missing)))
+        try:
+            fetched = pool.map(profiling.propagate(fetch), missing)
+        finally:
+            pool.close()
+            pool.join()
+
+        created = 0
+        for doi, resolves in zip(missing, fetched):
+            if resolves is not None and store(doi, resolves):
+                created += 1
+            resolutions[doi] = settle(resolves)
+            metrics.count_doi(resolves, cached=False)
+        stored(created)
+
+    return resolutions
+
+
+def stats():
+    """ Hit and miss counters summed over the entries currently cached and
+    the ones evicted
+    """
+    totals = DOIResolution.objects.aggregate(hits=Sum('hits'), misses=Sum('misses'))
+    evicted = DOICacheTotals.objects.filter(pk=1).values('hits', 'misses').first() or {}
+    hits = (totals['hits'] or 0) + evicted.get('hits', 0)
+    misses = (totals['misses'] or 0) + evicted.get('misses', 0)
+    lookups = hits + misses
+
+    return {
+        'entries': DOIResolution.objects.count(),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': float(hits) / lookups if lookups else 0.0
+    }
@@ -0,0 +1,56 @@
+## streaming export of pushed data
+import csv
+import json
+
+from django.conf import settings
+from django.utils import six
+from rest_framework.utils.encoders import JSONEncoder
+
+from push_endpoint.pagination import ORDERING, after
+from push_endpoint.serializers import READ_COLUMNS, READ_FIELDS
+
+# rows fetched per query while exporting
+CHUNK_SIZE = getattr(settings, 'PUSHED_DATA_EXPORT_CHUNK_SIZE', 1000)
+
+
+def iter_rows(queryset, chunk_size=None):
+    """ Yield a dict per row of queryset, ordered by (dateUpdated, id).
+
+    Rows are fetched chunk_size at a time by keyset, so neither the
+    database driver nor this process ever holds the whole result.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    queryset = queryset.order_by(*ORDERING).values_list(*READ_COLUMNS)
+
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        for row in chunk:
+            yield dict(zip(READ_FIELDS, row))
+        if len(chunk) < chunk_size:
+            break
+        last = dict(zip(READ_FIELDS, chunk[-1]))
+        chunk = list(after(queryset, last['dateUpdated'], last['id'])[:chunk_size])
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=JSONEncoder) + '\n'
+
+
+class Echo(object):
+    """ File-like object for csv.writer that hands back what is written
+    """
+    def write(self, value):
+        return value
+
+
+def encode_cell(value):
+    value = six.text_type(value)
+    return value.encode('utf-8') if six.PY2 else value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(READ_FIELDS)
+    for row in rows:
+        yield writer.writerow([encode_cell(row[field]) for field in READ_FIELDS])
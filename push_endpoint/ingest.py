@@ -0,0 +1,421 @@
+## batched writes of pushed data
+import json
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db import connections, router, transaction, IntegrityError
+from django.db.models import Count, Max
+from django.utils import six, timezone
+from rest_framework.exceptions import APIException, PermissionDenied, Throttled, ValidationError
+
+from push_endpoint import doi_cache
+from push_endpoint import response_cache
+from push_endpoint import throttling
+from push_endpoint.utils import chunks
+from push_endpoint.models import Change, DailyCount, PendingItem, PushedData, Tag, HASHED_FIELDS, content_hash
+from push_endpoint.serializers import PushedDataSerializer
+
+BATCH_SIZE = getattr(settings, 'PUSHED_DATA_BATCH_SIZE', 500)
+# records held in memory at once while reading a newline-delimited push
+STREAM_CHUNK_SIZE = getattr(settings, 'PUSHED_DATA_STREAM_CHUNK_SIZE', 500)
+# parameters sqlite builds before 3.32 take per statement
+SQLITE_MAX_VARIABLES = 999
+
+
+def reserve_ids(connection, count):
+    """ Take count ids from the postgres sequence behind PushedData.id
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+        [PushedData._meta.db_table, 'id', count]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def insert_objects(objs, using, batch_size):
+    """ bulk_create objs and set their ids, must run inside a transaction.
+
+    bulk_create does not hand back autoincrement ids, so on postgres they
+    are reserved from the sequence up front. Elsewhere (sqlite) the
+    transaction holds the write lock after the first INSERT, so our rows
+    are the newest ones in the table when we read the ids back.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        for obj, pk in zip(objs, reserve_ids(connection, len(objs))):
+            obj.pk = pk
+        PushedData.objects.using(using).bulk_create(objs, batch_size=batch_size)
+    else:
+        PushedData.objects.using(using).bulk_create(objs, batch_size=batch_size)
+        ids = PushedData.objects.using(using).order_by('-pk').values_list('pk', flat=True)[:len(objs)]
+        for obj, pk in zip(objs, reversed(list(ids))):
+            obj.pk = pk
+
+
+def count_inserted(objs, using):
+    """ Add freshly inserted rows to the daily rollups and the change log,
+    bulk_create sends no post_save
+    """
+    DailyCount.objects.db_manager(using).add(Counter((obj.source_id, obj.dateUpdated) for obj in objs))
+    Change.objects.db_manager(using).record(Change.CREATE, [(obj.pk, obj.source_id) for obj in objs])
+
+
+def bulk_insert(rows, source, batch_size=None):
+    """ Insert validated rows for one source with batched INSERTs inside a
+    single transaction, returning the saved PushedData objects with their
+    ids set.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    objs = [PushedData(source=source, contentHash=content_hash(row), **row) for row in rows]
+    if not objs:
+        return objs
+
+    using = router.db_for_write(PushedData)
+    # the bumps of the block wait for its commit, here and below
+    with response_cache.bump_after(), transaction.atomic(using=using):
+        insert_objects(objs, using, batch_size)
+        count_inserted(objs, using)
+        Tag.objects.db_manager(using).sync([(obj.pk, obj.tags) for obj in objs])
+        # bulk_create sends no post_save, so invalidate cached lists here
+        response_cache.bump_generation()
+    return objs
+
+
+def existing_dois(source, dois):
+    """ Map the DOIs among dois that source has already pushed to their ids
+    """
+    existing = {}
+    for batch in chunks(set(dois)):
+        existing.update(PushedData.objects.filter(source=source, doi__in=batch).values_list('doi', 'pk'))
+    return existing
+
+
+def upsert_rows(rows, source, batch_size=None):
+    """ Write validated rows for one source keyed on their DOI, returning
+    (outcome, id) for every row, the outcome being 'inserted', 'updated'
+    or 'unchanged'. The DOIs in rows must be distinct.
+
+    Rows whose content hash matches the stored one are skipped without a
+    write, changed rows are updated in place and new DOIs are inserted in
+    batches, all in one transaction.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    try:
+        return write_upserts(rows, source, batch_size)
+    except IntegrityError:
+        # a concurrent push, a retry racing its original request say,
+        # inserted one of the new DOIs first. Now that it is stored the
+        # second pass updates it instead.
+        return write_upserts(rows, source, batch_size)
+
+
+def write_upserts(rows, source, batch_size):
+    """ One pass of upsert_rows, raising IntegrityError when one of the
+    DOIs it found new was inserted by someone else in the meantime
+    """
+    results = []
+
+    using = router.db_for_write(PushedData)
+    with response_cache.bump_after(), transaction.atomic(using=using):
+        stored = {}
+        for batch in chunks([row['doi'] for row in rows]):
+            for values in (PushedData.objects.using(using).filter(source=source, doi__in=batch)
+                           .values('doi', 'id', 'contentHash', *HASHED_FIELDS)):
+                stored[values.pop('doi')] = values
+
+        now = timezone.now()
+        new = []
+        for row in rows:
+            if row['doi'] not in stored:
+                obj = PushedData(source=source, contentHash=content_hash(row), **row)
+                new.append(obj)
+                results.append(['inserted', obj])
+                continue
+
+            values = stored[row['doi']]
+            # fields the row leaves out keep their stored values
+            digest = content_hash(dict(values, **row))
+            if values['contentHash'] == digest:
+                results.append(['unchanged', values['id']])
+            else:
+                # update() skips auto_now, so dateModified is set here
+                PushedData.objects.using(using).filter(pk=values['id']).update(
+                    contentHash=digest, dateModified=now, **row
+                )
+                results.append(['updated', values['id']])
+
+        if new:
+            insert_objects(new, using, batch_size)
+            count_inserted(new, using)
+
+        # update() and bulk_create send no post_save, re-tag the rows here.
+        # Updates leaving the tags out keep the stored ones.
+        Tag.objects.db_manager(using).sync([
+            (obj.pk, obj.tags) if outcome == 'inserted' else (obj, row['tags'])
+            for (outcome, obj), row in zip(results, rows)
+            if outcome == 'inserted' or (outcome == 'updated' and 'tags' in row)
+        ])
+        Change.objects.db_manager(using).record(
+            Change.UPDATE, [(pk, source.pk) for outcome, pk in results if outcome == 'updated']
+        )
+        if any(outcome != 'unchanged' for outcome, _ in results):
+            response_cache.bump_generation()
+    return [(outcome, obj.pk if outcome == 'inserted' else obj) for outcome, obj in results]
+
+
+def upsert(rows, source, batch_size=None):
+    """ upsert_rows, returning the number of rows inserted, updated and
+    left unchanged
+    """
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    for outcome, _ in upsert_rows(rows, source, batch_size):
+        counts[outcome] += 1
+    return counts
+
+
+def update_objects(changes, using, batch_size):
+    """ Write (id, {field: value}) pairs with one UPDATE per batch, each
+    column set by a CASE on the id, and bump their dateModified. Must run
+    inside a transaction.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = PushedData._meta
+    fields = [opts.get_field(name) for name in sorted(set(name for _, values in changes for name in values))]
+    modified = opts.get_field('dateModified').get_db_prep_save(timezone.now(), connection)
+    # an id and a value per field and row, and the id again in the WHERE
+    per_row = 2 * len(fields) + 1
+    if connection.vendor == 'sqlite':
+        # and the shared dateModified once per statement
+        batch_size = min(batch_size, (SQLITE_MAX_VARIABLES - 1) // per_row)
+    else:
+        batch_size = min(batch_size, connection.ops.bulk_batch_size([None] * per_row, changes))
+
+    for batch in chunks(changes, batch_size):
+        assignments = ['{} = %s'.format(qn('dateModified'))]
+        params = [modified]
+        for field in fields:
+            cases = [(pk, values[field.name]) for pk, values in batch if field.name in values]
+            if not cases:
+                continue
+            assignments.append('{column} = CASE {id} {whens} ELSE {column} END'.format(
+                column=qn(field.column), id=qn('id'), whens=' '.join(['WHEN %s THEN %s'] * len(cases))
+            ))
+            for pk, value in cases:
+                params.extend([pk, field.get_db_prep_save(value, connection)])
+
+        params.extend(pk for pk, _ in batch)
+        connection.cursor().execute('UPDATE {} SET {} WHERE {} IN ({})'.format(
+            qn(opts.db_table), ', '.join(assignments), qn('id'), ', '.join(['%s'] * len(batch))
+        ), params)
+
+
+def bulk_update(rows, source, batch_size=None):
+    """ Apply validated rows, each carrying the id of a row of source, and
+    return the updated PushedData objects in the order of rows.
+
+    The targets are read with one id__in query per 500 rows, their
+    ownership checked together and the writes made by update_objects, all
+    in one transaction. Fields a row leaves out, in a partial update, keep
+    their stored values.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    changes = OrderedDict()
+    for row in rows:
+        row = dict(row)
+        try:
+            pk = int(row.pop('id'))
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError('Every record needs the id of the record it updates.')
+        if pk in changes:
+            raise ValidationError('Record {} appears more than once in this update.'.format(pk))
+        changes[pk] = row
+    if not changes:
+        return []
+
+    using = router.db_for_write(PushedData)
+    with response_cache.bump_after(), transaction.atomic(using=using):
+        stored = {}
+        for batch in chunks(list(changes)):
+            for values in PushedData.objects.using(using).filter(pk__in=batch).values('id', 'source', *HASHED_FIELDS):
+                stored[values.pop('id')] = values
+
+        if len(stored) != len(changes):
+            raise ValidationError('Could not find all objects to update.')
+        if any(values['source'] != source.pk for values in stored.values()):
+            raise PermissionDenied('Records can only be updated by their source.')
+
+        for pk, row in changes.items():
+            row['contentHash'] = content_hash(dict(stored[pk], **row))
+        update_objects(list(changes.items()), using, batch_size)
+
+        # the UPDATEs send no post_save, re-tag the rows and log the changes here
+        Tag.objects.db_manager(using).sync([(pk, row['tags']) for pk, row in changes.items() if 'tags' in row])
+        Change.objects.db_manager(using).record(Change.UPDATE, [(pk, source.pk) for pk in changes])
+        response_cache.bump_generation()
+
+    objs = {}
+    for batch in chunks(list(changes)):
+        objs.update((obj.pk, obj) for obj in PushedData.objects.using(using).select_related('source').filter(pk__in=batch))
+    return [objs[pk] for pk in changes]
+
+
+def bulk_delete(queryset):
+    """ Delete every row of a PushedData queryset with a single DELETE and
+    return how many there were.
+
+    The rows are never fetched: their tags, queued items, daily counts and
+    change log tombstones are kept in step by a fixed number of set-based
+    statements in the same transaction, where QuerySet.delete() would load
+    every row and send a post_delete for each.
+    """
+    using = router.db_for_write(PushedData)
+    queryset = queryset.using(using).order_by()
+    with response_cache.bump_after(), transaction.atomic(using=using):
+        # rows pushed while we delete are left alone
+        last = queryset.aggregate(last=Max('id'))['last']
+        if last is None:
+            return 0
+        queryset = queryset.filter(id__lte=last)
+
+        days = queryset.values_list('source', 'dateUpdated').annotate(count=Count('id'))
+        deltas = dict(((source_id, day), -count) for source_id, day, count in days)
+
+        ids = queryset.values('id')
+        Change.objects.db_manager(using).record_query(Change.DELETE, queryset)
+        Tag.objects.using(using).filter(data__in=ids)._raw_delete(using)
+        PendingItem.objects.using(using).filter(data__in=ids).update(data=None)
+        DailyCount.objects.db_manager(using).add(deltas)
+        queryset._raw_delete(using)
+        response_cache.bump_generation()
+    return -sum(deltas.values())
+
+
+def parse_line(line):
+    """ Decode one newline-delimited record, returning (record, errors)
+    """
+    if isinstance(line, six.binary_type):
+        line = line.decode('utf-8')
+    try:
+        record = json.loads(line)
+    except ValueError as exc:
+        return None, {'non_field_errors': ['Invalid JSON: {}'.format(exc)]}
+    if not isinstance(record, dict):
+        return None, {'non_field_errors': ['Expected a JSON object on each line']}
+    return record, None
+
+
+def validate_records(records, source, context, upsert=False, workers=None):
+    """ Validate (key, record) pairs pushed by source, returning a list of
+    (key, validated data) and a list of (key, errors).
+
+    The DOIs of all the records are resolved, and looked up among the
+    source's existing data, up front so the validators do no I/O of their
+    own. With upsert, DOIs the source already pushed are accepted.
+    """
+    dois = [record['doi'] for _, record in records if isinstance(record.get('doi'), six.string_types)]
+    context = dict(
+        context,
+        source=source,
+        upsert=upsert,
+        doi_resolutions=doi_cache.resolve_many(dois, workers=workers, source=source),
+        existing_dois={} if upsert else existing_dois(source, dois),
+        seen_dois=set()
+    )
+
+    valid = []
+    failed = []
+    for key, record in records:
+        serializer = PushedDataSerializer(data=record, context=context)
+        if serializer.is_valid():
+            valid.append((key, serializer.validated_data))
+        else:
+            failed.append((key, serializer.errors))
+    return valid, failed
+
+
+def ingest_chunk(chunk, source, context):
+    """ Validate a list of (line number, raw line) pairs, insert the valid
+    records in one batch and return a result dict for every line
+    """
+    throttling.admit(source, throttling.ITEMS, len(chunk))
+    results = []
+    records = []
+    for number, line in chunk:
+        record, errors = parse_line(line)
+        if errors:
+            results.append({'line': number, 'errors': errors})
+        else:
+            records.append((number, record))
+
+    valid, failed = validate_records(records, source, context)
+    for number, errors in failed:
+        results.append({'line': number, 'errors': errors})
+
+    created = bulk_insert([row for _, row in valid], source=source)
+    for (number, _), obj in zip(valid, created):
+        results.append({'line': number, 'id': obj.pk})
+
+    return sorted(results, key=lambda result: result['line'])
+
+
+CONCURRENT_WRITE_MESSAGE = 'A concurrent push wrote a DOI of this chunk first, nothing of it was written'
+
+
+def ingest_lines(lines, source, context, chunk_size=None):
+    """ Validate and insert newline-delimited JSON records chunk_size at a
+    time, so memory use does not grow with the size of the push.
+
+    Yields a result for every non-blank line as its chunk is written,
+    followed by a summary of the whole push. When the source's item or DOI
+    lookup budget runs out the rest of the push is not read, the summary
+    says from which line to push it again and after how many seconds. A
+    chunk a concurrent push beat to one of its DOIs fails line by line. A
+    body that stops decoding part way, a corrupt or oversized compressed
+    push, ends with the error in the summary.
+    """
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    summary = {'lines': 0, 'created': 0, 'failed': 0}
+
+    def flush(chunk):
+        try:
+            results = ingest_chunk(chunk, source, context)
+        except IntegrityError:
+            # a concurrent push inserted one of the chunk's DOIs after it
+            # was validated, nothing of the chunk was written
+            results = [
+                {'line': number, 'errors': {'non_field_errors': [CONCURRENT_WRITE_MESSAGE]}}
+                for number, _ in chunk
+            ]
+        for result in results:
+            summary['lines'] += 1
+            summary['failed' if 'errors' in result else 'created'] += 1
+            yield result
+
+    chunk = []
+    number = 0
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            chunk.append((number, line))
+            if len(chunk) >= chunk_size:
+                for result in flush(chunk):
+                    yield result
+                chunk = []
+
+        for result in flush(chunk):
+            yield result
+    except Throttled as exc:
+        # nothing of the chunk was written
+        summary['throttled'] = {'line': chunk[0][0], 'retry_after': exc.wait}
+    except APIException as exc:
+        # the response has started, the error goes in the summary instead
+        summary['error'] = {
+            'line': chunk[0][0] if chunk else number + 1,
+            'status': exc.status_code,
+            'detail': exc.detail
+        }
+
+    yield {'summary': summary}
@@ -0,0 +1,168 @@
+## load test harness: stub DOI resolver, transports and a request driver
+import math
+import time
+import zlib
+import base64
+import threading
+from multiprocessing.pool import ThreadPool
+
+import requests
+from django.conf import settings
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils.six.moves import BaseHTTPServer, socketserver
+
+
+class StubResolver(object):
+    """ Local stand-in for the DOI resolver. Every lookup waits latency
+    seconds, and not_found_rate of the DOIs get a 404, always the same ones
+    for the same DOI so runs are reproducible.
+    """
+    def __init__(self, latency=0.0, not_found_rate=0.0, port=0):
+        self.latency = latency
+        self.not_found_rate = not_found_rate
+        self.lookups = 0
+        stub = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            # keep-alive, like the real resolver
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub.lookups += 1
+                time.sleep(stub.latency)
+                self.send_response(404 if stub.not_found(self.path.lstrip('/')) else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def not_found(self, doi):
+        return zlib.crc32(doi.encode('utf-8')) % 10000 < self.not_found_rate * 10000
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def basic_auth(username, password):
+    return 'Basic ' + base64.b64encode('{}:{}'.format(username, password).encode('utf-8')).decode('ascii')
+
+
+class LocalTransport(object):
+    """ Sends requests through the whole Django stack in this process,
+    middleware included, without a server. Use it as a context manager,
+    the test client's host is allowed inside it.
+    """
+    def __init__(self, authorization):
+        self.authorization = authorization
+        self.local = threading.local()
+        self.hosts = override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver'])
+
+    def __enter__(self):
+        self.hosts.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.hosts.disable()
+
+    def request(self, method, path, body=None, content_type='application/json'):
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client()
+        response = self.local.client.generic(
+            method, path, body or '', content_type, HTTP_AUTHORIZATION=self.authorization
+        )
+        return response.status_code, response.content
+
+
+class HTTPTransport(object):
+    """ Sends requests to a running server at url
+    """
+    def __init__(self, url, authorization):
+        self.url = url.rstrip('/')
+        self.authorization = authorization
+        self.local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def request(self, method, path, body=None, content_type='application/json'):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        response = self.local.session.request(method, self.url + path, data=body, headers={
+            'Authorization': self.authorization, 'Content-Type': content_type
+        })
+        return response.status_code, response.content
+
+
+def percentile(timings, percent):
+    """ Nearest-rank percentile of a sorted list
+    """
+    if not timings:
+        return None
+    return timings[max(int(math.ceil(percent / 100.0 * len(timings))) - 1, 0)]
+
+
+def run(transport, calls, concurrency=1):
+    """ Make calls, (method, path, body, items) tuples, at most concurrency
+    at a time and return their throughput and latency. items is how many
+    records a call pushes, or a function of the response body counting the
+    records it returns.
+    """
+    def call(spec):
+        method, path, body, items = spec
+        start = time.time()
+        status, content = transport.request(method, path, body)
+        elapsed = time.time() - start
+        if callable(items):
+            items = items(content) if 200 <= status < 300 else 0
+        return status, elapsed, items if 200 <= status < 300 else 0
+
+    start = time.time()
+    if concurrency > 1:
+        pool = ThreadPool(concurrency)
+        try:
+            results = pool.map(call, calls)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        # sqlite in-memory test databases are private to their thread
+        results = [call(spec) for spec in calls]
+    seconds = time.time() - start
+
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    timings = sorted(elapsed for _, elapsed, _ in results)
+    items = sum(count for _, _, count in results)
+
+    return {
+        'requests': len(results),
+        'items': items,
+        'seconds': seconds,
+        'requests_per_second': len(results) / seconds if seconds else None,
+        'items_per_second': items / seconds if seconds else None,
+        'latency': {
+            'p50': percentile(timings, 50),
+            'p99': percentile(timings, 99),
+            'max': timings[-1] if timings else None,
+        },
+        'statuses': statuses,
+    }
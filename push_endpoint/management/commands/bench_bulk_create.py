@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from push_endpoint import ingest
+from push_endpoint.bench import bench_user, best_of, fake_rows
+from push_endpoint.models import PushedData
+
+
+class Command(BaseCommand):
+    help = 'Time a bulk push written row by row against the bulk_create ingest path'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--items', type='int', dest='items', default=1000,
+                    help='Number of rows per push'),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+                    help='Number of runs of each path, the best one is reported'),
+        make_option('--batch-size', type='int', dest='batch_size', default=None,
+                    help='Rows per INSERT for the bulk path'),
+    )
+
+    def handle(self, *args, **options):
+        source = bench_user()
+        rows = fake_rows(options['items'])
+
+        def row_by_row():
+            for row in rows:
+                PushedData.objects.create(source=source, **row)
+
+        def bulk():
+            ingest.bulk_insert(rows, source=source, batch_size=options['batch_size'])
+
+        def cleanup():
+            ingest.bulk_delete(PushedData.objects.filter(source=source))
+
+        results = {}
+        for name, run in (('row_by_row', row_by_row), ('bulk_insert', bulk)):
+            results[name] = best_of(options['repeat'], run, cleanup)
+            self.stdout.write('{:<12} {:>5} rows  {:.4f}s'.format(name, len(rows), results[name]))
+
+        self.stdout.write('speedup      {:.1f}x'.format(results['row_by_row'] / results['bulk_insert']))
@@ -0,0 +1,52 @@
+import datetime
+from io import BytesIO
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from push_endpoint.bench import best_of, fake_rows
+from push_endpoint.parsers import MessagePackParser
+from push_endpoint.renderers import MessagePackRenderer
+
+
+class Command(BaseCommand):
+    help = 'Time encoding and decoding of bulk payloads as JSON and MessagePack, and compare their sizes'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', dest='sizes', default='10,100,1000,10000',
+                    help='Comma separated numbers of records per payload'),
+        make_option('--repeat', type='int', dest='repeat', default=5,
+                    help='Number of runs of each path, the best one is reported'),
+    )
+
+    formats = (
+        ('json', JSONRenderer(), JSONParser()),
+        ('msgpack', MessagePackRenderer(), MessagePackParser()),
+    )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        today = datetime.date.today()
+
+        for size in sizes:
+            # records as the API lists them
+            data = [dict(row, id=i, source='benchmark', dateUpdated=today) for i, row in enumerate(fake_rows(size))]
+            results = []
+            parsed = []
+            for name, renderer, parser in self.formats:
+                body = renderer.render(data)
+                parsed.append(parser.parse(BytesIO(body)))
+                results.append((
+                    name, len(body),
+                    best_of(options['repeat'], lambda: renderer.render(data)),
+                    best_of(options['repeat'], lambda: parser.parse(BytesIO(body)))
+                ))
+
+            if parsed[0] != parsed[1]:
+                raise CommandError('MessagePack does not round-trip like JSON at {} records'.format(size))
+
+            self.stdout.write('{:>6} records  '.format(size) + '  '.join(
+                '{} {:>9} bytes encode {:.4f}s decode {:.4f}s'.format(*result) for result in results
+            ))
@@ -0,0 +1,115 @@
+import json
+import datetime
+from optparse import make_option
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.core.management.base import BaseCommand
+
+from push_endpoint import ingest, search
+from push_endpoint.models import DailyCount, PushedData
+from push_endpoint.bench import bench_user, best_of, fake_rows
+from push_endpoint.pagination import ORDERING, PAGE_SIZE, after
+
+# rows seeded per INSERT batch, every batch gets its own dateUpdated
+SEED_CHUNK = 2000
+
+
+def explain(queryset):
+    """ The database's query plan for a queryset, one string per row
+    """
+    sql, params = queryset.query.sql_with_params()
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    cursor = connection.cursor()
+    cursor.execute(prefix + sql, params)
+    return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = 'Seed PushedData and record query plans and timings for the list, detail and filter patterns'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', dest='rows', default=2000000,
+                    help='Number of benchmark rows to seed, existing ones are reused'),
+        make_option('--sources', type='int', dest='sources', default=20,
+                    help='Number of benchmark sources the rows are spread over'),
+        make_option('--repeat', type='int', dest='repeat', default=5,
+                    help='Number of runs of each query, the best one is reported'),
+        make_option('--output', dest='output', default=None,
+                    help='Write the JSON results to this file instead of stdout'),
+        make_option('--cleanup', action='store_true', dest='cleanup', default=False,
+                    help='Delete the benchmark rows afterwards'),
+    )
+
+    def handle(self, *args, **options):
+        sources = [bench_user(number) for number in range(options['sources'])]
+        self.seed(sources, options['rows'])
+
+        results = {
+            'database': connection.vendor,
+            'rows': PushedData.objects.count(),
+            'patterns': {}
+        }
+        for name, queryset in self.patterns(sources):
+            results['patterns'][name] = {
+                'seconds': best_of(options['repeat'], lambda: list(queryset.all())),
+                'plan': explain(queryset)
+            }
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['cleanup']:
+            ingest.bulk_delete(PushedData.objects.filter(source__in=sources))
+
+    def seed(self, sources, rows):
+        seeded = PushedData.objects.filter(source__in=sources).count()
+        first_day = datetime.date.today() - datetime.timedelta(days=rows // SEED_CHUNK)
+
+        for chunk, start in enumerate(range(seeded, rows, SEED_CHUNK)):
+            source = sources[chunk % len(sources)]
+            # bulk_insert keeps the tags, change log and daily counts up to date
+            objs = ingest.bulk_insert(fake_rows(min(SEED_CHUNK, rows - start), start), source=source)
+            self.backdate(objs, first_day + datetime.timedelta(days=start // SEED_CHUNK))
+
+    def backdate(self, objs, day):
+        """ Move freshly inserted rows of one source to day along with their
+        daily counts, auto_now_add stamps today
+        """
+        today = objs[0].dateUpdated
+        if day == today:
+            return
+        source_id = objs[0].source_id
+        with transaction.atomic():
+            PushedData.objects.filter(
+                source=source_id, pk__gte=objs[0].pk, pk__lte=objs[-1].pk
+            ).update(dateUpdated=day)
+            DailyCount.objects.add({(source_id, day): len(objs), (source_id, today): -len(objs)})
+
+    def patterns(self, sources):
+        ordered = PushedData.objects.order_by(*ORDERING)
+        total = ordered.count()
+        middle = ordered[total // 2]
+        deep = ordered[max(total - PAGE_SIZE, 0)]
+        days = ordered.aggregate(last=Max('dateUpdated'))['last'] - middle.dateUpdated
+        week_end = middle.dateUpdated + datetime.timedelta(days=min(7, days.days))
+
+        return [
+            ('detail', PushedData.objects.filter(pk=middle.pk)),
+            ('lookup_doi', PushedData.objects.filter(doi=middle.doi)),
+            ('list_first_page', ordered[:PAGE_SIZE]),
+            ('list_offset_deep', ordered[total - PAGE_SIZE:total]),
+            ('list_keyset_deep', after(ordered, deep.dateUpdated, deep.pk)[:PAGE_SIZE]),
+            ('filter_date_range', ordered.filter(
+                dateUpdated__gte=middle.dateUpdated, dateUpdated__lte=week_end
+            )[:PAGE_SIZE]),
+            ('search', search.search(PushedData.objects.all(), middle.title)[:PAGE_SIZE]),
+            ('filter_source', ordered.filter(source=middle.source_id)[:PAGE_SIZE]),
+            ('filter_source_date_range', ordered.filter(
+                source=middle.source_id, dateUpdated__gte=middle.dateUpdated, dateUpdated__lte=week_end
+            )[:PAGE_SIZE]),
+        ]
@@ -0,0 +1,49 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from push_endpoint import ingest
+from push_endpoint.bench import bench_user, best_of, fake_rows
+from push_endpoint.models import PushedData
+from push_endpoint.serializers import PushedDataSerializer, READ_COLUMNS, serialize_rows
+
+
+class Command(BaseCommand):
+    help = 'Time PushedDataSerializer against serialize_rows for list pages of several sizes'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', dest='sizes', default='10,100,500',
+                    help='Comma separated page sizes'),
+        make_option('--repeat', type='int', dest='repeat', default=5,
+                    help='Number of runs of each path, the best one is reported'),
+    )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        source = bench_user()
+        ingest.bulk_insert(fake_rows(max(sizes)), source=source)
+        context = {'request': APIRequestFactory().get('/pushed_data/')}
+        renderer = JSONRenderer()
+
+        try:
+            for size in sizes:
+                queryset = PushedData.objects.filter(source=source).order_by('pk')[:size]
+
+                def serializer():
+                    return renderer.render(PushedDataSerializer(queryset.all(), many=True, context=context).data)
+
+                def fast():
+                    return renderer.render(serialize_rows(queryset.values_list(*READ_COLUMNS)))
+
+                if serializer() != fast():
+                    raise CommandError('serialize_rows output differs at page size {}'.format(size))
+
+                slow_time = best_of(options['repeat'], serializer)
+                fast_time = best_of(options['repeat'], fast)
+                self.stdout.write('{:>5} rows  serializer {:.4f}s  serialize_rows {:.4f}s  {:.1f}x'.format(
+                    size, slow_time, fast_time, slow_time / fast_time
+                ))
+        finally:
+            ingest.bulk_delete(PushedData.objects.filter(source=source))
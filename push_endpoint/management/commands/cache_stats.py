@@ -0,0 +1,16 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from push_endpoint import doi_cache
+from push_endpoint import response_cache
+
+
+class Command(BaseCommand):
+    help = 'Print hit and miss counts for the DOI resolution and DataList response caches'
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps({
+            'doi_cache': doi_cache.stats(),
+            'response_cache': response_cache.stats()
+        }, indent=2, sort_keys=True))
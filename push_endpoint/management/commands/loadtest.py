@@ -0,0 +1,191 @@
+import sys
+import json
+import random
+import datetime
+from optparse import make_option
+
+from django.db import connection
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.core.management.base import BaseCommand
+
+from push_endpoint import doi_cache
+from push_endpoint import ingest
+from push_endpoint import loadtest
+from push_endpoint.bench import payloads
+from push_endpoint.models import DailyCount, DOIResolution, PushedData, SourceLimit
+from push_endpoint.pagination import ORDERING, encode_cursor
+from push_endpoint.utils import chunks
+
+LOADTEST_USER = 'loadtest'
+PASSWORD = 'loadtest'
+# every DOI the load test pushes starts with this, 10.5555 is a test prefix
+DOI_PREFIX = '10.5555/loadtest'
+SEED_PREFIX = DOI_PREFIX + '.seed'
+
+
+class Command(BaseCommand):
+    help = ('Measure requests/s, items/s and latency of single and bulk pushes, deep pagination and '
+            'date-filtered lists, and write the results as JSON. DOIs are resolved by a local stub. '
+            'With --url the requests go to a running server on the same database, start it with '
+            'DOI_RESOLVER_URL set to the stub, see --resolver-port.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--url', dest='url', default=None,
+                    help='Base URL of a running server, requests go through Django in this process otherwise'),
+        make_option('--requests', type='int', dest='requests', default=100,
+                    help='Requests per single push, pagination and filter scenario'),
+        make_option('--bulk-sizes', dest='bulk_sizes', default='10,100,1000',
+                    help='Comma separated numbers of records per bulk push'),
+        make_option('--bulk-requests', type='int', dest='bulk_requests', default=10,
+                    help='Requests per bulk push scenario'),
+        make_option('--concurrency', type='int', dest='concurrency', default=1,
+                    help='Requests in flight at once, keep 1 on sqlite'),
+        make_option('--rows', type='int', dest='rows', default=10000,
+                    help='Records seeded for the pagination and filter scenarios'),
+        make_option('--days', type='int', dest='days', default=30,
+                    help='Days the seeded records are spread over'),
+        make_option('--window', type='int', dest='window', default=7,
+                    help='Days covered by each date-filtered list'),
+        make_option('--resolver-latency', type='float', dest='resolver_latency', default=20,
+                    help='Milliseconds the stub resolver takes per DOI'),
+        make_option('--not-found-rate', type='float', dest='not_found_rate', default=0.0,
+                    help='Share of DOIs the stub resolver answers with a 404'),
+        make_option('--resolver-port', type='int', dest='resolver_port', default=0,
+                    help='Port of the stub resolver, any free one by default'),
+        make_option('--throttled', action='store_true', dest='throttled', default=False,
+                    help='Keep the per-source throttling on for the load test source'),
+        make_option('--seed', type='int', dest='seed', default=0,
+                    help='Seed of the generated records and of the request mix'),
+        make_option('--output', dest='output', default=None,
+                    help='Write the JSON results to this file instead of stdout'),
+    )
+
+    def handle(self, *args, **options):
+        self.source = self.prepare(options['throttled'])
+        self.rng = random.Random(options['seed'])
+        self.seed = options['seed']
+
+        resolver = loadtest.StubResolver(
+            options['resolver_latency'] / 1000.0, options['not_found_rate'], options['resolver_port']
+        ).start()
+        authorization = loadtest.basic_auth(LOADTEST_USER, PASSWORD)
+        if options['url']:
+            sys.stderr.write('Stub DOI resolver at {}\n'.format(resolver.url))
+            transport = loadtest.HTTPTransport(options['url'], authorization)
+        else:
+            doi_cache.set_resolver(resolver.url)
+            transport = loadtest.LocalTransport(authorization)
+
+        try:
+            self.seed_rows(options['rows'], options['days'])
+            scenarios = [('single_post', self.pushes(options['requests'], 1))]
+            for size in [int(size) for size in options['bulk_sizes'].split(',')]:
+                scenarios.append(('bulk_post_{}'.format(size), self.pushes(options['bulk_requests'], size)))
+            scenarios.append(('list_deep', self.deep_pages(options['requests'])))
+            scenarios.append(('list_date_filtered', self.date_filters(options['requests'], options['window'])))
+
+            results = {
+                'date': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'target': options['url'] or 'in-process',
+                'seed': options['seed'],
+                'concurrency': options['concurrency'],
+                'rows': options['rows'],
+                'resolver': {
+                    'latency_ms': options['resolver_latency'],
+                    'not_found_rate': options['not_found_rate'],
+                },
+                'scenarios': {}
+            }
+            with transport:
+                for name, calls in scenarios:
+                    results['scenarios'][name] = loadtest.run(transport, calls, options['concurrency'])
+            results['resolver']['lookups'] = resolver.lookups
+        finally:
+            # drop the keep-alive connections to the stub before it goes
+            doi_cache.session.close()
+            resolver.stop()
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    def prepare(self, throttled):
+        """ The load test source, without any data or cached DOIs left from
+        an earlier run so every run starts from the same state
+        """
+        source, _ = User.objects.get_or_create(username=LOADTEST_USER)
+        source.set_password(PASSWORD)
+        source.save()
+
+        ingest.bulk_delete(PushedData.objects.filter(source=source))
+        DOIResolution.objects.filter(doi__startswith=DOI_PREFIX).delete()
+        SourceLimit.objects.filter(source=source).delete()
+        if not throttled:
+            SourceLimit.objects.create(source=source, exempt=True)
+        return source
+
+    def seed_rows(self, rows, days):
+        """ Push rows records and spread them evenly over the last days
+        """
+        today = datetime.date.today()
+        per_day = max(int(-(-rows // days)), 1)
+        for number, start in enumerate(range(0, rows, per_day)):
+            objs = ingest.bulk_insert(
+                payloads(min(per_day, rows - start), self.seed, start, SEED_PREFIX), source=self.source
+            )
+            day = today - datetime.timedelta(days=days - 1 - number)
+            for batch in chunks([obj.pk for obj in objs]):
+                PushedData.objects.filter(pk__in=batch).update(dateUpdated=day)
+            DailyCount.objects.add({(self.source.pk, today): -len(objs)})
+            DailyCount.objects.add({(self.source.pk, day): len(objs)})
+        self.pushed = 0
+
+    def pushes(self, count, size):
+        """ count POSTs of size new records each, single records are sent
+        as an object and not a list
+        """
+        calls = []
+        for _ in range(count):
+            records = payloads(size, self.seed, self.pushed, DOI_PREFIX)
+            self.pushed += size
+            calls.append(('POST', '/pushed_data/', json.dumps(records[0] if size == 1 else records), size))
+        return calls
+
+    def deep_pages(self, count):
+        """ count list pages at cursors in the second half of the data,
+        each page at a position of its own
+        """
+        ordered = PushedData.objects.order_by(*ORDERING).values_list('dateUpdated', 'id')
+        total = ordered.count()
+        calls = []
+        for _ in range(count if total else 0):
+            date, pk = ordered[self.rng.randint(total // 2, max(total - 1, 0))]
+            calls.append(('GET', '/pushed_data/?cursor={}'.format(encode_cursor(date, pk)), None, count_results))
+        return calls
+
+    def date_filters(self, count, window):
+        """ count lists of the records between two dates window days apart
+        """
+        dates = PushedData.objects.filter(source=self.source).order_by('dateUpdated').values_list('dateUpdated', flat=True)
+        first, last = dates.first(), dates.last()
+        if first is None:
+            return []
+        span = max((last - first).days - window, 0)
+        calls = []
+        for _ in range(count):
+            start = first + datetime.timedelta(days=self.rng.randint(0, span))
+            end = start + datetime.timedelta(days=window)
+            calls.append(('GET', '/pushed_data/?from={}&to={}'.format(start, end), None, count_results))
+        return calls
+
+
+def count_results(content):
+    """ Records in a list response, paged or not
+    """
+    data = json.loads(content.decode('utf-8'))
+    return len(data['results'] if isinstance(data, dict) else data)
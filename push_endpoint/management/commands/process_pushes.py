@@ -0,0 +1,32 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from push_endpoint import pending
+
+
+class Command(BaseCommand):
+    help = 'Validate and write pushes queued with ?async=true, one batch at a time'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=None,
+                    help='Concurrent DOI lookups, defaults to DOI_RESOLVER_WORKERS'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=None,
+                    help='Items validated and written together'),
+        make_option('--sleep', type='float', dest='sleep', default=5,
+                    help='Seconds to wait when the queue is empty'),
+        make_option('--once', action='store_true', dest='once', default=False,
+                    help='Exit once the queue is empty instead of waiting for more'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            batch = pending.claim_batch()
+            if batch is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+
+            pending.process_batch(batch, workers=options['workers'], chunk_size=options['chunk_size'])
@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from push_endpoint.models import DailyCount
+
+
+class Command(BaseCommand):
+    help = 'Recount the per source per day rollups from PushedData'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--check', action='store_true', dest='check', default=False,
+                    help='Only compare the rollups with a recount and fail on any difference'),
+    )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            DailyCount.objects.rebuild()
+            self.stdout.write('Rebuilt {} daily counts'.format(DailyCount.objects.count()))
+            return
+
+        expected = dict(((source_id, day), count) for source_id, day, count in DailyCount.objects.recount())
+        stored = dict(
+            ((source_id, day), count) for source_id, day, count
+            in DailyCount.objects.filter(count__gt=0).values_list('source', 'day', 'count')
+        )
+
+        differences = sorted(
+            key for key in set(expected) | set(stored) if expected.get(key, 0) != stored.get(key, 0)
+        )
+        for source_id, day in differences:
+            self.stdout.write('source {} on {}: expected {}, stored {}'.format(
+                source_id, day, expected.get((source_id, day), 0), stored.get((source_id, day), 0)
+            ))
+        if differences:
+            raise CommandError('The daily counts differ from PushedData, run rebuild_rollups to fix them')
+        self.stdout.write('Daily counts match PushedData')
@@ -0,0 +1,95 @@
+## Prometheus metrics of the requests, pushes, DOI checks and outbound calls
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# every worker process writes its samples to files in this directory and
+# /metrics adds them up. It must exist and be emptied when the server
+# starts. The prometheus_multiproc_dir environment variable, when set, wins.
+# None keeps the samples in the memory of each process.
+MULTIPROC_DIR = getattr(settings, 'PROMETHEUS_MULTIPROC_DIR', None)
+if MULTIPROC_DIR:
+    os.environ.setdefault('prometheus_multiproc_dir', MULTIPROC_DIR)
+
+# imported after the directory is set, prometheus_client picks its store then
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+REQUESTS = Counter(
+    'http_requests_total', 'Requests by URL name, method and status', ['view', 'method', 'status']
+)
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to respond by URL name and method', ['view', 'method']
+)
+PUSHED_ITEMS = Counter(
+    'pushed_items_total', 'Pushed records created, updated and deleted', ['action']
+)
+DOI_VALIDATIONS = Counter(
+    'doi_validations_total', 'DOIs checked by whether they resolve and where the answer came from',
+    ['outcome', 'origin']
+)
+OUTBOUND_LATENCY = Histogram(
+    'outbound_request_duration_seconds', 'Time of the calls to the DOI resolver and OAI-PMH providers',
+    ['service']
+)
+
+DOI = 'doi'
+OAI = 'oai'
+# the URL name of requests that matched no URL
+UNMATCHED = 'unmatched'
+
+
+def directory():
+    return os.environ.get('prometheus_multiproc_dir')
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else UNMATCHED
+
+
+def observe_request(request, response, seconds):
+    view = view_name(request)
+    REQUESTS.labels(view, request.method, str(response.status_code)).inc()
+    REQUEST_LATENCY.labels(view, request.method).observe(seconds)
+
+
+def count_pushed(action, count):
+    if count > 0:
+        PUSHED_ITEMS.labels(action).inc(count)
+
+
+def count_doi(resolves, cached):
+    """ resolves is None when the resolver gave no definite answer
+    """
+    outcome = 'unknown' if resolves is None else 'resolves' if resolves else 'not_found'
+    DOI_VALIDATIONS.labels(outcome, 'cache' if cached else 'resolver').inc()
+
+
+@contextmanager
+def outbound(service):
+    """ Time the calls to service made in the block, failed ones included
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        OUTBOUND_LATENCY.labels(service).observe(time.time() - start)
+
+
+def exposition(path=None):
+    """ The metrics in the Prometheus text format, summed over every
+    process writing to path (default the multi-process directory) when
+    there is one, else this process' own
+    """
+    path = path or directory()
+    if path:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
@@ -0,0 +1,157 @@
+## request and response middleware for the push API
+import time
+import itertools
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.permissions import SAFE_METHODS
+
+from push_endpoint import compression
+from push_endpoint import metrics
+from push_endpoint import profiling
+from push_endpoint import routers
+
+
+class CompressionMiddleware(object):
+    """
+    Decode request bodies sent with a Content-Encoding as they are read,
+    and compress responses with the best coding in Accept-Encoding.
+
+    Streamed responses are compressed chunk by chunk, once their first
+    chunks add up to compression.MIN_SIZE. Goes first in
+    MIDDLEWARE_CLASSES so nothing reads the body before it is wrapped.
+    """
+    def process_request(self, request):
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', 'identity').strip().lower()
+        if encoding == 'identity':
+            return None
+        if encoding not in compression.DECODERS:
+            return HttpResponse(
+                'Unsupported Content-Encoding {}'.format(encoding), status=415, content_type='text/plain'
+            )
+        request._stream = compression.DecodedStream(request._stream, encoding)
+        return None
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '')
+        if response.has_header('Content-Encoding') or not compression.compressible(content_type):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        negotiated = compression.negotiate(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if negotiated is None:
+            return response
+        name, encoder = negotiated
+
+        if response.streaming:
+            chunks = iter(response.streaming_content)
+            head = []
+            size = 0
+            for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size >= compression.MIN_SIZE:
+                    break
+            else:
+                # the whole body fit under the threshold
+                response.streaming_content = head
+                return response
+            response.streaming_content = compression.compress_stream(itertools.chain(head, chunks), encoder)
+            if response.has_header('Content-Length'):
+                del response['Content-Length']
+        else:
+            if len(response.content) < compression.MIN_SIZE:
+                return response
+            content = compression.compress(response.content, encoder)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # the bytes differ per coding, the representation does not
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = name
+        return response
+
+
+class ProfilingMiddleware(object):
+    """
+    Time the SQL queries, the outbound HTTP calls per host and the view of
+    each request and send them back in a Server-Timing header. A sampled
+    share of the requests also runs under cProfile, and its stats are
+    dumped when it turns out slower than profiling.PROFILING_THRESHOLD.
+
+    Goes right after CompressionMiddleware. The view time includes the
+    rendering of the response; streamed bodies are produced after the
+    headers are sent, so their time is not in them.
+    """
+    def __init__(self):
+        profiling.install()
+
+    def process_request(self, request):
+        profile = profiling.Profile()
+        if profiling.sampled():
+            profile.start_profiler()
+        profiling.activate(profile)
+        request._profile = profile
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            profile.view_start = time.time()
+        return None
+
+    def process_response(self, request, response):
+        profile = getattr(request, '_profile', None)
+        if profile is None:
+            return response
+        profiling.deactivate()
+        profile.finish()
+        response['Server-Timing'] = profile.server_timing()
+        profile.dump(request)
+        return response
+
+
+class MetricsMiddleware(object):
+    """
+    Count the requests and time the responses of each URL name for
+    /metrics. Requests no URL matched are counted as metrics.UNMATCHED.
+    """
+    def process_request(self, request):
+        request._metrics_start = time.time()
+        return None
+
+    def process_response(self, request, response):
+        start = getattr(request, '_metrics_start', None)
+        if start is not None:
+            metrics.observe_request(request, response, time.time() - start)
+        return response
+
+
+class ReplicaMiddleware(object):
+    """
+    Route the reads of safe-method requests to a read replica, see
+    routers.ReplicaRouter. A client whose request wrote gets a pin, as a
+    cookie and a header, and reads from the primary while it lasts.
+    """
+    def process_request(self, request):
+        routers.begin(request)
+        return None
+
+    def process_response(self, request, response):
+        state = routers.current()
+        if state is None or not routers.REPLICAS:
+            return response
+        routers.end()
+
+        if state.wrote or (request.method not in SAFE_METHODS and response.status_code < 400):
+            until = '{:.3f}'.format(time.time() + routers.PIN_SECONDS)
+            response.set_cookie(routers.PIN_COOKIE, until, max_age=routers.PIN_SECONDS, httponly=True)
+            response[routers.PIN_HEADER] = until
+        if response.streaming and state.replica is not None:
+            # the body is read from the database as it is sent
+            response.streaming_content = routers.bind(state, response.streaming_content)
+        return response
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_endpoint', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DOIResolution',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('doi', models.TextField(unique=True)),
+                ('resolves', models.BooleanField(default=False)),
+                ('date_checked', models.DateTimeField()),
+                ('last_used', models.DateTimeField(db_index=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('misses', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
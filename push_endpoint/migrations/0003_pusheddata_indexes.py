@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_endpoint', '0002_doiresolution'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pusheddata',
+            name='doi',
+            field=models.TextField(db_index=True),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='pusheddata',
+            index_together=set([('source', 'dateUpdated'), ('dateUpdated', 'id')]),
+        ),
+    ]
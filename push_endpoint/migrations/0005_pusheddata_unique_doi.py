@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count, Max
+
+
+def drop_duplicates(apps, schema_editor):
+    """ Keep the latest row of every (source, doi) pushed more than once
+    """
+    PushedData = apps.get_model('push_endpoint', 'PushedData')
+    duplicated = (PushedData.objects.values('source', 'doi')
+                  .annotate(rows=Count('id'), last=Max('id'))
+                  .filter(rows__gt=1))
+    for group in duplicated:
+        PushedData.objects.filter(
+            source=group['source'], doi=group['doi'], id__lt=group['last']
+        ).delete()
+
+
+def keep_rows(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_endpoint', '0004_pusheddata_datemodified'),
+    ]
+
+    operations = [
+        # existing rows start without a hash and are rewritten once by
+        # their first upsert
+        migrations.AddField(
+            model_name='pusheddata',
+            name='contentHash',
+            field=models.CharField(default='', max_length=40, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(drop_duplicates, keep_rows),
+        migrations.AlterUniqueTogether(
+            name='pusheddata',
+            unique_together=set([('source', 'doi')]),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('push_endpoint', '0005_pusheddata_unique_doi'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingItem',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('position', models.PositiveIntegerField()),
+                ('payload', models.TextField()),
+                ('status', models.CharField(default=b'pending', max_length=10, choices=[(b'pending', b'Pending'), (b'inserted', b'Inserted'), (b'updated', b'Updated'), (b'unchanged', b'Unchanged'), (b'failed', b'Failed')])),
+                ('errors', models.TextField(blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='PushBatch',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('status', models.CharField(default=b'pending', max_length=10, db_index=True, choices=[(b'pending', b'Pending'), (b'processing', b'Processing'), (b'done', b'Done')])),
+                ('upsert', models.BooleanField(default=False)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_claimed', models.DateTimeField(null=True, blank=True)),
+                ('date_finished', models.DateTimeField(null=True, blank=True)),
+                ('source', models.ForeignKey(related_name='batches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AddField(
+            model_name='pendingitem',
+            name='batch',
+            field=models.ForeignKey(related_name='items', to='push_endpoint.PushBatch'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='pendingitem',
+            name='data',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='push_endpoint.PushedData', null=True),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='pendingitem',
+            index_together=set([('batch', 'status', 'position')]),
+        ),
+    ]
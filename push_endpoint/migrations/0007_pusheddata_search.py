@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from push_endpoint import search
+
+
+def create_index(apps, schema_editor):
+    search.create_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_endpoint', '0006_pushbatch'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
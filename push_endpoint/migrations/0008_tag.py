@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from push_endpoint.models import split_tags
+
+
+def index_existing_tags(apps, schema_editor):
+    PushedData = apps.get_model('push_endpoint', 'PushedData')
+    Tag = apps.get_model('push_endpoint', 'Tag')
+    tags = []
+    for pk, names in PushedData.objects.exclude(tags='').values_list('id', 'tags').iterator():
+        tags.extend(Tag(data_id=pk, name=name) for name in split_tags(names))
+        if len(tags) >= 5000:
+            Tag.objects.bulk_create(tags)
+            tags = []
+    Tag.objects.bulk_create(tags)
+
+
+def drop_tags(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_endpoint', '0007_pusheddata_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(max_length=200)),
+                ('data', models.ForeignKey(related_name='tag_set', to='push_endpoint.PushedData')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tag',
+            unique_together=set([('data', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='tag',
+            index_together=set([('name', 'data')]),
+        ),
+        migrations.RunPython(index_existing_tags, drop_tags),
+    ]
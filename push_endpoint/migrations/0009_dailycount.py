@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+from django.db.models import Count
+
+
+def count_existing_rows(apps, schema_editor):
+    PushedData = apps.get_model('push_endpoint', 'PushedData')
+    DailyCount = apps.get_model('push_endpoint', 'DailyCount')
+    rows = PushedData.objects.values_list('source', 'dateUpdated').annotate(count=Count('id'))
+    DailyCount.objects.bulk_create([
+        DailyCount(source_id=source_id, day=day, count=count) for source_id, day, count in rows.order_by()
+    ])
+
+
+def drop_counts(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('push_endpoint', '0008_tag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCount',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('day', models.DateField(db_index=True)),
+                ('count', models.IntegerField(default=0)),
+                ('source', models.ForeignKey(related_name='daily_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailycount',
+            unique_together=set([('source', 'day')]),
+        ),
+        migrations.RunPython(count_existing_rows, drop_counts),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import django.db.models.deletion
+from django.conf import settings
+
+
+def log_existing_rows(apps, schema_editor):
+    """ A create for every existing row, so syncing from 0 sees them all
+    """
+    PushedData = apps.get_model('push_endpoint', 'PushedData')
+    Change = apps.get_model('push_endpoint', 'Change')
+    changes = []
+    for pk, source_id in PushedData.objects.order_by('id').values_list('id', 'source').iterator():
+        changes.append(Change(action='create', data_id=pk, source_id=source_id))
+        if len(changes) >= 5000:
+            Change.objects.bulk_create(changes)
+            changes = []
+    Change.objects.bulk_create(changes)
+
+
+def drop_changes(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('push_endpoint', '0009_dailycount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('action', models.CharField(max_length=6, choices=[(b'create', b'Create'), (b'update', b'Update'), (b'delete', b'Delete')])),
+                ('data_id', models.IntegerField(db_index=True)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RunPython(log_existing_rows, drop_changes),
+    ]
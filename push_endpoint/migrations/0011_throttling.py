@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('push_endpoint', '0010_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceLimit',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('exempt', models.BooleanField(default=False)),
+                ('requests_per_second', models.FloatField(null=True, blank=True)),
+                ('request_burst', models.PositiveIntegerField(null=True, blank=True)),
+                ('items_per_second', models.FloatField(null=True, blank=True)),
+                ('item_burst', models.PositiveIntegerField(null=True, blank=True)),
+                ('doi_lookups_per_second', models.FloatField(null=True, blank=True)),
+                ('doi_lookup_burst', models.PositiveIntegerField(null=True, blank=True)),
+                ('source', models.OneToOneField(related_name='limit', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='ThrottleBucket',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('scope', models.CharField(max_length=11, choices=[(b'requests', b'Requests'), (b'items', b'Items'), (b'doi_lookups', b'DOI lookups')])),
+                ('tokens', models.FloatField()),
+                ('updated', models.FloatField()),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('source', models.ForeignKey(related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='throttlebucket',
+            unique_together=set([('source', 'scope')]),
+        ),
+        migrations.AddField(
+            model_name='pushbatch',
+            name='retry_after',
+            field=models.DateTimeField(null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,54 @@
+import calendar
+import hashlib
+
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+
+def fingerprint(*parts):
+    return hashlib.md5('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def not_modified(request, etag, last_modified):
+    """ Whether the client's copy, as described by If-None-Match or
+    If-Modified-Since, is still current
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag is not None and (etag in etags or '*' in etags)
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since and last_modified:
+        return last_modified <= if_modified_since
+
+    return False
+
+
+class ConditionalGetMixin(object):
+    """
+    Answer GETs with 304 Not Modified, before anything is serialized,
+    when the validators from get_validators() match the request
+    """
+    def get_validators(self):
+        """ Return (etag, last modified datetime), either may be None
+        """
+        raise NotImplementedError('.get_validators() must be implemented')
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        # HTTP dates only have whole seconds
+        last_modified = last_modified and calendar.timegm(last_modified.utctimetuple())
+
+        if not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        if etag:
+            response['ETag'] = quote_etag(etag)
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -1,13 +1,453 @@
-from django.db import models
+import json
+import time
+import hashlib
+
+from django.db import connections, models, transaction, IntegrityError
+from django.db.models import Count, F
+from django.utils import six, timezone
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete, post_migrate
+
+from push_endpoint import metrics
+from push_endpoint import response_cache
+from push_endpoint import search
+from push_endpoint.utils import chunks
+
+
+# the fields compared when a source re-pushes a DOI it already pushed
+HASHED_FIELDS = ('url', 'tags', 'title', 'serviceID', 'description', 'contributors')
+
+
+def content_hash(row):
+    """ Digest of a record's HASHED_FIELDS, row is a dict of field values
+    """
+    values = [six.text_type(row.get(field) or '') for field in HASHED_FIELDS]
+    return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+
+class PushedDataQuerySet(models.QuerySet):
+    def delete(self):
+        # post_delete is sent before the delete commits
+        with response_cache.bump_after():
+            super(PushedDataQuerySet, self).delete()
+    delete.alters_data = True
+    delete.queryset_only = True
 
 
 class PushedData(models.Model):
     url = models.URLField()
-    doi = models.TextField()
+    doi = models.TextField(db_index=True)
     tags = models.TextField(blank=True)
     title = models.TextField()
     serviceID = models.TextField()
     description = models.TextField(blank=True)
     contributors = models.TextField()
     dateUpdated = models.DateField(auto_now_add=True)
+    # bumped on every save, validators for conditional GETs
+    dateModified = models.DateTimeField(auto_now=True, db_index=True)
     source = models.ForeignKey('auth.User', related_name='data')
+    # content_hash() of the record, lets an upsert skip unchanged rows
+    contentHash = models.CharField(max_length=40, blank=True, default='')
+
+    objects = PushedDataQuerySet.as_manager()
+
+    class Meta:
+        # a source pushes each DOI once, re-pushes update the same row
+        unique_together = [('source', 'doi')]
+        index_together = [
+            # from/to range filters and keyset pagination
+            ('dateUpdated', 'id'),
+            # a source's data within a date range
+            ('source', 'dateUpdated'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.contentHash = content_hash(self.__dict__)
+        super(PushedData, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # post_delete is sent before the delete commits
+        with response_cache.bump_after():
+            super(PushedData, self).delete(*args, **kwargs)
+
+
+@receiver([post_save, post_delete], sender=PushedData)
+def invalidate_cached_lists(sender, **kwargs):
+    # post_save is sent after the save commits, deletes hold the bump back
+    # themselves, see PushedDataQuerySet
+    response_cache.bump_generation()
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    # any migration altering PushedData, even one generated later, rebuilds
+    # the table on sqlite and drops the search triggers with it
+    if sender.name == 'push_endpoint':
+        search.restore_triggers(connections[using])
+
+
+# longest tag kept, longer ones are cut
+TAG_LENGTH = 200
+
+
+def split_tags(tags):
+    """ The distinct normalized tags of a comma separated tags string
+    """
+    names = []
+    for name in (tags or '').split(','):
+        name = ' '.join(name.lower().split())[:TAG_LENGTH]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+class TagManager(models.Manager):
+    def sync(self, rows):
+        """ Replace the tags of PushedData rows, given (id, tags string)
+        pairs, with two queries per 500 rows
+        """
+        for batch in chunks(rows):
+            self.filter(data__in=[pk for pk, _ in batch]).delete()
+            self.bulk_create([
+                self.model(data_id=pk, name=name) for pk, tags in batch for name in split_tags(tags)
+            ])
+
+
+class Tag(models.Model):
+    """ One normalized tag of a PushedData row, so rows can be found and
+    counted by tag from an index instead of splitting every tags string
+    """
+    data = models.ForeignKey(PushedData, related_name='tag_set')
+    name = models.CharField(max_length=TAG_LENGTH)
+
+    objects = TagManager()
+
+    class Meta:
+        unique_together = [('data', 'name')]
+        index_together = [
+            # rows with a tag, and counts by tag
+            ('name', 'data'),
+        ]
+
+    def __unicode__(self):
+        return self.name
+
+
+@receiver(post_save, sender=PushedData)
+def index_tags(sender, instance, created, **kwargs):
+    if instance.tags or not created:
+        Tag.objects.sync([(instance.pk, instance.tags)])
+
+
+class DailyCountManager(models.Manager):
+    def add(self, deltas):
+        """ Apply {(source id, day): change in rows} to the rollups
+        """
+        for (source_id, day), delta in deltas.items():
+            counts = self.filter(source_id=source_id, day=day)
+            if counts.update(count=F('count') + delta) or delta < 0:
+                # a removal always follows the row's own addition
+                continue
+            try:
+                with transaction.atomic(using=self.db):
+                    self.create(source_id=source_id, day=day, count=delta)
+            except IntegrityError:
+                # another worker created the day first
+                counts.update(count=F('count') + delta)
+
+    def recount(self):
+        """ (source id, day, rows) of every source and day, counted from
+        PushedData from scratch
+        """
+        rows = PushedData.objects.using(self.db).values_list('source', 'dateUpdated').annotate(count=Count('id'))
+        return list(rows.order_by('dateUpdated', 'source'))
+
+    def rebuild(self):
+        """ Replace the rollups with a recount
+        """
+        with transaction.atomic(using=self.db):
+            rows = self.recount()
+            self.all().delete()
+            self.bulk_create([
+                self.model(source_id=source_id, day=day, count=count) for source_id, day, count in rows
+            ])
+
+
+class DailyCount(models.Model):
+    """ Number of PushedData rows per source per day, kept up to date on
+    every create and delete so statistics never aggregate PushedData
+    """
+    source = models.ForeignKey('auth.User', related_name='daily_counts')
+    day = models.DateField(db_index=True)
+    count = models.IntegerField(default=0)
+
+    objects = DailyCountManager()
+
+    class Meta:
+        unique_together = [('source', 'day')]
+
+
+@receiver(post_save, sender=PushedData)
+def count_created(sender, instance, created, **kwargs):
+    if created:
+        DailyCount.objects.add({(instance.source_id, instance.dateUpdated): 1})
+
+
+@receiver(post_delete, sender=PushedData)
+def count_deleted(sender, instance, **kwargs):
+    DailyCount.objects.add({(instance.source_id, instance.dateUpdated): -1})
+
+
+# any fixed number, names the postgres advisory lock taken to record changes
+CHANGE_LOCK = 4243
+
+
+class ChangeManager(models.Manager):
+    def record(self, action, rows):
+        """ Append a change for every (PushedData id, source id) in rows
+        """
+        if not rows:
+            return
+        now = timezone.now()
+        connection = connections[self.db]
+        with transaction.atomic(using=self.db):
+            if connection.vendor == 'postgresql':
+                # hold the lock to commit, so sequence numbers are taken in
+                # commit order and a reader that has seen change n never
+                # finds a smaller one appear later. sqlite writers are
+                # serialized already.
+                connection.cursor().execute('SELECT pg_advisory_xact_lock(%s)', [CHANGE_LOCK])
+            self.bulk_create([
+                self.model(action=action, data_id=data_id, source_id=source_id, date=now)
+                for data_id, source_id in rows
+            ])
+        metrics.count_pushed(action, len(rows))
+
+    def record_query(self, action, queryset):
+        """ Append a change for every row of a PushedData queryset with one
+        INSERT ... SELECT, the rows are never fetched
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        select, params = queryset.using(self.db).order_by().values_list('id', 'source').query.sql_with_params()
+        date = self.model._meta.get_field('date').get_db_prep_save(timezone.now(), connection)
+        with transaction.atomic(using=self.db):
+            if connection.vendor == 'postgresql':
+                connection.cursor().execute('SELECT pg_advisory_xact_lock(%s)', [CHANGE_LOCK])
+            cursor = connection.cursor()
+            cursor.execute(
+                'INSERT INTO {table} ({action}, {date}, {data_id}, {source_id}) '
+                'SELECT %s, %s, rows.{id}, rows.{source_id} FROM ({select}) rows'.format(
+                    table=qn(self.model._meta.db_table), action=qn('action'), date=qn('date'),
+                    data_id=qn('data_id'), source_id=qn('source_id'), id=qn('id'), select=select
+                ),
+                [action, date] + list(params)
+            )
+        metrics.count_pushed(action, cursor.rowcount)
+
+
+class Change(models.Model):
+    """ Append-only log of every create, update and delete of PushedData,
+    the id is the sequence number consumers sync from. Deletes stay on as
+    tombstones.
+    """
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    ACTION_CHOICES = (
+        (CREATE, 'Create'),
+        (UPDATE, 'Update'),
+        (DELETE, 'Delete'),
+    )
+
+    action = models.CharField(max_length=6, choices=ACTION_CHOICES)
+    # not a foreign key, the row is gone once it is deleted
+    data_id = models.IntegerField(db_index=True)
+    source = models.ForeignKey('auth.User', related_name='+', null=True, on_delete=models.SET_NULL)
+    date = models.DateTimeField(default=timezone.now)
+
+    objects = ChangeManager()
+
+
+@receiver(post_save, sender=PushedData)
+def record_save(sender, instance, created, **kwargs):
+    Change.objects.record(Change.CREATE if created else Change.UPDATE, [(instance.pk, instance.source_id)])
+
+
+@receiver(post_delete, sender=PushedData)
+def record_delete(sender, instance, **kwargs):
+    Change.objects.record(Change.DELETE, [(instance.pk, instance.source_id)])
+
+
+class DOIResolution(models.Model):
+    """ Shared cache of DOI lookups against the DOI resolver, so every
+    worker process can skip the network for DOIs it has already seen
+    """
+    doi = models.TextField(unique=True)
+    resolves = models.BooleanField(default=False)
+    date_checked = models.DateTimeField()
+    last_used = models.DateTimeField(db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+    misses = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return self.doi
+
+
+class DOICacheTotals(models.Model):
+    """ Hits and misses of the DOI cache entries evicted so far, in a
+    single row, so the stats still count them once the entries are gone
+    """
+    hits = models.BigIntegerField(default=0)
+    misses = models.BigIntegerField(default=0)
+
+
+class PushBatch(models.Model):
+    """ A push accepted with ?async=true, its items are validated and
+    written later by the process_pushes command
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+    )
+
+    source = models.ForeignKey('auth.User', related_name='batches')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    upsert = models.BooleanField(default=False)
+    date_created = models.DateTimeField(auto_now_add=True)
+    # set when a worker claims the batch and refreshed after every chunk,
+    # a batch left processing for too long is claimed again
+    date_claimed = models.DateTimeField(null=True, blank=True)
+    # set when the source ran out of DOI lookups, no worker claims the
+    # batch again before then
+    retry_after = models.DateTimeField(null=True, blank=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return '{} {}'.format(self.pk, self.status)
+
+
+class PendingItem(models.Model):
+    """ One record of a PushBatch, stored as pushed until it is validated
+    """
+    PENDING = 'pending'
+    INSERTED = 'inserted'
+    UPDATED = 'updated'
+    UNCHANGED = 'unchanged'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (INSERTED, 'Inserted'),
+        (UPDATED, 'Updated'),
+        (UNCHANGED, 'Unchanged'),
+        (FAILED, 'Failed'),
+    )
+
+    batch = models.ForeignKey(PushBatch, related_name='items')
+    # index of the record in the pushed list
+    position = models.PositiveIntegerField()
+    payload = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # JSON validation errors of a failed item
+    errors = models.TextField(blank=True)
+    data = models.ForeignKey(PushedData, null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        index_together = [
+            # a batch's pending items in order, and its per-status counts
+            ('batch', 'status', 'position'),
+        ]
+
+
+class SourceLimit(models.Model):
+    """ Per-source overrides of PUSHED_DATA_THROTTLE_RATES, set in the
+    admin. An empty rate or burst falls back to the setting, a 0 blocks
+    the source.
+    """
+    source = models.OneToOneField('auth.User', related_name='limit')
+    # no throttling at all for this source
+    exempt = models.BooleanField(default=False)
+    requests_per_second = models.FloatField(null=True, blank=True)
+    request_burst = models.PositiveIntegerField(null=True, blank=True)
+    items_per_second = models.FloatField(null=True, blank=True)
+    item_burst = models.PositiveIntegerField(null=True, blank=True)
+    doi_lookups_per_second = models.FloatField(null=True, blank=True)
+    doi_lookup_burst = models.PositiveIntegerField(null=True, blank=True)
+
+    def __unicode__(self):
+        return six.text_type(self.source)
+
+
+# attempts at taking tokens before a bucket that keeps changing under us
+# counts as empty
+BUCKET_RETRIES = 5
+
+
+class ThrottleBucketManager(models.Manager):
+    def take(self, source, scope, cost, rate, burst):
+        """ Take cost tokens from source's bucket for scope, refilled at
+        rate tokens a second up to burst. Return None when they were taken,
+        else the seconds until they will be there.
+
+        A cost over burst is let through once the bucket is full and leaves
+        it in debt, so a push larger than the burst is paced, not refused
+        forever. Every process shares the buckets through the database: the
+        write is conditional on the version read, so concurrent takes never
+        spend the same tokens twice.
+        """
+        needed = min(cost, burst)
+        for _ in range(BUCKET_RETRIES):
+            bucket = self.bucket(source, scope, burst)
+            now = time.time()
+            tokens = min(burst, bucket.tokens + max(now - bucket.updated, 0) * rate)
+            if tokens < needed:
+                return (needed - tokens) / rate
+
+            taken = self.filter(pk=bucket.pk, version=bucket.version).update(
+                tokens=tokens - cost, updated=now, version=F('version') + 1
+            )
+            if taken:
+                return None
+        return 1.0 / rate
+
+    def bucket(self, source, scope, burst):
+        try:
+            return self.get(source=source, scope=scope)
+        except self.model.DoesNotExist:
+            pass
+        try:
+            with transaction.atomic(using=self.db):
+                return self.create(source=source, scope=scope, tokens=burst, updated=time.time())
+        except IntegrityError:
+            # another process created it first
+            return self.get(source=source, scope=scope)
+
+
+class ThrottleBucket(models.Model):
+    """ Token bucket of one source for one kind of load, see throttling
+    """
+    REQUESTS = 'requests'
+    ITEMS = 'items'
+    DOI_LOOKUPS = 'doi_lookups'
+    SCOPE_CHOICES = (
+        (REQUESTS, 'Requests'),
+        (ITEMS, 'Items'),
+        (DOI_LOOKUPS, 'DOI lookups'),
+    )
+
+    source = models.ForeignKey('auth.User', related_name='+')
+    scope = models.CharField(max_length=11, choices=SCOPE_CHOICES)
+    # tokens left when last taken from, below zero after a large push
+    tokens = models.FloatField()
+    # unix time of the last take
+    updated = models.FloatField()
+    version = models.PositiveIntegerField(default=0)
+
+    objects = ThrottleBucketManager()
+
+    class Meta:
+        unique_together = [('source', 'scope')]
@@ -0,0 +1,11 @@
+## content negotiation of views that pick their own response type
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class IgnoreClientContentNegotiation(DefaultContentNegotiation):
+    """ For views that stream a body of their own content type instead of
+    rendering one, so no Accept header can turn them down with a 406.
+    Errors are rendered with the view's first renderer.
+    """
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
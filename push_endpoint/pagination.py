@@ -0,0 +1,86 @@
+## keyset pagination for pushed data
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ParseError
+from rest_framework.templatetags.rest_framework import replace_query_param
+
+CURSOR_PARAM = 'cursor'
+PAGE_SIZE_PARAM = 'page_size'
+
+PAGE_SIZE = getattr(settings, 'PUSHED_DATA_PAGE_SIZE', 10)
+MAX_PAGE_SIZE = getattr(settings, 'PUSHED_DATA_MAX_PAGE_SIZE', 1000)
+
+ORDERING = ('dateUpdated', 'id')
+
+
+def encode_cursor(date, pk):
+    """ Opaque continuation token for the row a page ended on
+    """
+    position = '{}|{}'.format(date.isoformat(), pk)
+    return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(token):
+    try:
+        position = base64.urlsafe_b64decode(token.encode('ascii')).decode('ascii')
+        date, pk = position.split('|')
+        date, pk = parse_date(date), int(pk)
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ParseError('Invalid cursor')
+    if date is None:
+        raise ParseError('Invalid cursor')
+    return date, pk
+
+
+def after(queryset, date, pk):
+    """ Rows that sort after (date, pk). The leading dateUpdated__gte gives
+    the database a range to seek on the (dateUpdated, id) index, which the
+    bare OR of the two cases does not.
+    """
+    return queryset.filter(dateUpdated__gte=date).filter(Q(dateUpdated__gt=date) | Q(id__gt=pk))
+
+
+def get_page_size(request):
+    try:
+        page_size = int(request.query_params[PAGE_SIZE_PARAM])
+    except (KeyError, ValueError):
+        return PAGE_SIZE
+    if page_size < 1:
+        return PAGE_SIZE
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def object_position(obj):
+    return obj.dateUpdated, obj.pk
+
+
+def paginate_keyset(queryset, request, position=object_position):
+    """ Return one page of queryset ordered by (dateUpdated, id) starting
+    after the request's cursor, and the link to the next page or None.
+    position gives the (dateUpdated, id) of a row of the queryset.
+
+    The cursor turns into a range condition on the ordering columns, so
+    every page costs the same however deep the client is.
+    """
+    page_size = get_page_size(request)
+    queryset = queryset.order_by(*ORDERING)
+
+    token = request.query_params.get(CURSOR_PARAM)
+    if token:
+        date, pk = decode_cursor(token)
+        queryset = after(queryset, date, pk)
+
+    # one extra row tells us whether there is a next page
+    page = list(queryset[:page_size + 1])
+    if len(page) <= page_size:
+        return page, None
+
+    page = page[:page_size]
+    next_url = replace_query_param(
+        request.build_absolute_uri(), CURSOR_PARAM, encode_cursor(*position(page[-1]))
+    )
+    return page, next_url
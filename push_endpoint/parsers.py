@@ -0,0 +1,21 @@
+## MessagePack request bodies, see renderers
+import msgpack
+from django.utils import six
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+
+from push_endpoint.renderers import MessagePackRenderer
+
+
+class MessagePackParser(parsers.BaseParser):
+    """ Parses a MessagePack body into what JSONParser gives for the same
+    data in JSON
+    """
+    media_type = MessagePackRenderer.media_type
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - %s' % six.text_type(exc))
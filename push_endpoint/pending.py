@@ -0,0 +1,198 @@
+## accept-then-validate queue of pushed data
+import json
+import logging
+import datetime
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+from push_endpoint import ingest, response_cache
+from push_endpoint.models import PendingItem, PushBatch
+
+logger = logging.getLogger(__name__)
+
+# items validated and written together by a worker
+CHUNK_SIZE = getattr(settings, 'PUSHED_DATA_QUEUE_CHUNK_SIZE', 500)
+# seconds before a batch claimed by a worker that stopped is claimed again
+CLAIM_TIMEOUT = getattr(settings, 'PUSHED_DATA_QUEUE_CLAIM_TIMEOUT', 600)
+
+
+class LostClaim(Exception):
+    """ The batch was reclaimed by another worker after its claim went stale
+    """
+
+
+class WorkerView(object):
+    """ Stands in for the view in the serializer context, BulkSerializerMixin
+    reads view.request and a queued push is validated outside a request
+    """
+    request = None
+
+
+def enqueue(records, source, upsert=False):
+    """ Store a pushed list of records as they are, without validating
+    them, and return the new PushBatch
+    """
+    with transaction.atomic():
+        batch = PushBatch.objects.create(source=source, upsert=upsert)
+        PendingItem.objects.bulk_create([
+            PendingItem(batch=batch, position=position, payload=json.dumps(record))
+            for position, record in enumerate(records)
+        ], batch_size=ingest.BATCH_SIZE)
+    return batch
+
+
+def claimable():
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=CLAIM_TIMEOUT)
+    return (
+        Q(status=PushBatch.PENDING) & (Q(retry_after__isnull=True) | Q(retry_after__lte=now)) |
+        Q(status=PushBatch.PROCESSING, date_claimed__lt=stale)
+    )
+
+
+def claim_batch():
+    """ Take the oldest batch no worker is processing, or return None.
+    The claim is a conditional UPDATE, so concurrent workers never take
+    the same batch.
+    """
+    for pk in PushBatch.objects.filter(claimable()).order_by('pk').values_list('pk', flat=True)[:10]:
+        claimed = PushBatch.objects.filter(claimable(), pk=pk).update(
+            status=PushBatch.PROCESSING, date_claimed=timezone.now()
+        )
+        if claimed:
+            return PushBatch.objects.select_related('source').get(pk=pk)
+    return None
+
+
+def renew_claim(batch, **fields):
+    """ Compare-and-set the claim of batch: update it with fields and a new
+    date_claimed unless another worker reclaimed it since we did, raising
+    LostClaim then
+    """
+    now = timezone.now()
+    renewed = PushBatch.objects.filter(
+        pk=batch.pk, status=PushBatch.PROCESSING, date_claimed=batch.date_claimed
+    ).update(date_claimed=now, **fields)
+    if not renewed:
+        raise LostClaim(batch.pk)
+    batch.date_claimed = now
+
+
+def process_chunk(batch, items, workers=None):
+    """ Validate and write one chunk of a batch's pending items and record
+    the outcome of each
+    """
+    records = []
+    outcomes = []
+    for item in items:
+        record, errors = ingest.parse_line(item.payload)
+        if errors:
+            outcomes.append((item, PendingItem.FAILED, errors))
+        else:
+            records.append((item, record))
+
+    valid, failed = ingest.validate_records(
+        records, batch.source, {'view': WorkerView()}, upsert=batch.upsert, workers=workers
+    )
+    outcomes.extend((item, PendingItem.FAILED, errors) for item, errors in failed)
+
+    claimed = batch.date_claimed
+    try:
+        # the writes bump the cache generation, which must wait for the commit
+        with response_cache.bump_after(), transaction.atomic():
+            # checked before writing: once a stale claim was taken over only
+            # the new one writes, and the old worker stops here
+            renew_claim(batch)
+            rows = [row for _, row in valid]
+            if batch.upsert:
+                written = ingest.upsert_rows(rows, batch.source)
+            else:
+                written = [(PendingItem.INSERTED, obj.pk) for obj in ingest.bulk_insert(rows, batch.source)]
+            outcomes.extend((item, status, pk) for (item, _), (status, pk) in zip(valid, written))
+
+            for item, status, result in outcomes:
+                if status == PendingItem.FAILED:
+                    PendingItem.objects.filter(pk=item.pk).update(status=status, errors=json.dumps(result))
+                else:
+                    PendingItem.objects.filter(pk=item.pk).update(status=status, data=result)
+    except Exception:
+        # the renewal was rolled back with the writes
+        batch.date_claimed = claimed
+        raise
+
+
+def fail_chunk(batch, items, exc):
+    """ Mark the items of a chunk that could not be written failed, with
+    the error, so a chunk that keeps failing does not hold the batch up
+    """
+    logger.exception('Chunk of batch {} failed'.format(batch.pk))
+    errors = json.dumps({'non_field_errors': ['Could not be written: {}'.format(exc)]})
+    with transaction.atomic():
+        renew_claim(batch)
+        PendingItem.objects.filter(pk__in=[item.pk for item in items]).update(
+            status=PendingItem.FAILED, errors=errors
+        )
+
+
+def process_batch(batch, workers=None, chunk_size=None):
+    """ Work through a claimed batch chunk_size items at a time, resolving
+    at most workers DOIs concurrently, and mark it done.
+
+    When the source runs out of DOI lookups the batch goes back to pending
+    until its budget has refilled, the chunks written so far stay done.
+    A worker whose claim went stale and was taken over stops. A chunk
+    that fails otherwise, say on a DOI a concurrent push inserted, has its
+    items marked failed and the batch goes on.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    try:
+        while True:
+            items = list(batch.items.filter(status=PendingItem.PENDING).order_by('position')[:chunk_size])
+            if not items:
+                break
+            try:
+                process_chunk(batch, items, workers)
+            except Throttled as exc:
+                renew_claim(
+                    batch, status=PushBatch.PENDING,
+                    retry_after=timezone.now() + datetime.timedelta(seconds=exc.wait)
+                )
+                return
+            except LostClaim:
+                raise
+            except Exception as exc:
+                fail_chunk(batch, items, exc)
+
+        renew_claim(batch, status=PushBatch.DONE, date_finished=timezone.now())
+    except LostClaim:
+        # the worker that took the batch over finishes it
+        pass
+
+
+def batch_status(batch):
+    """ Progress of a batch: item counts by status and the errors of the
+    failed items, by their position in the push
+    """
+    counts = OrderedDict((status, 0) for status, _ in PendingItem.STATUS_CHOICES)
+    for status, count in batch.items.values_list('status').annotate(count=Count('id')):
+        counts[status] = count
+
+    failed = batch.items.filter(status=PendingItem.FAILED).order_by('position')
+    return OrderedDict([
+        ('id', batch.pk),
+        ('status', batch.status),
+        ('upsert', batch.upsert),
+        ('date_created', batch.date_created),
+        ('date_finished', batch.date_finished),
+        ('items', sum(counts.values())),
+        ('counts', counts),
+        ('errors', [
+            OrderedDict([('position', position), ('errors', json.loads(errors))])
+            for position, errors in failed.values_list('position', 'errors')
+        ])
+    ])
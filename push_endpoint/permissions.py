@@ -12,5 +12,6 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        # Write permissions are only allowed to the source of the data
-        return obj.source == request.user
+        # Write permissions are only allowed to the source of the data,
+        # compare ids so the source does not have to be fetched
+        return obj.source_id == request.user.pk
@@ -0,0 +1,179 @@
+## per-request timing of SQL, outbound HTTP and the view
+import os
+import re
+import time
+import random
+import cProfile
+import datetime
+import threading
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from django.db.backends import BaseDatabaseWrapper, utils
+from django.utils.six.moves.urllib.parse import urlparse
+
+# a cProfile dump of a share of the requests is written here when they
+# take longer than PROFILING_THRESHOLD milliseconds, None turns it off
+PROFILING_DIR = getattr(settings, 'PROFILING_DIR', None)
+PROFILING_SAMPLE_RATE = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.01)
+PROFILING_THRESHOLD = getattr(settings, 'PROFILING_THRESHOLD', 1000)
+
+_local = threading.local()
+_installed = []
+
+
+class Profile(object):
+    """ What one request spent its time on. SQL and HTTP are added by the
+    hooks install() sets up, from any thread the profile is active on.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.view_start = None
+        self.end = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        # host -> [calls, seconds]
+        self.http = OrderedDict()
+        self.profiler = None
+
+    def add_sql(self, seconds):
+        with self.lock:
+            self.sql_count += 1
+            self.sql_time += seconds
+
+    def add_http(self, host, seconds):
+        with self.lock:
+            calls = self.http.setdefault(host, [0, 0.0])
+            calls[0] += 1
+            calls[1] += seconds
+
+    def start_profiler(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def finish(self):
+        self.end = time.time()
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    @property
+    def total(self):
+        return (self.end or time.time()) - self.start
+
+    def server_timing(self):
+        """ The Server-Timing header value, durations in milliseconds
+        """
+        metrics = ['db;dur={:.1f};desc="{} queries"'.format(self.sql_time * 1000, self.sql_count)]
+        for host, (calls, seconds) in self.http.items():
+            metrics.append('http;dur={:.1f};desc="{} ({} calls)"'.format(seconds * 1000, host, calls))
+        if self.view_start is not None:
+            metrics.append('view;dur={:.1f}'.format(((self.end or time.time()) - self.view_start) * 1000))
+        metrics.append('total;dur={:.1f}'.format(self.total * 1000))
+        return ', '.join(metrics)
+
+    def dump(self, request):
+        """ Write the cProfile stats to PROFILING_DIR when this request was
+        sampled and slower than PROFILING_THRESHOLD, returning the path
+        """
+        if self.profiler is None or self.total * 1000 < PROFILING_THRESHOLD:
+            return None
+        if not os.path.isdir(PROFILING_DIR):
+            os.makedirs(PROFILING_DIR)
+        name = '{:%Y%m%d-%H%M%S-%f}-{}ms-{}-{}.prof'.format(
+            datetime.datetime.now(), int(self.total * 1000), request.method,
+            re.sub(r'[^\w-]+', '_', request.path).strip('_') or 'root'
+        )
+        path = os.path.join(PROFILING_DIR, name)
+        self.profiler.dump_stats(path)
+        return path
+
+
+def sampled():
+    return bool(PROFILING_DIR) and random.random() < PROFILING_SAMPLE_RATE
+
+
+def current():
+    return getattr(_local, 'profile', None)
+
+
+def activate(profile):
+    _local.profile = profile
+
+
+def deactivate():
+    _local.profile = None
+
+
+def propagate(func):
+    """ Wrap func so it records into the calling thread's profile when it
+    runs on another thread, like the DOI lookups in a pool
+    """
+    profile = current()
+
+    def wrapper(*args, **kwargs):
+        previous = current()
+        activate(profile)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            activate(previous)
+    return wrapper
+
+
+class TimedCursor(utils.CursorWrapper):
+    def __init__(self, cursor, db, profile):
+        super(TimedCursor, self).__init__(cursor, db)
+        self.profile = profile
+
+    def timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.profile.add_sql(time.time() - start)
+
+    def callproc(self, procname, params=None):
+        return self.timed(self.cursor.callproc, procname, params)
+
+    def execute(self, sql, params=None):
+        return self.timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self.timed(self.cursor.executemany, sql, param_list)
+
+
+def install():
+    """ Hook the database cursors and requests' sessions so they record
+    into the active profile. Costs an attribute lookup when none is.
+    """
+    if _installed:
+        return
+    _installed.append(True)
+
+    cursor = BaseDatabaseWrapper.cursor
+
+    def timed_cursor(self):
+        wrapped = cursor(self)
+        profile = current()
+        if profile is None:
+            return wrapped
+        return TimedCursor(wrapped, self, profile)
+    BaseDatabaseWrapper.cursor = timed_cursor
+
+    send = requests.Session.send
+
+    def timed_send(self, request, **kwargs):
+        profile = current()
+        # redirects are sent from inside the first send, count them with it
+        if profile is None or getattr(_local, 'sending', False):
+            return send(self, request, **kwargs)
+        _local.sending = True
+        start = time.time()
+        try:
+            return send(self, request, **kwargs)
+        finally:
+            _local.sending = False
+            profile.add_http(urlparse(request.url).netloc, time.time() - start)
+    requests.Session.send = timed_send
@@ -0,0 +1,22 @@
+## MessagePack, a compact binary alternative to JSON on the push API
+import msgpack
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """ Renders the same representation as JSONRenderer as MessagePack.
+    Dates and other values JSON has no type for are turned into the same
+    strings JSONEncoder gives them.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    encoder_class = encoders.JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # every string goes out as a MessagePack str, JSON has no bytes
+        return msgpack.packb(data, default=self.encoder_class().default, use_bin_type=False)
@@ -0,0 +1,115 @@
+## write-invalidated cache of rendered DataList responses
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from push_endpoint import routers
+
+# any configured cache works, use a shared backend (file, memcached) when
+# running more than one worker process so they all see the same generation
+CACHE_ALIAS = getattr(settings, 'PUSHED_DATA_CACHE', 'default')
+TIMEOUT = getattr(settings, 'PUSHED_DATA_CACHE_TIMEOUT', 300)
+# the browsable API embeds the user and a CSRF token, never cache it
+CACHEABLE_FORMATS = getattr(settings, 'PUSHED_DATA_CACHE_FORMATS', ('json', 'msgpack'))
+
+GENERATION_KEY = 'pushed_data:generation'
+HITS_KEY = 'pushed_data:hits'
+MISSES_KEY = 'pushed_data:misses'
+
+_local = threading.local()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def generation():
+    """ Current generation of PushedData, part of every cache key
+    """
+    cache = get_cache()
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # if the counter was evicted, restart beyond any value it reached
+        cache.add(GENERATION_KEY, int(time.time() * 1000000), None)
+        value = cache.get(GENERATION_KEY)
+    return value
+
+
+def bump_generation():
+    """ Invalidate every cached response, called on any PushedData write.
+    Inside bump_after() the bump waits until the block exits.
+    """
+    if getattr(_local, 'depth', 0):
+        _local.held = True
+        return
+    try:
+        get_cache().incr(GENERATION_KEY)
+    except ValueError:
+        generation()
+
+
+@contextmanager
+def bump_after():
+    """ Hold back the bumps of the writes made in the block and make one
+    when it exits. Wrap the outermost transaction in it: a list read
+    between a bump and the commit would cache the old rows under the new
+    generation until the timeout.
+    """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        if not _local.depth and getattr(_local, 'held', False):
+            _local.held = False
+            bump_generation()
+
+
+def increment(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def make_key(request):
+    """ Cache key for a list request: the generation, the host (links are
+    absolute), the renderer format, the normalized query params and the
+    database read from, so a lagging replica's page never reaches a client
+    pinned to the primary
+    """
+    params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+    parts = repr((request.get_host(), request.accepted_renderer.format, params, routers.read_alias()))
+    return 'pushed_data:list:{}:{}'.format(generation(), hashlib.md5(parts.encode('utf-8')).hexdigest())
+
+
+def lookup(key):
+    """ Return (content, content type) for a cached response or None
+    """
+    cached = get_cache().get(key)
+    increment(MISSES_KEY if cached is None else HITS_KEY)
+    return cached
+
+
+def store(key, response):
+    get_cache().set(key, (response.content, response['Content-Type']), TIMEOUT)
+
+
+def stats():
+    cache = get_cache()
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    lookups = hits + misses
+
+    return {
+        'generation': generation(),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': float(hits) / lookups if lookups else 0.0
+    }
@@ -0,0 +1,131 @@
+## read replica routing with read-your-writes pinning
+import time
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+# aliases in DATABASES holding copies of the primary, 'default'. Reads of
+# safe-method requests go to one of them, nothing else does
+REPLICAS = getattr(settings, 'DATABASE_REPLICAS', [])
+# seconds a client reads from the primary after it wrote
+PIN_SECONDS = getattr(settings, 'DATABASE_PIN_SECONDS', 10)
+
+# tables whose writes do not pin the client: a session saved during a GET,
+# and the last_login stamped on a user, are bookkeeping rather than data
+# the client reads back. They still go to the primary.
+UNPINNED_TABLES = getattr(settings, 'DATABASE_UNPINNED_TABLES', ('django_session', 'auth_user'))
+
+PRIMARY = DEFAULT_DB_ALIAS
+# the pin is sent back in both, browsers keep the cookie and API clients
+# can echo the header. Its value is the time the pin runs out.
+PIN_COOKIE = 'primary_pin'
+PIN_HEADER = 'X-Primary-Pin'
+
+_local = threading.local()
+
+
+class RequestState(object):
+    """ Where the reads of one request go: a replica chosen for the whole
+    request, or the primary once the request has written
+    """
+    def __init__(self, replica):
+        self.replica = replica
+        self.wrote = False
+
+
+def pinned(request, now=None):
+    """ Whether a client wrote recently enough that it must read from the
+    primary. Pins further off than PIN_SECONDS are not honoured.
+    """
+    now = now or time.time()
+    for value in (request.COOKIES.get(PIN_COOKIE), request.META.get('HTTP_X_PRIMARY_PIN')):
+        try:
+            until = float(value)
+        except (TypeError, ValueError):
+            continue
+        if now < until <= now + PIN_SECONDS:
+            return True
+    return False
+
+
+def begin(request):
+    """ Route the reads of request until end(). Only safe-method requests of
+    clients that are not pinned read from a replica.
+    """
+    replica = None
+    if REPLICAS and request.method in SAFE_METHODS and not pinned(request):
+        replica = random.choice(REPLICAS)
+    _local.state = RequestState(replica)
+    return _local.state
+
+
+def end():
+    _local.state = None
+
+
+def current():
+    return getattr(_local, 'state', None)
+
+
+def activate(state):
+    _local.state = state
+
+
+def read_alias():
+    """ The alias the reads of the current request go to
+    """
+    state = current()
+    if not REPLICAS or state is None or state.replica is None or state.wrote:
+        return PRIMARY
+    return state.replica
+
+
+def bind(state, content):
+    """ Iterate content, a streamed response body, with the reads routed as
+    they were for its request
+    """
+    content = iter(content)
+    while True:
+        previous = current()
+        activate(state)
+        try:
+            chunk = next(content)
+        except StopIteration:
+            return
+        finally:
+            activate(previous)
+        yield chunk
+
+
+class ReplicaRouter(object):
+    """
+    Send the reads of safe-method requests to a replica and everything
+    else to the primary. Reads outside a request, in management commands
+    and queue workers, also go to the primary. A write pins the rest of
+    the request to the primary unless it is to one of UNPINNED_TABLES.
+    Does nothing while DATABASE_REPLICAS is empty.
+    """
+    def db_for_read(self, model, **hints):
+        if not REPLICAS:
+            return None
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        if not REPLICAS:
+            return None
+        state = current()
+        if state is not None and model._meta.db_table not in UNPINNED_TABLES:
+            # the rest of the request reads what it wrote
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not REPLICAS:
+            return None
+        databases = [PRIMARY] + list(REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,181 @@
+## full-text search over pushed data
+import re
+import operator
+from functools import reduce
+
+from django.db import connections
+from django.db.models import Q
+from rest_framework.templatetags.rest_framework import replace_query_param
+
+from push_endpoint import pagination
+
+QUERY_PARAM = 'q'
+PAGE_PARAM = 'page'
+
+TABLE = 'push_endpoint_pusheddata'
+INDEX = 'push_endpoint_pusheddata_search'
+SEARCH_FIELDS = ('title', 'description', 'contributors', 'tags')
+
+# sqlite: an FTS5 table over the columns, with PushedData as its external
+# content so the text is not stored twice. Triggers keep it in step with
+# every write, bulk_create and update() included. sqlite rebuilds a table
+# to alter it, which drops its triggers, so they are put back after every
+# migrate, see restore_triggers().
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE {index} USING fts5("
+    "title, description, contributors, tags, content='{table}', content_rowid='id')",
+    "INSERT INTO {index}({index}) VALUES ('rebuild')",
+]
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {index}(rowid, title, description, contributors, tags) "
+    "VALUES (new.id, new.title, new.description, new.contributors, new.tags); END",
+    "CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {index}({index}, rowid, title, description, contributors, tags) "
+    "VALUES ('delete', old.id, old.title, old.description, old.contributors, old.tags); END",
+    "CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF title, description, contributors, tags "
+    "ON {table} BEGIN "
+    "INSERT INTO {index}({index}, rowid, title, description, contributors, tags) "
+    "VALUES ('delete', old.id, old.title, old.description, old.contributors, old.tags); "
+    "INSERT INTO {index}(rowid, title, description, contributors, tags) "
+    "VALUES (new.id, new.title, new.description, new.contributors, new.tags); END",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS {index}_insert",
+    "DROP TRIGGER IF EXISTS {index}_delete",
+    "DROP TRIGGER IF EXISTS {index}_update",
+    "DROP TABLE IF EXISTS {index}",
+]
+# bm25 weights of title, description, contributors and tags
+SQLITE_RANK = 'bm25({index}, 4.0, 1.0, 2.0, 2.0)'
+
+# postgres: a weighted tsvector column set by a trigger, under a GIN index
+POSTGRES_INDEX = [
+    "ALTER TABLE {table} ADD COLUMN search_vector tsvector",
+    "CREATE INDEX {index} ON {table} USING gin(search_vector)",
+]
+POSTGRES_TRIGGERS = [
+    "CREATE OR REPLACE FUNCTION {index}_update() RETURNS trigger AS $$ BEGIN "
+    "NEW.search_vector := "
+    "setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(NEW.contributors, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(NEW.tags, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C'); "
+    "RETURN NEW; END $$ LANGUAGE plpgsql",
+    "DROP TRIGGER IF EXISTS {index}_update ON {table}",
+    "CREATE TRIGGER {index}_update BEFORE INSERT OR UPDATE OF title, description, contributors, tags "
+    "ON {table} FOR EACH ROW EXECUTE PROCEDURE {index}_update()",
+]
+POSTGRES_BACKFILL = [
+    "UPDATE {table} SET title = title",
+]
+POSTGRES_DROP = [
+    "DROP TRIGGER IF EXISTS {index}_update ON {table}",
+    "DROP FUNCTION IF EXISTS {index}_update()",
+    "ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector",
+]
+POSTGRES_RANK = "ts_rank_cd(search_vector, plainto_tsquery('english', %s))"
+
+
+def execute(connection, statements):
+    cursor = connection.cursor()
+    for statement in statements:
+        cursor.execute(statement.format(index=INDEX, table=TABLE))
+
+
+def create_triggers(connection):
+    """ (Re)create the triggers that keep the index in step with writes
+    """
+    if connection.vendor == 'sqlite':
+        execute(connection, SQLITE_TRIGGERS)
+    elif connection.vendor == 'postgresql':
+        execute(connection, POSTGRES_TRIGGERS)
+
+
+def restore_triggers(connection):
+    """ Recreate the sqlite triggers a rebuild of PushedData dropped, if
+    there is an index. postgres keeps triggers when a table is altered.
+    """
+    if connection.vendor == 'sqlite' and INDEX in connection.introspection.table_names():
+        execute(connection, SQLITE_TRIGGERS)
+
+
+def create_index(connection):
+    """ Build the index over the existing rows and keep it in step
+    """
+    if connection.vendor == 'sqlite':
+        execute(connection, SQLITE_INDEX + SQLITE_TRIGGERS)
+    elif connection.vendor == 'postgresql':
+        execute(connection, POSTGRES_INDEX + POSTGRES_TRIGGERS + POSTGRES_BACKFILL)
+
+
+def drop_index(connection):
+    if connection.vendor == 'sqlite':
+        execute(connection, SQLITE_DROP)
+    elif connection.vendor == 'postgresql':
+        execute(connection, POSTGRES_DROP)
+
+
+def terms(query):
+    return re.findall(r'\w+', query, re.UNICODE)
+
+
+def search(queryset, query):
+    """ Narrow queryset to the rows matching every word of query, best
+    matches first. Other databases fall back to unindexed icontains.
+    """
+    words = terms(query)
+    if not words:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        # quoting every word keeps FTS5 query syntax out of user input
+        match = ' '.join('"{}"'.format(word) for word in words)
+        return queryset.extra(
+            select={'rank': SQLITE_RANK.format(index=INDEX)},
+            tables=[INDEX],
+            where=[
+                '{index} MATCH %s'.format(index=INDEX),
+                '{index}.rowid = {table}.id'.format(index=INDEX, table=TABLE)
+            ],
+            params=[match],
+            order_by=['rank', 'id']
+        )
+
+    if vendor == 'postgresql':
+        text = ' '.join(words)
+        return queryset.extra(
+            select={'rank': POSTGRES_RANK},
+            select_params=[text],
+            where=["search_vector @@ plainto_tsquery('english', %s)"],
+            params=[text],
+            order_by=['-rank', 'id']
+        )
+
+    return queryset.filter(*[
+        reduce(operator.or_, (Q(**{field + '__icontains': word}) for field in SEARCH_FIELDS))
+        for word in words
+    ]).order_by('id')
+
+
+def get_page(request):
+    try:
+        return max(int(request.query_params[PAGE_PARAM]), 1)
+    except (KeyError, ValueError):
+        return 1
+
+
+def paginate_ranked(queryset, request):
+    """ Return one page of ranked search results and the link to the next
+    page or None. Results are paged by offset, relevance has no key to
+    seek on.
+    """
+    page_size = pagination.get_page_size(request)
+    page_number = get_page(request)
+    start = (page_number - 1) * page_size
+
+    page = list(queryset[start:start + page_size + 1])
+    if len(page) <= page_size:
+        return page, None
+    return page[:page_size], replace_query_param(request.build_absolute_uri(), PAGE_PARAM, page_number + 1)
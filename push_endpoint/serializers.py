@@ -1,9 +1,11 @@
+from collections import OrderedDict
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from rest_framework_bulk import BulkSerializerMixin, BulkListSerializer
 
 from push_endpoint.models import PushedData
-from push_endpoint.validators import ValidDOI
+from push_endpoint.validators import UniqueDOIPerSource, ValidDOI
 
 
 class PushedDataSerializer(BulkSerializerMixin, serializers.HyperlinkedModelSerializer):
@@ -15,11 +17,38 @@ class PushedDataSerializer(BulkSerializerMixin, serializers.HyperlinkedModelSeri
                   'title', 'dateUpdated', 'url', 'serviceID', 'doi', 'source')
         list_serializer_class = BulkListSerializer
 
-        validators = [
+    def get_validators(self):
+        # the validators keep the state of the push they check, so every
+        # serializer gets its own instead of sharing ones on Meta
+        return [
+            UniqueDOIPerSource(),
             ValidDOI()
         ]
 
 
+# PushedDataSerializer's output fields, and the columns they are read from
+READ_FIELDS = ('id', 'description', 'contributors', 'tags', 'source',
+               'title', 'dateUpdated', 'url', 'serviceID', 'doi')
+READ_COLUMNS = ('id', 'description', 'contributors', 'tags', 'source__username',
+                'title', 'dateUpdated', 'url', 'serviceID', 'doi')
+DATE_INDEX = READ_FIELDS.index('dateUpdated')
+
+
+def serialize_rows(rows):
+    """ Fast path for PushedDataSerializer(many=True).data on list pages.
+
+    Takes rows of values_list(*READ_COLUMNS), so there are no model
+    instances or field objects per row and the source username comes
+    from a join, and gives the same representation.
+    """
+    data = []
+    for row in rows:
+        row = list(row)
+        row[DATE_INDEX] = row[DATE_INDEX].isoformat()
+        data.append(OrderedDict(zip(READ_FIELDS, row)))
+    return data
+
+
 class UserSerializer(serializers.HyperlinkedModelSerializer):
     data = serializers.HyperlinkedRelatedField(many=True, view_name='data-detail', read_only=True)
 
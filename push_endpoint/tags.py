@@ -0,0 +1,37 @@
+## tag filters and facet counts from the normalized Tag table
+from django.conf import settings
+from django.db.models import Count
+
+from push_endpoint.models import Tag, split_tags
+
+TAGS_PARAM = 'tags'
+FACET_LIMIT = getattr(settings, 'PUSHED_DATA_FACET_LIMIT', 20)
+MAX_FACET_LIMIT = getattr(settings, 'PUSHED_DATA_MAX_FACET_LIMIT', 1000)
+
+
+def filter_tags(queryset, query_params):
+    """ Narrow pushed data to the rows carrying every tag of the comma
+    separated tags param, each one an indexed lookup on Tag
+    """
+    for name in split_tags(query_params.get(TAGS_PARAM)):
+        queryset = queryset.filter(id__in=Tag.objects.filter(name=name).values('data_id'))
+    return queryset
+
+
+def get_limit(query_params):
+    try:
+        limit = int(query_params['limit'])
+    except (KeyError, ValueError):
+        return FACET_LIMIT
+    if limit < 1:
+        return FACET_LIMIT
+    return min(limit, MAX_FACET_LIMIT)
+
+
+def facets(tags=None, limit=None):
+    """ The most used tags of the rows of the Tag queryset tags, as
+    (name, number of rows) pairs
+    """
+    tags = Tag.objects.all() if tags is None else tags
+    counts = tags.values('name').annotate(count=Count('id')).order_by('-count', 'name')
+    return [(row['name'], row['count']) for row in counts[:limit or FACET_LIMIT]]
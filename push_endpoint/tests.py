@@ -1,9 +1,50 @@
+import os
+import base64
+import sys
+import csv
 import copy
 import json
+import zlib
+import time
+import shutil
+import pstats
+import tempfile
+import subprocess
+import datetime
 
-from django.test import TestCase
-from push_endpoint.views import DataList
+import mock
+import msgpack
+import requests
+from django.apps import apps
+from django.db import connection, connections, router, transaction, IntegrityError
+from django.db.models.signals import post_delete, post_migrate
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.utils.six import StringIO
+from django.test import Client, RequestFactory, TestCase
+from django.contrib.sessions.models import Session
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.forms.models import model_to_dict
+from django.utils.http import http_date
+from push_endpoint import bench
+from push_endpoint import ingest
+from push_endpoint import doi_cache
+from push_endpoint import loadtest
+from push_endpoint import metrics
+from push_endpoint import pending
+from push_endpoint import profiling
+from push_endpoint import response_cache
+from push_endpoint import routers
+from push_endpoint import search
+from push_endpoint import throttling
+from push_endpoint.views import DataList, DataStream, DataExport, DataDetail, UserList, UserDetail, BatchDetail, TagFacets, DailyStats, ChangeList
+from push_endpoint.models import Change, DailyCount, DOIResolution, PendingItem, PushBatch, PushedData, SourceLimit, Tag, content_hash, split_tags
+from push_endpoint.validators import UniqueDOIPerSource
+from push_endpoint.serializers import PushedDataSerializer, READ_COLUMNS, serialize_rows
 from rest_framework.test import APIRequestFactory
+from rest_framework.renderers import JSONRenderer
 from django.contrib.auth.models import AnonymousUser, User
 
 
@@ -18,6 +59,12 @@ VALID_POST = {
 }
 
 
+def pushed(i):
+    """ VALID_POST with a DOI of its own, a source pushes each DOI once
+    """
+    return dict(VALID_POST, doi='10.1000/duck.{}'.format(i))
+
+
 class APIPostTests(TestCase):
 
     def setUp(self):
@@ -212,3 +259,1906 @@ class APIPostTests(TestCase):
         data = response.data
 
         self.assertEqual(data['source'], request.user.username)
+
+
+class DOICacheTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        self.get = patcher.start()
+        self.get.return_value.status_code = 200
+        self.addCleanup(patcher.stop)
+
+    def test_second_lookup_skips_network(self):
+        self.assertTrue(doi_cache.resolve('10.1000/duck'))
+        self.assertTrue(doi_cache.resolve('10.1000/duck'))
+
+        self.assertEqual(self.get.call_count, 1)
+        self.assertEqual(doi_cache.stats()['hits'], 1)
+        self.assertEqual(doi_cache.stats()['misses'], 1)
+
+    def test_resolver_prefix_shares_entry(self):
+        doi_cache.resolve('10.1000/duck')
+        doi_cache.resolve('https://dx.doi.org/10.1000/duck')
+
+        self.assertEqual(self.get.call_count, 1)
+        self.get.assert_called_with('https://dx.doi.org/10.1000/duck', allow_redirects=False)
+
+    def test_negative_entry_is_cached(self):
+        self.get.return_value.status_code = 404
+
+        self.assertFalse(doi_cache.resolve('thisistotallynotadoi'))
+        self.assertFalse(doi_cache.resolve('thisistotallynotadoi'))
+        self.assertEqual(self.get.call_count, 1)
+
+    def test_indefinite_answers_are_not_cached(self):
+        for status in (500, 503, 429):
+            self.get.return_value.status_code = status
+            self.assertTrue(doi_cache.resolve('10.1000/duck'))
+        self.get.side_effect = requests.ConnectionError('resolver down')
+        self.assertTrue(doi_cache.resolve('10.1000/duck'))
+        self.assertEqual(doi_cache.resolve_many(['10.1000/duck']), {'10.1000/duck': True})
+
+        self.assertEqual(self.get.call_count, 5)
+        self.assertFalse(DOIResolution.objects.exists())
+
+        self.get.side_effect = None
+        self.get.return_value.status_code = 404
+        self.assertFalse(doi_cache.resolve('10.1000/duck'))
+        self.assertFalse(DOIResolution.objects.get(doi='10.1000/duck').resolves)
+
+    def test_expired_negative_entry_is_rechecked(self):
+        self.get.return_value.status_code = 404
+        doi_cache.resolve('10.1000/duck')
+        DOIResolution.objects.update(
+            date_checked=timezone.now() - datetime.timedelta(seconds=doi_cache.NEGATIVE_TTL + 1)
+        )
+
+        self.get.return_value.status_code = 200
+        self.assertTrue(doi_cache.resolve('10.1000/duck'))
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_positive_entry_outlives_negative_ttl(self):
+        doi_cache.resolve('10.1000/duck')
+        DOIResolution.objects.update(
+            date_checked=timezone.now() - datetime.timedelta(seconds=doi_cache.NEGATIVE_TTL + 1)
+        )
+
+        doi_cache.resolve('10.1000/duck')
+        self.assertEqual(self.get.call_count, 1)
+
+    def test_evicts_least_recently_used(self):
+        for doi in ('10.1000/one', '10.1000/two', '10.1000/three'):
+            doi_cache.resolve(doi)
+        DOIResolution.objects.filter(doi='10.1000/one').update(
+            last_used=timezone.now() + datetime.timedelta(minutes=1)
+        )
+
+        doi_cache.evict(max_entries=2)
+
+        self.assertEqual(
+            set(DOIResolution.objects.values_list('doi', flat=True)),
+            {'10.1000/one', '10.1000/three'}
+        )
+
+    def test_bulk_lookups_check_the_size_once(self):
+        with mock.patch('push_endpoint.doi_cache.EVICT_INTERVAL', 1), \
+                mock.patch('push_endpoint.doi_cache.MAX_ENTRIES', 2):
+            with CaptureQueriesContext(connection) as queries:
+                doi_cache.resolve_many(['10.1000/duck.{}'.format(i) for i in range(5)])
+
+        self.assertEqual(len([query for query in queries if 'COUNT(' in query['sql']]), 1)
+        self.assertEqual(DOIResolution.objects.count(), 2)
+
+    def test_stats_count_evicted_entries(self):
+        for doi in ('10.1000/one', '10.1000/two', '10.1000/three'):
+            doi_cache.resolve(doi)
+        doi_cache.resolve('10.1000/three')
+
+        doi_cache.evict(max_entries=1)
+        doi_cache.evict(max_entries=0)
+        stats = doi_cache.stats()
+
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses']), (0, 1, 3))
+
+    def test_repush_does_not_resolve_again(self):
+        user = User.objects.create(username='bubbaray', password='dudley')
+        factory = APIRequestFactory()
+        view = DataList.as_view()
+
+        for url, status in (('/pushed_data/', 201), ('/pushed_data/?upsert=true', 200)):
+            request = factory.post(url, json.dumps(VALID_POST), content_type='application/json')
+            request.user = user
+            response = view(request)
+            self.assertEqual(response.status_code, status)
+
+        self.assertEqual(self.get.call_count, 1)
+
+
+class BulkDOIValidationTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        self.get = patcher.start()
+        self.get.side_effect = self.resolver
+        self.addCleanup(patcher.stop)
+
+    def resolver(self, url, **kwargs):
+        response = mock.Mock()
+        response.status_code = 404 if url.endswith('notadoi') else 200
+        return response
+
+    def bulk_post(self, dois, url='/pushed_data/'):
+        items = []
+        for doi in dois:
+            item = copy.copy(VALID_POST)
+            item['doi'] = doi
+            items.append(item)
+        request = self.factory.post(url, json.dumps(items), content_type='application/json')
+        request.user = self.user
+        return DataList.as_view()(request)
+
+    def test_duplicate_dois_resolved_once(self):
+        response = self.bulk_post(['10.1000/duck', 'https://dx.doi.org/10.1000/duck', '10.1000/goose'])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_errors_map_to_item_positions(self):
+        response = self.bulk_post(['10.1000/duck', 'thisistotallynotadoi', '10.1000/goose'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(response.data[1]['non_field_errors'], ['DOI does not resolve, please enter a valid DOI'])
+        self.assertEqual(response.data[2], {})
+
+    def test_known_dois_skip_network(self):
+        self.bulk_post(['10.1000/duck', '10.1000/goose'])
+        self.bulk_post(['10.1000/duck', '10.1000/goose', '10.1000/swan'], url='/pushed_data/?upsert=true')
+
+        self.assertEqual(self.get.call_count, 3)
+
+    def test_resolve_many_keys_by_normalized_doi(self):
+        resolutions = doi_cache.resolve_many(['https://dx.doi.org/10.1000/duck', 'thisistotallynotadoi'])
+
+        self.assertEqual(resolutions, {'10.1000/duck': True, 'thisistotallynotadoi': False})
+
+
+class BulkInsertTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        self.rows = []
+        for i in range(5):
+            row = pushed(i)
+            row['title'] = 'All About Ducks {}'.format(i)
+            self.rows.append(row)
+
+    def test_returns_saved_ids(self):
+        User.objects.create(username='dvon').data.create(**VALID_POST)
+        objs = ingest.bulk_insert(self.rows, source=self.user, batch_size=2)
+
+        self.assertEqual(
+            [(obj.pk, obj.title) for obj in objs],
+            list(PushedData.objects.filter(source=self.user).order_by('pk').values_list('pk', 'title'))
+        )
+
+    def test_batches_inserts(self):
+        with CaptureQueriesContext(connection) as queries:
+            ingest.bulk_insert(self.rows, source=self.user, batch_size=2)
+
+        inserts = [query for query in queries if 'INSERT INTO "push_endpoint_pusheddata"' in query['sql']]
+        self.assertEqual(len(inserts), 3)
+
+    def test_bulk_post_uses_bulk_insert(self):
+        factory = APIRequestFactory()
+        request = factory.post('/pushed_data/', json.dumps(self.rows), content_type='application/json')
+        request.user = self.user
+
+        with mock.patch('push_endpoint.doi_cache.session.get') as get:
+            get.return_value.status_code = 200
+            response = DataList.as_view()(request)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [item['id'] for item in response.data],
+            list(PushedData.objects.order_by('pk').values_list('pk', flat=True))
+        )
+        self.assertEqual(response.data[0]['source'], 'bubbaray')
+
+
+class DataStreamTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        self.get = patcher.start()
+        self.get.side_effect = lambda url, **kwargs: mock.Mock(status_code=404 if url.endswith('notadoi') else 200)
+        self.addCleanup(patcher.stop)
+
+    def stream_post(self, lines, user=None, **headers):
+        request = self.factory.post(
+            '/pushed_data/stream/',
+            '\n'.join(lines),
+            content_type='application/x-ndjson',
+            **headers
+        )
+        request.user = user or self.user
+        return DataStream.as_view()(request)
+
+    def results(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+
+    def test_per_line_results(self):
+        invalid_doi = copy.copy(VALID_POST)
+        invalid_doi['doi'] = 'thisistotallynotadoi'
+        missing_title = copy.copy(VALID_POST)
+        missing_title.pop('title')
+
+        response = self.stream_post([
+            json.dumps(pushed(1)),
+            '{"not json',
+            '',
+            json.dumps(invalid_doi),
+            json.dumps(missing_title),
+            json.dumps(pushed(6))
+        ])
+        results = self.results(response)
+        ids = list(PushedData.objects.order_by('pk').values_list('pk', flat=True))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(results[0], {'line': 1, 'id': ids[0]})
+        self.assertIn('Invalid JSON', results[1]['errors']['non_field_errors'][0])
+        self.assertEqual(results[2]['errors']['non_field_errors'], ['DOI does not resolve, please enter a valid DOI'])
+        self.assertEqual(results[3], {'line': 5, 'errors': {'title': ['This field is required.']}})
+        self.assertEqual(results[4], {'line': 6, 'id': ids[1]})
+        self.assertEqual(results[5], {'summary': {'lines': 5, 'created': 2, 'failed': 3}})
+
+    def test_concurrent_duplicate_fails_its_chunk(self):
+        bulk_insert = ingest.bulk_insert
+        calls = []
+
+        def insert(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise IntegrityError('UNIQUE constraint failed')
+            return bulk_insert(*args, **kwargs)
+
+        with mock.patch('push_endpoint.ingest.STREAM_CHUNK_SIZE', 2), \
+                mock.patch('push_endpoint.ingest.bulk_insert', side_effect=insert):
+            results = self.results(self.stream_post([json.dumps(pushed(i)) for i in range(3)]))
+
+        self.assertEqual(results[0]['errors']['non_field_errors'], [ingest.CONCURRENT_WRITE_MESSAGE])
+        self.assertEqual(results[1]['errors']['non_field_errors'], [ingest.CONCURRENT_WRITE_MESSAGE])
+        self.assertEqual(results[2], {'line': 3, 'id': PushedData.objects.get().pk})
+        self.assertEqual(results[3], {'summary': {'lines': 3, 'created': 1, 'failed': 2}})
+
+    def test_inserts_in_chunks(self):
+        with mock.patch('push_endpoint.ingest.STREAM_CHUNK_SIZE', 2):
+            with mock.patch('push_endpoint.ingest.bulk_insert', wraps=ingest.bulk_insert) as bulk_insert:
+                response = self.stream_post([json.dumps(pushed(i)) for i in range(5)])
+                results = self.results(response)
+
+        self.assertEqual(bulk_insert.call_count, 3)
+        self.assertEqual(results[-1]['summary']['created'], 5)
+        self.assertEqual(PushedData.objects.filter(source=self.user).count(), 5)
+
+    def test_accepts_ndjson(self):
+        response = self.stream_post([json.dumps(pushed(1))], HTTP_ACCEPT='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(self.results(response)[-1]['summary']['created'], 1)
+
+    def test_anonomous_user_can_not_stream(self):
+        response = self.stream_post([json.dumps(VALID_POST)], user=AnonymousUser())
+
+        self.assertEqual(response.status_code, 403)
+
+
+class CursorPaginationTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        user = User.objects.create(username='bubbaray', password='dudley')
+        for i, day in enumerate((3, 1, 2, 1, 3, 2, 1)):
+            item = user.data.create(**pushed(i))
+            PushedData.objects.filter(pk=item.pk).update(dateUpdated=datetime.date(2015, 3, day))
+
+    def get(self, url):
+        request = self.factory.get(url)
+        request.user = AnonymousUser()
+        return DataList.as_view()(request)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_walks_whole_table_in_order(self):
+        expected = list(PushedData.objects.order_by('dateUpdated', 'id').values_list('id', flat=True))
+
+        self.assertEqual(self.walk('/pushed_data/?cursor=&page_size=2'), expected)
+
+    def test_honours_date_filters(self):
+        expected = list(
+            PushedData.objects.filter(dateUpdated__gte=datetime.date(2015, 3, 2))
+            .order_by('dateUpdated', 'id').values_list('id', flat=True)
+        )
+
+        self.assertEqual(self.walk('/pushed_data/?cursor=&page_size=3&from=2015-03-02'), expected)
+
+    def test_page_size_is_capped(self):
+        with mock.patch('push_endpoint.pagination.MAX_PAGE_SIZE', 4):
+            response = self.get('/pushed_data/?cursor=&page_size=100')
+
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_pages_do_not_use_offset(self):
+        response = self.get('/pushed_data/?cursor=&page_size=2')
+        response = self.get(response.data['next'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get(response.data['next'])
+
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries))
+
+    def test_invalid_cursor(self):
+        response = self.get('/pushed_data/?cursor=bm90IGEgY3Vyc29y')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class QueryBenchmarkTests(TestCase):
+
+    def test_reports_every_pattern(self):
+        out = StringIO()
+        call_command('bench_queries', rows=60, sources=3, repeat=1, stdout=out)
+        results = json.loads(out.getvalue())
+
+        self.assertEqual(results['rows'], 60)
+        self.assertEqual(
+            sorted(results['patterns']),
+            ['detail', 'filter_date_range', 'filter_source', 'filter_source_date_range',
+             'list_first_page', 'list_keyset_deep', 'list_offset_deep', 'lookup_doi', 'search']
+        )
+        self.assertTrue(all(pattern['plan'] for pattern in results['patterns'].values()))
+
+    def test_seed_and_cleanup_keep_the_rollups(self):
+        with mock.patch('push_endpoint.management.commands.bench_queries.SEED_CHUNK', 20):
+            call_command('bench_queries', rows=60, sources=3, repeat=1, stdout=StringIO())
+
+        counts = DailyCount.objects.filter(count__gt=0).order_by('day', 'source')
+        self.assertEqual(list(counts.values_list('source', 'day', 'count')), DailyCount.objects.recount())
+        self.assertEqual(len(DailyCount.objects.recount()), 3)
+        self.assertEqual(Change.objects.filter(action=Change.CREATE).count(), 60)
+
+        call_command('bench_queries', rows=60, sources=3, repeat=1, cleanup=True, stdout=StringIO())
+        self.assertEqual(PushedData.objects.count(), 0)
+        self.assertFalse(DailyCount.objects.filter(count__gt=0).exists())
+        self.assertEqual(Change.objects.filter(action=Change.DELETE).count(), 60)
+
+
+class DataExportTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        user = User.objects.create(username='bubbaray', password='dudley')
+        for i, day in enumerate((3, 1, 2, 1)):
+            item = user.data.create(**pushed(i))
+            PushedData.objects.filter(pk=item.pk).update(dateUpdated=datetime.date(2015, 3, day))
+        self.expected = list(PushedData.objects.order_by('dateUpdated', 'id').values_list('id', flat=True))
+
+    def export(self, url, export_format, **headers):
+        request = self.factory.get(url, **headers)
+        request.user = AnonymousUser()
+        response = DataExport.as_view()(request, export_format=export_format)
+        return response, b''.join(response.streaming_content).decode('utf-8').splitlines()
+
+    def test_jsonl_matches_list_output(self):
+        response, lines = self.export('/pushed_data/export.jsonl', 'jsonl')
+        request = self.factory.get('/pushed_data/')
+        request.user = AnonymousUser()
+        listed = DataList.as_view()(request).data
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            sorted((dict(item) for item in listed), key=lambda item: (item['dateUpdated'], item['id']))
+        )
+
+    def test_csv_export(self):
+        response, lines = self.export('/pushed_data/export.csv', 'csv')
+        rows = list(csv.DictReader(lines))
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual([int(row['id']) for row in rows], self.expected)
+        self.assertEqual(rows[0]['source'], 'bubbaray')
+        self.assertEqual(rows[0]['dateUpdated'], '2015-03-01')
+
+    def test_accepts_its_own_content_types(self):
+        for export_format, content_type in DataExport.content_types.items():
+            url = '/pushed_data/export.{}'.format(export_format)
+            response, lines = self.export(url, export_format, HTTP_ACCEPT=content_type)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], content_type)
+            self.assertTrue(lines)
+
+    def test_honours_date_filters(self):
+        response, lines = self.export('/pushed_data/export.jsonl?from=2015-03-02&to=2015-03-02', 'jsonl')
+
+        self.assertEqual(
+            [json.loads(line)['id'] for line in lines],
+            list(PushedData.objects.filter(dateUpdated=datetime.date(2015, 3, 2)).values_list('id', flat=True))
+        )
+
+    def test_fetches_in_chunks(self):
+        with mock.patch('push_endpoint.export.CHUNK_SIZE', 3):
+            with CaptureQueriesContext(connection) as queries:
+                response, lines = self.export('/pushed_data/export.jsonl', 'jsonl')
+
+        self.assertEqual([json.loads(line)['id'] for line in lines], self.expected)
+        self.assertEqual(len(queries), 2)
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        self.item = self.user.data.create(**pushed(1))
+        self.user.data.create(**pushed(2))
+
+    def get_list(self, url='/pushed_data/', **headers):
+        request = self.factory.get(url, **headers)
+        request.user = AnonymousUser()
+        return DataList.as_view()(request)
+
+    def get_detail(self, **headers):
+        request = self.factory.get('/pushed_data/{}/'.format(self.item.pk), **headers)
+        request.user = AnonymousUser()
+        return DataDetail.as_view()(request, pk=self.item.pk)
+
+    def test_list_not_modified_skips_serializing(self):
+        etag = self.get_list()['ETag']
+
+        with mock.patch('push_endpoint.views.serialize_rows') as serialize_rows:
+            response = self.get_list(HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(serialize_rows.called)
+
+    def test_list_etag_changes_on_update_and_delete(self):
+        etag = self.get_list()['ETag']
+
+        self.item.title = 'All About Geese'
+        self.item.save()
+        response = self.get_list(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.item.delete()
+        self.assertEqual(self.get_list(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_etag_depends_on_filters(self):
+        etag = self.get_list()['ETag']
+
+        response = self.get_list('/pushed_data/?from=2015-03-01', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_ignores_if_modified_since(self):
+        response = self.get_list()
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        # the newest row stays, its dateModified is still the latest
+        self.item.delete()
+        since = http_date(time.time() + 60)
+        self.assertEqual(self.get_list(HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+
+    def test_detail_not_modified(self):
+        etag = self.get_detail()['ETag']
+
+        self.assertEqual(self.get_detail(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.item.title = 'All About Geese'
+        self.item.save()
+        self.assertEqual(self.get_detail(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_missing(self):
+        self.item.delete()
+
+        self.assertEqual(self.get_detail().status_code, 404)
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        self.item = self.user.data.create(**VALID_POST)
+
+    def get_list(self, url='/pushed_data/'):
+        request = self.factory.get(url)
+        request.user = AnonymousUser()
+        response = DataList.as_view()(request)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_repeat_request_is_served_from_cache(self):
+        first = self.get_list()
+
+        with mock.patch('push_endpoint.views.serialize_rows') as serialize_rows:
+            second = self.get_list()
+
+        self.assertFalse(serialize_rows.called)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+        self.assertEqual(response_cache.stats()['hits'], 1)
+        self.assertEqual(response_cache.stats()['misses'], 1)
+
+    def test_hits_do_not_read_pushed_data(self):
+        etag = self.get_list()['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_list()
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse([query for query in queries if 'push_endpoint_pusheddata' in query['sql']])
+
+        self.item.delete()
+        self.assertNotEqual(self.get_list()['ETag'], etag)
+
+    def test_key_normalizes_param_order(self):
+        self.get_list('/pushed_data/?from=2015-03-01&to=2099-03-01')
+        self.get_list('/pushed_data/?to=2099-03-01&from=2015-03-01')
+
+        self.assertEqual(response_cache.stats()['hits'], 1)
+
+    def test_writes_invalidate(self):
+        self.get_list()
+
+        self.item.title = 'All About Geese'
+        self.item.save()
+        self.assertIn(b'All About Geese', self.get_list().content)
+
+        ingest.bulk_insert([pushed(1)], source=self.user)
+        self.assertEqual(len(json.loads(self.get_list().content.decode('utf-8'))), 2)
+
+        self.item.delete()
+        self.assertEqual(len(json.loads(self.get_list().content.decode('utf-8'))), 1)
+        self.assertEqual(response_cache.stats()['hits'], 0)
+
+    def test_deletes_bump_after_their_transaction(self):
+        during = []
+
+        def deleted(sender, **kwargs):
+            during.append(response_cache.generation())
+        post_delete.connect(deleted, sender=PushedData)
+        self.addCleanup(post_delete.disconnect, deleted, sender=PushedData)
+        self.user.data.create(**pushed(1))
+
+        for delete in (self.item.delete, PushedData.objects.all().delete):
+            before = response_cache.generation()
+            delete()
+            self.assertEqual(during.pop(), before)
+            self.assertNotEqual(response_cache.generation(), before)
+
+    def test_queued_writes_bump_after_their_transaction(self):
+        before = response_cache.generation()
+        during = []
+        bulk_insert = ingest.bulk_insert
+
+        def insert(*args, **kwargs):
+            objs = bulk_insert(*args, **kwargs)
+            during.append(response_cache.generation())
+            return objs
+
+        pending.enqueue([pushed(1)], self.user)
+        with mock.patch('push_endpoint.doi_cache.session.get') as get, \
+                mock.patch('push_endpoint.ingest.bulk_insert', side_effect=insert):
+            get.return_value = mock.Mock(status_code=200)
+            call_command('process_pushes', once=True)
+
+        self.assertEqual(during, [before])
+        self.assertNotEqual(response_cache.generation(), before)
+
+    def test_browsable_api_is_not_cached(self):
+        self.get_list('/pushed_data/?format=api')
+        self.get_list('/pushed_data/?format=api')
+
+        self.assertEqual(response_cache.stats()['hits'] + response_cache.stats()['misses'], 0)
+
+
+class FastListSerializerTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        for username in ('bubbaray', 'd-von'):
+            user = User.objects.create(username=username, password='dudley')
+            user.data.create(**VALID_POST)
+            user.data.create(
+                description='', contributors=u'Bj\xf6rk', tags='', title=u'\u2603',
+                url='http://dudley.net', serviceID='DuckID12', doi='10.1000/duck'
+            )
+
+    def test_matches_serializer_output(self):
+        queryset = PushedData.objects.order_by('pk')
+        request = self.factory.get('/pushed_data/')
+
+        slow = PushedDataSerializer(queryset, many=True, context={'request': request}).data
+        fast = serialize_rows(queryset.values_list(*READ_COLUMNS))
+
+        self.assertEqual(JSONRenderer().render(fast), JSONRenderer().render(slow))
+
+    def test_list_reads_rows_in_one_query(self):
+        request = self.factory.get('/pushed_data/?cursor=&page_size=3')
+        request.user = AnonymousUser()
+
+        with self.assertNumQueries(1):
+            # the page, the ETag comes from the response cache
+            response = DataList.as_view()(request)
+
+        self.assertEqual([item['source'] for item in response.data['results']], ['bubbaray', 'bubbaray', 'd-von'])
+
+    def test_browsable_api_renders(self):
+        request = self.factory.get('/pushed_data/?format=api')
+        request.user = AnonymousUser()
+        response = DataList.as_view()(request)
+        response.render()
+
+        self.assertEqual(response.status_code, 200)
+
+
+class QueryCountTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.users = []
+        for username in ('bubbaray', 'd-von', 'spike'):
+            user = User.objects.create(username=username, password='dudley')
+            for i in range(3):
+                user.data.create(**pushed(i))
+            self.users.append(user)
+
+    def get_users(self):
+        request = self.factory.get('/users/')
+        request.user = AnonymousUser()
+        response = UserList.as_view()(request)
+        response.render()
+        return response
+
+    def test_user_list_queries_do_not_grow(self):
+        with self.assertNumQueries(2):
+            response = self.get_users()
+        self.assertEqual([len(user['data']) for user in response.data], [3, 3, 3])
+
+        for _ in range(3):
+            User.objects.create(username='dudley-{}'.format(_)).data.create(**VALID_POST)
+        with self.assertNumQueries(2):
+            self.get_users()
+
+    def test_user_detail_queries(self):
+        user = self.users[0]
+        request = self.factory.get('/users/{}/'.format(user.pk))
+        request.user = AnonymousUser()
+
+        with self.assertNumQueries(2):
+            response = UserDetail.as_view()(request, pk=user.pk)
+            response.render()
+
+        self.assertEqual(len(response.data['data']), 3)
+        self.assertTrue(response.data['data'][0].endswith('/pushed_data/{}/'.format(user.data.order_by('pk')[0].pk)))
+
+    def test_detail_joins_source(self):
+        item = self.users[0].data.all()[0]
+        request = self.factory.get('/pushed_data/{}/'.format(item.pk))
+        request.user = AnonymousUser()
+
+        # the conditional GET validators and the joined row
+        with self.assertNumQueries(2):
+            response = DataDetail.as_view()(request, pk=item.pk)
+
+        self.assertEqual(response.data['source'], 'bubbaray')
+
+    def test_ownership_check_does_not_fetch_source(self):
+        item = self.users[0].data.all()[0]
+        request = self.factory.delete('/pushed_data/{}/'.format(item.pk))
+        request.user = self.users[1]
+
+        # fetching the row, nothing to check ownership. The throttles are
+        # counted by ThrottleTests.
+        with mock.patch.object(DataDetail, 'throttle_classes', ()):
+            with self.assertNumQueries(1):
+                response = DataDetail.as_view()(request, pk=item.pk)
+
+        self.assertEqual(response.status_code, 403)
+
+
+class UpsertTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        self.get = patcher.start()
+        self.get.return_value.status_code = 200
+        self.addCleanup(patcher.stop)
+
+    def post(self, items, url='/pushed_data/?upsert=true'):
+        request = self.factory.post(url, json.dumps(items), content_type='application/json')
+        request.user = self.user
+        return DataList.as_view()(request)
+
+    def test_counts_inserted_updated_unchanged(self):
+        response = self.post([pushed(i) for i in range(3)])
+        self.assertEqual(response.data, {'inserted': 3, 'updated': 0, 'unchanged': 0})
+
+        changed = dict(pushed(1), title='All About Geese')
+        response = self.post([pushed(0), changed, pushed(3)])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'inserted': 1, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(PushedData.objects.count(), 4)
+        self.assertEqual(PushedData.objects.get(doi=changed['doi']).title, 'All About Geese')
+
+    def test_unchanged_rows_are_not_written(self):
+        self.post([pushed(i) for i in range(3)])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post([pushed(i) for i in range(3)])
+
+        self.assertEqual(response.data['unchanged'], 3)
+        writes = [
+            query for query in queries
+            if 'push_endpoint_pusheddata' in query['sql'] and ('UPDATE' in query['sql'] or 'INSERT' in query['sql'])
+        ]
+        self.assertEqual(writes, [])
+
+    def test_rows_without_a_hash_are_rewritten(self):
+        item = self.user.data.create(**pushed(0))
+        PushedData.objects.filter(pk=item.pk).update(contentHash='')
+
+        self.assertEqual(self.post(pushed(0)).data, {'inserted': 0, 'updated': 1, 'unchanged': 0})
+        self.assertEqual(PushedData.objects.get(pk=item.pk).contentHash, item.contentHash)
+
+    def test_left_out_fields_keep_their_hash(self):
+        item = self.user.data.create(**pushed(0))
+        partial = dict(pushed(0))
+        del partial['description']
+
+        self.assertEqual(self.post(partial).data, {'inserted': 0, 'updated': 0, 'unchanged': 1})
+
+        self.post(dict(partial, title='All About Geese'))
+        item = PushedData.objects.get(pk=item.pk)
+        self.assertEqual(item.description, VALID_POST['description'])
+        self.assertEqual(item.contentHash, content_hash(model_to_dict(item)))
+
+    def test_repush_without_upsert_is_rejected(self):
+        self.user.data.create(**pushed(0))
+
+        response = self.post([pushed(1), pushed(0)], url='/pushed_data/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[1]['non_field_errors'], [UniqueDOIPerSource.message])
+
+        response = self.post(pushed(0), url='/pushed_data/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_duplicate_doi_in_one_push(self):
+        response = self.post([pushed(0), pushed(0)])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[1]['non_field_errors'], ['DOI appears more than once in this push'])
+
+    def test_sources_push_the_same_doi(self):
+        User.objects.create(username='dvon').data.create(**pushed(0))
+
+        self.assertEqual(self.post([pushed(0)], url='/pushed_data/').status_code, 201)
+
+    def test_detail_update_keeps_its_doi(self):
+        item = self.user.data.create(**pushed(0))
+        request = self.factory.put(
+            '/pushed_data/{}/'.format(item.pk), json.dumps(dict(pushed(0), title='All About Geese')),
+            content_type='application/json'
+        )
+        request.user = self.user
+
+        self.assertEqual(DataDetail.as_view()(request, pk=item.pk).status_code, 200)
+
+    def test_validators_are_per_serializer(self):
+        first, second = PushedDataSerializer().validators, PushedDataSerializer().validators
+
+        self.assertFalse(set(map(id, first)) & set(map(id, second)))
+
+    def test_racing_insert_becomes_update(self):
+        write_upserts = ingest.write_upserts
+        calls = []
+
+        def raced(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                # the original request committed the DOI in the meantime
+                self.user.data.create(**pushed(0))
+                raise IntegrityError('UNIQUE constraint failed')
+            return write_upserts(*args)
+
+        with mock.patch('push_endpoint.ingest.write_upserts', side_effect=raced):
+            response = self.post([dict(pushed(0), title='All About Geese')])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'inserted': 0, 'updated': 1, 'unchanged': 0})
+        self.assertEqual(PushedData.objects.get(doi=pushed(0)['doi']).title, 'All About Geese')
+
+    def test_unique_index(self):
+        self.user.data.create(**pushed(0))
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                self.user.data.create(**pushed(0))
+
+
+class PushQueueTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        self.get = patcher.start()
+        self.get.side_effect = lambda url, **kwargs: mock.Mock(status_code=404 if url.endswith('notadoi') else 200)
+        self.addCleanup(patcher.stop)
+
+    def post(self, items, url='/pushed_data/?async=true'):
+        request = self.factory.post(url, json.dumps(items), content_type='application/json')
+        request.user = self.user
+        return DataList.as_view()(request)
+
+    def status(self, pk, user=None):
+        request = self.factory.get('/pushed_data/batches/{}/'.format(pk))
+        request.user = user or self.user
+        return BatchDetail.as_view()(request, pk=pk)
+
+    def test_accepts_without_validating(self):
+        response = self.post([pushed(0), dict(pushed(1), doi='thisistotallynotadoi')])
+
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response['Location'].endswith('/pushed_data/batches/{}/'.format(response.data['batch'])))
+        self.assertFalse(self.get.called)
+        self.assertEqual(PushedData.objects.count(), 0)
+        self.assertEqual(PendingItem.objects.filter(status=PendingItem.PENDING).count(), 2)
+
+    def test_worker_promotes_and_reports_errors(self):
+        missing_title = pushed(2)
+        missing_title.pop('title')
+        batch = self.post([pushed(0), dict(pushed(1), doi='thisistotallynotadoi'), missing_title, pushed(3)]).data['batch']
+
+        with mock.patch('push_endpoint.pending.CHUNK_SIZE', 3):
+            call_command('process_pushes', once=True)
+        status = self.status(batch).data
+
+        self.assertEqual(status['status'], PushBatch.DONE)
+        self.assertEqual(status['counts'], {
+            'pending': 0, 'inserted': 2, 'updated': 0, 'unchanged': 0, 'failed': 2
+        })
+        self.assertEqual(status['errors'], [
+            {'position': 1, 'errors': {'non_field_errors': ['DOI does not resolve, please enter a valid DOI']}},
+            {'position': 2, 'errors': {'title': ['This field is required.']}}
+        ])
+        self.assertEqual(
+            sorted(PushedData.objects.values_list('doi', flat=True)),
+            [pushed(0)['doi'], pushed(3)['doi']]
+        )
+
+    def test_upsert_batch(self):
+        self.user.data.create(**pushed(0))
+        self.user.data.create(**pushed(1))
+        batch = self.post([pushed(0), dict(pushed(1), title='All About Geese'), pushed(2)],
+                          url='/pushed_data/?async=true&upsert=true').data['batch']
+
+        call_command('process_pushes', once=True)
+
+        self.assertEqual(self.status(batch).data['counts'], {
+            'pending': 0, 'inserted': 1, 'updated': 1, 'unchanged': 1, 'failed': 0
+        })
+        self.assertEqual(
+            list(PendingItem.objects.order_by('position').values_list('data__doi', flat=True)),
+            [pushed(i)['doi'] for i in range(3)]
+        )
+
+    def test_claims_are_exclusive(self):
+        batch = pending.enqueue([pushed(0)], self.user)
+
+        self.assertEqual(pending.claim_batch(), batch)
+        self.assertIsNone(pending.claim_batch())
+
+        PushBatch.objects.filter(pk=batch.pk).update(
+            date_claimed=timezone.now() - datetime.timedelta(seconds=pending.CLAIM_TIMEOUT + 1)
+        )
+        self.assertEqual(pending.claim_batch(), batch)
+
+    def test_failing_chunk_does_not_stop_the_batch(self):
+        batch = self.post([pushed(0), pushed(1)]).data['batch']
+        bulk_insert = ingest.bulk_insert
+        calls = []
+
+        def insert(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise IntegrityError('UNIQUE constraint failed')
+            return bulk_insert(*args, **kwargs)
+
+        with mock.patch('push_endpoint.pending.CHUNK_SIZE', 1), \
+                mock.patch('push_endpoint.ingest.bulk_insert', side_effect=insert):
+            call_command('process_pushes', once=True)
+        status = self.status(batch).data
+
+        self.assertEqual(status['status'], PushBatch.DONE)
+        self.assertEqual((status['counts']['failed'], status['counts']['inserted']), (1, 1))
+        self.assertIn('UNIQUE constraint failed', status['errors'][0]['errors']['non_field_errors'][0])
+        self.assertEqual(list(PushedData.objects.values_list('doi', flat=True)), [pushed(1)['doi']])
+
+    def test_stale_worker_stops_once_reclaimed(self):
+        pending.enqueue([pushed(0), pushed(1)], self.user)
+        stale = pending.claim_batch()
+        PushBatch.objects.filter(pk=stale.pk).update(
+            date_claimed=timezone.now() - datetime.timedelta(seconds=pending.CLAIM_TIMEOUT + 1)
+        )
+        stale.date_claimed = PushBatch.objects.get(pk=stale.pk).date_claimed
+        current = pending.claim_batch()
+
+        pending.process_batch(stale)
+        self.assertEqual(PushedData.objects.count(), 0)
+        self.assertEqual(PushBatch.objects.get(pk=stale.pk).status, PushBatch.PROCESSING)
+
+        pending.process_batch(current)
+        self.assertEqual(PushedData.objects.count(), 2)
+        self.assertEqual(PushBatch.objects.get(pk=stale.pk).status, PushBatch.DONE)
+
+    def test_status_is_private(self):
+        batch = pending.enqueue([pushed(0)], self.user)
+
+        self.assertEqual(self.status(batch.pk).status_code, 200)
+        self.assertEqual(self.status(batch.pk, user=User.objects.create(username='dvon')).status_code, 404)
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        self.title = self.user.data.create(**dict(pushed(0), title='Mallard migration', description='Birds'))
+        self.description = self.user.data.create(**dict(pushed(1), title='Birds', description='Mallard counts'))
+        self.other = self.user.data.create(**dict(pushed(2), title='Geese', description='Honking'))
+
+    def search(self, url):
+        request = self.factory.get(url)
+        request.user = AnonymousUser()
+        response = DataList.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def ids(self, url):
+        return [item['id'] for item in self.search(url).data['results']]
+
+    def test_ranks_title_matches_first(self):
+        self.assertEqual(self.ids('/pushed_data/?q=mallard'), [self.title.pk, self.description.pk])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.ids('/pushed_data/?q=mallard+counts'), [self.description.pk])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.ids('/pushed_data/?q=%22mallard+OR+NEAR(*'), [])
+        self.assertEqual(self.ids('/pushed_data/?q=---'), [])
+
+    def test_index_follows_writes(self):
+        self.other.title = 'Mallard decoys'
+        self.other.save()
+        ingest.bulk_insert([dict(pushed(3), title='Mallard calls')], source=self.user)
+        PushedData.objects.filter(pk=self.description.pk).update(description='Counts')
+        self.title.delete()
+
+        self.assertEqual(len(self.ids('/pushed_data/?q=mallard')), 2)
+        self.assertEqual(self.ids('/pushed_data/?q=geese'), [])
+
+    def test_migrate_restores_triggers(self):
+        triggers = "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s"
+        cursor = connection.cursor()
+        # what a rebuild of the table by a later migration leaves behind
+        search.execute(connection, search.SQLITE_DROP[:3])
+
+        post_migrate.send(sender=apps.get_app_config('push_endpoint'), app_config=apps.get_app_config('push_endpoint'),
+                          verbosity=0, interactive=False, using='default')
+
+        cursor.execute(triggers, [search.INDEX + '%'])
+        self.assertEqual(cursor.fetchone()[0], 3)
+        ingest.bulk_insert([dict(pushed(3), title='Mallard calls')], source=self.user)
+        self.assertEqual(len(self.ids('/pushed_data/?q=mallard')), 3)
+
+    def test_honours_date_filters(self):
+        PushedData.objects.filter(pk=self.title.pk).update(dateUpdated=datetime.date(2015, 3, 1))
+
+        self.assertEqual(self.ids('/pushed_data/?q=mallard&to=2015-03-02'), [self.title.pk])
+
+    def test_pages(self):
+        response = self.search('/pushed_data/?q=mallard&page_size=1')
+        self.assertEqual([item['id'] for item in response.data['results']], [self.title.pk])
+
+        response = self.search(response.data['next'])
+        self.assertEqual([item['id'] for item in response.data['results']], [self.description.pk])
+        self.assertIsNone(response.data['next'])
+
+
+class TagTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        self.other = User.objects.create(username='dvon', password='dudley')
+        self.item = self.user.data.create(**dict(pushed(0), tags='Ducks, hunting'))
+        self.user.data.create(**dict(pushed(1), tags='ducks, decoys'))
+        self.other.data.create(**dict(pushed(2), tags='ducks'))
+
+    def names(self, item):
+        return sorted(item.tag_set.values_list('name', flat=True))
+
+    def get(self, view, url):
+        request = self.factory.get(url)
+        request.user = AnonymousUser()
+        response = view.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def facets(self, url='/pushed_data/tags/'):
+        return [(facet['tag'], facet['count']) for facet in self.get(TagFacets, url)]
+
+    def test_split_tags(self):
+        self.assertEqual(split_tags(' Wood  Ducks,hunting,, wood ducks ,'), ['wood ducks', 'hunting'])
+        self.assertEqual(split_tags(''), [])
+
+    def test_tags_follow_writes(self):
+        self.assertEqual(self.names(self.item), ['ducks', 'hunting'])
+
+        self.item.tags = 'geese'
+        self.item.save()
+        self.assertEqual(self.names(self.item), ['geese'])
+
+        created = ingest.bulk_insert([dict(pushed(3), tags='swans, geese')], source=self.user)[0]
+        self.assertEqual(self.names(created), ['geese', 'swans'])
+
+        ingest.upsert([dict(pushed(3), tags='swans')], source=self.user)
+        self.assertEqual(self.names(created), ['swans'])
+
+        self.item.delete()
+        self.assertEqual(Tag.objects.filter(name='geese').count(), 0)
+
+    def test_upsert_without_tags_keeps_them(self):
+        row = dict(pushed(0), title='All About Geese')
+        del row['tags']
+        ingest.upsert([row], source=self.user)
+
+        self.assertEqual(PushedData.objects.get(pk=self.item.pk).tags, 'Ducks, hunting')
+        self.assertEqual(self.names(self.item), ['ducks', 'hunting'])
+
+    def test_list_filter(self):
+        results = self.get(DataList, '/pushed_data/?tags=Ducks')
+        self.assertEqual(len(results), 3)
+
+        results = self.get(DataList, '/pushed_data/?tags=ducks,decoys')
+        self.assertEqual([item['doi'] for item in results], [pushed(1)['doi']])
+
+    def test_facets(self):
+        self.assertEqual(self.facets(), [('ducks', 3), ('decoys', 1), ('hunting', 1)])
+        self.assertEqual(self.facets('/pushed_data/tags/?limit=1'), [('ducks', 3)])
+        self.assertEqual(self.facets('/pushed_data/tags/?source=dvon'), [('ducks', 1)])
+        self.assertEqual(self.facets('/pushed_data/tags/?tags=hunting'), [('ducks', 1), ('hunting', 1)])
+
+    def test_facets_by_date(self):
+        PushedData.objects.filter(pk=self.item.pk).update(dateUpdated=datetime.date(2015, 3, 1))
+
+        self.assertEqual(self.facets('/pushed_data/tags/?to=2015-03-02'), [('ducks', 1), ('hunting', 1)])
+
+    def test_facets_read_only_the_tag_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.facets()
+
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('push_endpoint_pusheddata', queries[0]['sql'])
+
+
+class DailyCountTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        self.other = User.objects.create(username='dvon', password='dudley')
+        self.today = datetime.date.today()
+
+    def counts(self):
+        return sorted(DailyCount.objects.filter(count__gt=0).values_list('source', 'day', 'count'))
+
+    def stats(self, url='/pushed_data/stats/'):
+        request = self.factory.get(url)
+        request.user = AnonymousUser()
+        return DailyStats.as_view()(request).data
+
+    def test_follows_creates_and_deletes(self):
+        item = self.user.data.create(**pushed(0))
+        ingest.bulk_insert([pushed(i) for i in range(1, 4)], source=self.user)
+        ingest.upsert([pushed(3), pushed(4)], source=self.user)
+        self.other.data.create(**pushed(0))
+        self.assertEqual(self.counts(), [(self.user.pk, self.today, 5), (self.other.pk, self.today, 1)])
+
+        item.delete()
+        self.user.data.filter(doi__in=[pushed(1)['doi'], pushed(2)['doi']]).delete()
+        self.assertEqual(self.counts(), [(self.user.pk, self.today, 2), (self.other.pk, self.today, 1)])
+        self.assertEqual(self.counts(), sorted(DailyCount.objects.recount()))
+
+    def test_stats_endpoint(self):
+        ingest.bulk_insert([pushed(i) for i in range(3)], source=self.user)
+        self.other.data.create(**pushed(0))
+        DailyCount.objects.create(source=self.user, day=datetime.date(2015, 3, 1), count=4)
+
+        stats = self.stats()
+        self.assertEqual(stats['total'], 8)
+        self.assertEqual([(day['day'], day['source'], day['count']) for day in stats['days']], [
+            (datetime.date(2015, 3, 1), 'bubbaray', 4),
+            (self.today, 'bubbaray', 3),
+            (self.today, 'dvon', 1),
+        ])
+        self.assertEqual(self.stats('/pushed_data/stats/?source=dvon')['total'], 1)
+        self.assertEqual(self.stats('/pushed_data/stats/?to=2015-03-02')['total'], 4)
+
+    def test_stats_do_not_read_pushed_data(self):
+        self.user.data.create(**pushed(0))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.stats()
+
+        self.assertFalse(any('push_endpoint_pusheddata' in query['sql'] for query in queries))
+
+    def test_rebuild(self):
+        item = self.user.data.create(**pushed(0))
+        PushedData.objects.filter(pk=item.pk).update(dateUpdated=datetime.date(2015, 3, 1))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.counts(), [(self.user.pk, datetime.date(2015, 3, 1), 1)])
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+
+class ChangeFeedTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+
+    def feed(self, url='/changes/'):
+        request = self.factory.get(url)
+        request.user = AnonymousUser()
+        response = ChangeList.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def log(self, since=0):
+        return [(change['action'], change['id']) for change in self.feed('/changes/?since={}'.format(since))['changes']]
+
+    def test_records_every_write(self):
+        item = self.user.data.create(**pushed(0))
+        created = ingest.bulk_insert([pushed(1), pushed(2)], source=self.user)
+        ingest.upsert([dict(pushed(1), title='All About Geese'), pushed(2)], source=self.user)
+        item.title = 'All About Swans'
+        item.save()
+        first, second = [obj.pk for obj in created]
+        created[1].delete()
+
+        self.assertEqual(self.log(), [
+            ('create', item.pk), ('create', first), ('create', second),
+            ('update', first), ('update', item.pk), ('delete', second)
+        ])
+
+    def test_changes_carry_current_records(self):
+        item = self.user.data.create(**pushed(0))
+        gone = self.user.data.create(**pushed(1))
+        gone_pk = gone.pk
+        gone.delete()
+        item.title = 'All About Geese'
+        item.save()
+
+        changes = self.feed()['changes']
+        self.assertEqual([change['data']['title'] for change in changes if change['id'] == item.pk],
+                         ['All About Geese', 'All About Geese'])
+        self.assertEqual([change['data'] for change in changes if change['id'] == gone_pk], [None, None])
+        self.assertEqual(changes[0]['source'], 'bubbaray')
+
+    def test_pages_by_sequence(self):
+        ingest.bulk_insert([pushed(i) for i in range(5)], source=self.user)
+
+        seen = []
+        url = '/changes/?page_size=2'
+        while url:
+            page = self.feed(url)
+            seen.extend(change['seq'] for change in page['changes'])
+            url = page['next']
+
+        self.assertEqual(seen, sorted(Change.objects.values_list('pk', flat=True)))
+        self.assertEqual(self.feed('/changes/?since={}'.format(seen[-1])), {'last': seen[-1], 'next': None, 'changes': []})
+
+    def test_reads_only_new_changes(self):
+        ingest.bulk_insert([pushed(i) for i in range(50)], source=self.user)
+        last = Change.objects.latest('pk').pk
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.feed('/changes/?since={}'.format(last - 1))['last'], last)
+
+        self.assertEqual(len(queries), 2)
+
+    def test_invalid_since(self):
+        request = self.factory.get('/changes/?since=yesterday')
+        request.user = AnonymousUser()
+
+        self.assertEqual(ChangeList.as_view()(request).status_code, 400)
+
+
+class CompressionTests(TestCase):
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.user = User.objects.create(username='bubbaray')
+        self.user.set_password('dudley')
+        self.user.save()
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        patcher.start().return_value.status_code = 200
+        self.addCleanup(patcher.stop)
+
+    def gzip(self, data):
+        encoder = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return encoder.compress(data) + encoder.flush()
+
+    def gunzip(self, data):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+    def push(self, url, body, content_type='application/json', encoding='gzip'):
+        self.client.login(username='bubbaray', password='dudley')
+        return self.client.post(url, body, content_type=content_type, HTTP_CONTENT_ENCODING=encoding)
+
+    def test_gzip_push(self):
+        body = json.dumps([pushed(i) for i in range(20)]).encode('utf-8')
+        response = self.push('/pushed_data/', self.gzip(body))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(PushedData.objects.count(), 20)
+
+    def test_gzip_stream_push(self):
+        body = '\n'.join(json.dumps(pushed(i)) for i in range(5)).encode('utf-8')
+        response = self.push('/pushed_data/stream/', self.gzip(body), content_type='application/x-ndjson')
+        b''.join(response.streaming_content)
+
+        self.assertEqual(PushedData.objects.count(), 5)
+
+    def test_decompression_is_capped(self):
+        body = self.gzip(b'[' + b' ' * 100000 + b']')
+
+        with mock.patch('push_endpoint.compression.MAX_BODY_SIZE', 10000):
+            response = self.push('/pushed_data/', body)
+
+        self.assertEqual(response.status_code, 413)
+
+    def test_bad_stream_bodies(self):
+        response = self.push('/pushed_data/stream/', b'not gzip at all', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+
+        with mock.patch('push_endpoint.compression.MAX_BODY_SIZE', 10000):
+            response = self.push(
+                '/pushed_data/stream/', self.gzip(b' ' * 100000), content_type='application/x-ndjson'
+            )
+        self.assertEqual(response.status_code, 413)
+
+    def test_stream_bomb_after_the_first_line(self):
+        # noise, so the body decodes a block at a time instead of at once
+        body = json.dumps(pushed(0)).encode('utf-8') + b'\n' + base64.encodestring(os.urandom(150000))
+        with mock.patch('push_endpoint.compression.MAX_BODY_SIZE', 100000), \
+                mock.patch('push_endpoint.ingest.STREAM_CHUNK_SIZE', 10000):
+            response = self.push('/pushed_data/stream/', self.gzip(body), content_type='application/x-ndjson')
+            results = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(results[-1]['summary']['error']['status'], 413)
+        self.assertEqual(results[-1]['summary']['error']['line'], 1)
+        self.assertEqual(PushedData.objects.count(), 0)
+
+    def test_bad_bodies(self):
+        self.assertEqual(self.push('/pushed_data/', b'not gzip at all').status_code, 400)
+        self.assertEqual(self.push('/pushed_data/', b'[]', encoding='compress').status_code, 415)
+
+    def test_large_responses_are_compressed(self):
+        ingest.bulk_insert([pushed(i) for i in range(20)], source=self.user)
+        plain = self.client.get('/pushed_data/')
+        response = self.client.get('/pushed_data/', HTTP_ACCEPT_ENCODING='deflate;q=0.5, gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(self.gunzip(response.content), plain.content)
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+
+        response = self.client.get('/pushed_data/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_small_responses_are_not(self):
+        response = self.client.get('/pushed_data/', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(response.content.decode('utf-8')), [])
+
+    def test_refused_codings(self):
+        ingest.bulk_insert([pushed(i) for i in range(20)], source=self.user)
+        response = self.client.get('/pushed_data/', HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streamed_export_is_compressed(self):
+        ingest.bulk_insert([pushed(i) for i in range(50)], source=self.user)
+        plain = b''.join(self.client.get('/pushed_data/export.jsonl').streaming_content)
+        response = self.client.get('/pushed_data/export.jsonl', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(self.gunzip(b''.join(response.streaming_content)), plain)
+
+
+class ThrottleTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        self.get = patcher.start()
+        self.get.return_value.status_code = 200
+        self.addCleanup(patcher.stop)
+
+    def limit(self, **rates):
+        return SourceLimit.objects.create(source=self.user, **rates)
+
+    def post(self, items, url='/pushed_data/'):
+        request = self.factory.post(url, json.dumps(items), content_type='application/json')
+        request.user = self.user
+        return DataList.as_view()(request)
+
+    def test_requests_past_the_burst_wait(self):
+        self.limit(requests_per_second=0.01, request_burst=2)
+
+        self.assertEqual(self.post([pushed(0)]).status_code, 201)
+        self.assertEqual(self.post([pushed(1)]).status_code, 201)
+        response = self.post([pushed(2)])
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '100')
+        self.assertEqual(PushedData.objects.count(), 2)
+
+    def test_items_are_charged_by_push_size(self):
+        self.limit(items_per_second=1, item_burst=3)
+
+        self.assertEqual(self.post([pushed(0), pushed(1)]).status_code, 201)
+        response = self.post([pushed(2), pushed(3)])
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(PushedData.objects.filter(doi=pushed(2)['doi']).exists())
+
+    def test_push_over_the_burst_leaves_debt(self):
+        self.limit(items_per_second=1, item_burst=3)
+
+        self.assertEqual(self.post([pushed(i) for i in range(5)]).status_code, 201)
+        response = self.post([pushed(5)])
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_exempt_sources_and_reads(self):
+        limit = self.limit(requests_per_second=0.01, request_burst=1)
+        self.post([pushed(0)])
+
+        request = self.factory.get('/pushed_data/')
+        request.user = self.user
+        self.assertEqual(DataList.as_view()(request).status_code, 200)
+        self.assertEqual(self.post([pushed(1)]).status_code, 429)
+
+        limit.exempt = True
+        limit.save()
+        self.assertEqual(self.post([pushed(1)]).status_code, 201)
+
+    def test_doi_lookups_have_their_own_budget(self):
+        self.limit(doi_lookups_per_second=0.01, doi_lookup_burst=2)
+
+        self.assertEqual(self.post([pushed(0), pushed(1)]).status_code, 201)
+        response = self.post([pushed(2)])
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.get.call_count, 2)
+        # cached answers cost nothing
+        self.assertEqual(self.post([pushed(0), pushed(1)], url='/pushed_data/?upsert=true').status_code, 200)
+
+    def test_single_records_are_charged_lookups(self):
+        item = self.user.data.create(**pushed(0))
+        self.limit(doi_lookups_per_second=0.01, doi_lookup_burst=2)
+
+        self.assertEqual(self.post(pushed(1)).status_code, 201)
+        request = self.factory.put('/pushed_data/{}/'.format(item.pk), json.dumps(pushed(2)),
+                                   content_type='application/json')
+        request.user = self.user
+        self.assertEqual(DataDetail.as_view()(request, pk=item.pk).status_code, 200)
+
+        self.assertEqual(self.post(pushed(3)).status_code, 429)
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_detail_writes_are_throttled(self):
+        item = self.user.data.create(**pushed(0))
+        self.limit(requests_per_second=0.01, request_burst=1)
+
+        statuses = []
+        for title in ('All About Geese', 'All About Swans'):
+            request = self.factory.patch('/pushed_data/{}/'.format(item.pk), json.dumps({'title': title}),
+                                         content_type='application/json')
+            request.user = self.user
+            statuses.append(DataDetail.as_view()(request, pk=item.pk).status_code)
+
+        self.assertEqual(statuses, [200, 429])
+
+    def test_zero_blocks_the_source(self):
+        self.limit(requests_per_second=0)
+
+        response = self.post([pushed(0)])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(throttling.BLOCKED_WAIT))
+
+        SourceLimit.objects.filter(source=self.user).update(requests_per_second=None, item_burst=0)
+        self.assertEqual(self.post([pushed(0)]).status_code, 429)
+        self.assertFalse(PushedData.objects.exists())
+
+    def test_stream_stops_when_items_run_out(self):
+        self.limit(items_per_second=0.01, item_burst=2)
+        request = self.factory.post(
+            '/pushed_data/stream/', '\n'.join(json.dumps(pushed(i)) for i in range(5)),
+            content_type='application/x-ndjson'
+        )
+        request.user = self.user
+
+        with mock.patch('push_endpoint.ingest.STREAM_CHUNK_SIZE', 2):
+            response = DataStream.as_view()(request)
+            lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+
+        self.assertEqual(json.loads(lines[-1]), {'summary': {
+            'lines': 2, 'created': 2, 'failed': 0, 'throttled': {'line': 3, 'retry_after': 200}
+        }})
+        self.assertEqual(PushedData.objects.count(), 2)
+
+    def test_worker_defers_batch_without_lookups(self):
+        self.limit(doi_lookups_per_second=0.01, doi_lookup_burst=1)
+        batch = pending.enqueue([pushed(0), pushed(1)], self.user)
+
+        with mock.patch('push_endpoint.pending.CHUNK_SIZE', 1):
+            call_command('process_pushes', once=True)
+        batch = PushBatch.objects.get(pk=batch.pk)
+
+        self.assertEqual(batch.status, PushBatch.PENDING)
+        self.assertGreater(batch.retry_after, timezone.now())
+        self.assertIsNone(pending.claim_batch())
+        self.assertEqual(list(PushedData.objects.values_list('doi', flat=True)), [pushed(0)['doi']])
+
+        PushBatch.objects.filter(pk=batch.pk).update(retry_after=timezone.now())
+        self.assertEqual(pending.claim_batch(), batch)
+
+
+class BulkWriteTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        self.items = ingest.bulk_insert([pushed(i) for i in range(3)], source=self.user)
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        patcher.start().return_value.status_code = 200
+        self.addCleanup(patcher.stop)
+
+    def send(self, method, items=None, url='/pushed_data/', user=None):
+        request = getattr(self.factory, method)(url, json.dumps(items), content_type='application/json')
+        request.user = user or self.user
+        return DataList.as_view()(request)
+
+    def test_bulk_update_is_one_statement(self):
+        items = [dict(pushed(i), id=obj.pk, title='All About Geese {}'.format(i)) for i, obj in enumerate(self.items)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send('put', items)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['title'] for item in response.data], [item['title'] for item in items])
+        self.assertEqual(len([query for query in queries if 'UPDATE "push_endpoint_pusheddata"' in query['sql']]), 1)
+        self.assertEqual(
+            list(PushedData.objects.order_by('pk').values_list('title', flat=True)),
+            [item['title'] for item in items]
+        )
+        self.assertEqual(Change.objects.filter(action=Change.UPDATE).count(), 3)
+
+    def test_partial_bulk_update_keeps_other_fields(self):
+        response = self.send('patch', [{'id': self.items[0].pk, 'tags': 'Geese'}])
+        item = PushedData.objects.get(pk=self.items[0].pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((item.title, item.tags), ('All About Ducks', 'Geese'))
+        self.assertEqual(item.contentHash, content_hash(item.__dict__))
+        self.assertEqual(list(item.tag_set.values_list('name', flat=True)), ['geese'])
+        self.assertGreater(item.dateModified, self.items[0].dateModified)
+
+    def test_bulk_update_stays_under_the_sqlite_parameter_limit(self):
+        # four fields with contentHash: 111 rows fill 999 parameters
+        # exactly, before the one of dateModified
+        objs = ingest.bulk_insert([pushed(i) for i in range(3, 123)], source=self.user)
+        items = [{'id': obj.pk, 'title': 'Geese', 'url': 'http://geese.net', 'tags': 'geese'} for obj in objs]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send('patch', items)
+        updates = [query['sql'] for query in queries if 'UPDATE "push_endpoint_pusheddata"' in query['sql']]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PushedData.objects.filter(title='Geese').count(), 120)
+        self.assertEqual(len(updates), 2)
+        for sql in updates:
+            self.assertLessEqual(sql.count('%s'), ingest.SQLITE_MAX_VARIABLES)
+
+    def test_bulk_update_takes_string_ids(self):
+        items = [dict(pushed(i), id=str(obj.pk), title='All About Geese') for i, obj in enumerate(self.items)]
+        response = self.send('put', items)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PushedData.objects.filter(title='All About Geese').count(), 3)
+
+    def test_bulk_update_checks_ownership(self):
+        other = User.objects.create(username='dvon').data.create(**pushed(5))
+        response = self.send('patch', [{'id': self.items[0].pk, 'title': 'Mine'}, {'id': other.pk, 'title': 'Mine'}])
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(PushedData.objects.filter(title='Mine').exists())
+
+    def test_bulk_update_needs_every_id(self):
+        self.assertEqual(self.send('patch', [{'title': 'Geese'}]).status_code, 400)
+        self.assertEqual(self.send('patch', [{'id': 0, 'title': 'Geese'}]).status_code, 400)
+
+    def test_bulk_delete_by_date(self):
+        old = datetime.date(2015, 1, 1)
+        PushedData.objects.filter(pk__in=[self.items[0].pk, self.items[1].pk]).update(dateUpdated=old)
+        DailyCount.objects.rebuild()
+        other = User.objects.create(username='dvon').data.create(**pushed(0))
+        PushedData.objects.filter(pk=other.pk).update(dateUpdated=old)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send('delete', url='/pushed_data/?to=2015-01-31')
+
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertEqual(len([query for query in queries if 'DELETE FROM "push_endpoint_pusheddata"' in query['sql']]), 1)
+        self.assertEqual(
+            sorted(PushedData.objects.values_list('pk', flat=True)), sorted([self.items[2].pk, other.pk])
+        )
+        self.assertFalse(Tag.objects.filter(data_id__in=[self.items[0].pk, self.items[1].pk]).exists())
+        self.assertEqual(DailyCount.objects.get(source=self.user, day=old).count, 0)
+        self.assertEqual(
+            sorted(Change.objects.filter(action=Change.DELETE).values_list('data_id', 'source')),
+            sorted([(self.items[0].pk, self.user.pk), (self.items[1].pk, self.user.pk)])
+        )
+
+    def test_bulk_delete_scope(self):
+        other = User.objects.create(username='dvon')
+        other.data.create(**pushed(0))
+
+        self.assertEqual(self.send('delete').status_code, 400)
+        self.assertEqual(self.send('delete', url='/pushed_data/?from=2015-01-01&source=dvon').status_code, 403)
+
+        self.user.is_staff = True
+        response = self.send('delete', url='/pushed_data/?from=2015-01-01&source=dvon')
+        self.assertEqual(response.data, {'deleted': 1})
+        self.assertEqual(PushedData.objects.filter(source=self.user).count(), 3)
+
+
+class MessagePackTests(TestCase):
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='bubbaray', password='dudley')
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        patcher.start().return_value.status_code = 200
+        self.addCleanup(patcher.stop)
+
+    def test_bulk_push_and_response(self):
+        request = self.factory.post(
+            '/pushed_data/', msgpack.packb([pushed(0), pushed(1)]), content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack'
+        )
+        request.user = self.user
+        response = DataList.as_view()(request)
+        response.render()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(
+            [item['doi'] for item in msgpack.unpackb(response.content, raw=False)],
+            [pushed(0)['doi'], pushed(1)['doi']]
+        )
+
+    def test_round_trips_like_json(self):
+        item = self.user.data.create(**pushed(0))
+        ingest.bulk_insert([pushed(i) for i in range(1, 4)], source=self.user)
+
+        for url in ('/pushed_data/', '/pushed_data/{}/'.format(item.pk)):
+            as_json = self.client.get(url, HTTP_ACCEPT='application/json')
+            as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+
+            self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+            self.assertEqual(
+                msgpack.unpackb(as_msgpack.content, raw=False), json.loads(as_json.content.decode('utf-8'))
+            )
+
+    def test_invalid_body(self):
+        request = self.factory.post('/pushed_data/', b'\xc1', content_type='application/msgpack')
+        request.user = self.user
+        response = DataList.as_view()(request)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('MessagePack parse error', response.data['detail'])
+
+    def test_benchmark_checks_round_trip(self):
+        out = StringIO()
+        call_command('bench_formats', sizes='1,5', repeat=1, stdout=out)
+
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class LoadTestTests(TestCase):
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.addCleanup(doi_cache.set_resolver, doi_cache.RESOLVER_URL)
+
+    def test_payloads_are_reproducible(self):
+        self.assertEqual(bench.payloads(5, seed=1), bench.payloads(5, seed=1))
+        self.assertNotEqual(bench.payloads(5, seed=1), bench.payloads(5, seed=2))
+        self.assertEqual([row['doi'] for row in bench.payloads(2, start=3, prefix='10.5555/x')],
+                         ['10.5555/x.3', '10.5555/x.4'])
+
+    def test_stub_resolver(self):
+        for rate, status in ((0.0, 200), (1.0, 404)):
+            resolver = loadtest.StubResolver(not_found_rate=rate).start()
+            self.addCleanup(resolver.stop)
+            doi_cache.set_resolver(resolver.url)
+
+            self.assertEqual(doi_cache.session.get(doi_cache.resolver_url('10.5555/duck')).status_code, status)
+            self.assertEqual(resolver.lookups, 1)
+        doi_cache.session.close()
+
+    def test_reports_every_scenario(self):
+        out = StringIO()
+        call_command('loadtest', requests=2, bulk_requests=1, bulk_sizes='3', rows=20, days=2,
+                     resolver_latency=0, stdout=out)
+        results = json.loads(out.getvalue())
+        scenarios = results['scenarios']
+
+        self.assertEqual(
+            sorted(scenarios), ['bulk_post_3', 'list_date_filtered', 'list_deep', 'single_post']
+        )
+        self.assertEqual(scenarios['single_post']['statuses'], {'201': 2})
+        self.assertEqual(scenarios['bulk_post_3']['items'], 3)
+        self.assertEqual(scenarios['list_deep']['statuses'], {'200': 2})
+        self.assertTrue(all(scenario['latency']['p99'] is not None for scenario in scenarios.values()))
+        self.assertEqual(results['resolver']['lookups'], 5)
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.user = User.objects.create(username='bubbaray')
+        self.user.set_password('dudley')
+        self.user.save()
+        SourceLimit.objects.create(source=self.user, exempt=True)
+        self.addCleanup(doi_cache.set_resolver, doi_cache.RESOLVER_URL)
+
+    def timings(self, response):
+        return [metric.strip() for metric in response['Server-Timing'].split(',')]
+
+    def test_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/pushed_data/')
+
+        self.assertEqual(response.status_code, 200)
+        timings = self.timings(response)
+        self.assertTrue(timings[0].startswith('db;dur='))
+        self.assertTrue(timings[0].endswith('desc="{} queries"'.format(len(queries))))
+        self.assertTrue(timings[-2].startswith('view;dur='))
+        self.assertTrue(timings[-1].startswith('total;dur='))
+
+    def test_outbound_http_per_host(self):
+        resolver = loadtest.StubResolver().start()
+        self.addCleanup(resolver.stop)
+        self.addCleanup(doi_cache.session.close)
+        doi_cache.set_resolver(resolver.url)
+
+        self.client.login(username='bubbaray', password='dudley')
+        response = self.client.post('/pushed_data/', json.dumps([pushed(i) for i in range(3)]),
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        host = resolver.url.split('/')[2]
+        http = [metric for metric in self.timings(response) if metric.startswith('http;')]
+        self.assertEqual(len(http), 1)
+        self.assertTrue(http[0].endswith('desc="{} (3 calls)"'.format(host)), http)
+
+    def test_dumps_slow_sampled_requests(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        with mock.patch.multiple(profiling, PROFILING_DIR=directory, PROFILING_SAMPLE_RATE=1.0,
+                                 PROFILING_THRESHOLD=10 ** 6):
+            self.client.get('/pushed_data/')
+        self.assertEqual(os.listdir(directory), [])
+
+        with mock.patch.multiple(profiling, PROFILING_DIR=directory, PROFILING_SAMPLE_RATE=1.0,
+                                 PROFILING_THRESHOLD=0):
+            self.client.get('/pushed_data/')
+        dumps = os.listdir(directory)
+        self.assertEqual(len(dumps), 1)
+        self.assertIn('-GET-pushed_data.prof', dumps[0])
+        self.assertTrue(pstats.Stats(os.path.join(directory, dumps[0])).total_calls)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.user = User.objects.create(username='bubbaray')
+        self.user.set_password('dudley')
+        self.user.save()
+        SourceLimit.objects.create(source=self.user, exempt=True)
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        patcher.start().return_value.status_code = 200
+        self.addCleanup(patcher.stop)
+
+    def sample(self, name, **labels):
+        return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_counts_requests_by_url_name(self):
+        labels = {'view': 'data-list', 'method': 'GET'}
+        counted = self.sample('http_requests_total', status='200', **labels)
+        timed = self.sample('http_request_duration_seconds_count', **labels)
+
+        self.client.get('/pushed_data/')
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE_LATEST)
+        self.assertIn(b'http_request_duration_seconds_bucket{', response.content)
+        self.assertEqual(self.sample('http_requests_total', status='200', **labels), counted + 1)
+        self.assertEqual(self.sample('http_request_duration_seconds_count', **labels), timed + 1)
+
+    def test_pushes_and_doi_outcomes(self):
+        created = self.sample('pushed_items_total', action='create')
+        fetched = self.sample('doi_validations_total', outcome='resolves', origin='resolver')
+        cached = self.sample('doi_validations_total', outcome='resolves', origin='cache')
+        lookups = self.sample('outbound_request_duration_seconds_count', service='doi')
+
+        self.client.login(username='bubbaray', password='dudley')
+        response = self.client.post('/pushed_data/', json.dumps([pushed(i) for i in range(2)]),
+                                    content_type='application/json')
+        doi_cache.resolve_many([pushed(0)['doi']])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.sample('pushed_items_total', action='create'), created + 2)
+        self.assertEqual(self.sample('doi_validations_total', outcome='resolves', origin='resolver'), fetched + 2)
+        self.assertEqual(self.sample('doi_validations_total', outcome='resolves', origin='cache'), cached + 1)
+        self.assertEqual(self.sample('outbound_request_duration_seconds_count', service='doi'), lookups + 2)
+
+    def test_sums_worker_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        env = dict(os.environ, prometheus_multiproc_dir=directory)
+        script = ('import django; django.setup(); from push_endpoint import metrics; '
+                  'metrics.PUSHED_ITEMS.labels("create").inc({})')
+
+        for count in (2, 3):
+            subprocess.check_call([sys.executable, '-c', script.format(count)], env=env, cwd=settings.BASE_DIR)
+
+        self.assertIn(b'pushed_items_total{action="create"} 5.0', metrics.exposition(directory))
+
+
+class ReplicaTests(TestCase):
+    """ A second sqlite file stands in for the replica, it never catches up
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(ReplicaTests, cls).setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        connections.databases['replica'] = dict(
+            connections.databases['default'], NAME=os.path.join(cls.directory, 'replica.sqlite3')
+        )
+        call_command('migrate', database='replica', verbosity=0)
+        source = User.objects.db_manager('replica').create(username='replicated')
+        row = dict(pushed(0), title='Replicated')
+        PushedData.objects.using('replica').bulk_create([
+            PushedData(source=source, contentHash=content_hash(row), **row)
+        ])
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections._connections.replica
+        del connections.databases['replica']
+        shutil.rmtree(cls.directory)
+        super(ReplicaTests, cls).tearDownClass()
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.user = User.objects.create(username='bubbaray')
+        self.user.set_password('dudley')
+        self.user.save()
+        SourceLimit.objects.create(source=self.user, exempt=True)
+        ingest.bulk_insert([dict(pushed(1), title='Primary')], source=self.user)
+        patcher = mock.patch('push_endpoint.doi_cache.session.get')
+        patcher.start().return_value.status_code = 200
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(routers, 'REPLICAS', ['replica'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def titles(self, response):
+        return [row['title'] for row in json.loads(response.content.decode('utf-8'))]
+
+    def test_reads_go_to_replica(self):
+        response = self.client.get('/pushed_data/')
+
+        self.assertEqual(self.titles(response), ['Replicated'])
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_writers_read_their_writes(self):
+        response = self.client.post('/pushed_data/', json.dumps(pushed(2)), content_type='application/json',
+                                    HTTP_AUTHORIZATION=loadtest.basic_auth('bubbaray', 'dudley'))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertEqual(sorted(self.titles(self.client.get('/pushed_data/'))), ['All About Ducks', 'Primary'])
+
+        pinned = Client(HTTP_X_PRIMARY_PIN=response[routers.PIN_HEADER])
+        self.assertEqual(sorted(self.titles(pinned.get('/pushed_data/'))), ['All About Ducks', 'Primary'])
+        # the response cache keeps the pages of each database apart
+        self.assertEqual(self.titles(Client().get('/pushed_data/')), ['Replicated'])
+
+    def test_pins_are_bounded(self):
+        far = Client(HTTP_X_PRIMARY_PIN=str(time.time() + routers.PIN_SECONDS * 100))
+        self.assertEqual(self.titles(far.get('/pushed_data/')), ['Replicated'])
+
+        expired = Client(HTTP_X_PRIMARY_PIN=str(time.time() - 1))
+        self.assertEqual(self.titles(expired.get('/pushed_data/')), ['Replicated'])
+
+    def test_session_writes_do_not_pin(self):
+        state = routers.begin(RequestFactory().get('/pushed_data/'))
+        self.addCleanup(routers.end)
+
+        self.assertEqual(router.db_for_write(Session), 'default')
+        self.assertEqual(router.db_for_write(User), 'default')
+        self.assertFalse(state.wrote)
+        self.assertEqual(router.db_for_read(PushedData), 'replica')
+
+        router.db_for_write(PushedData)
+        self.assertTrue(state.wrote)
+        self.assertEqual(router.db_for_read(PushedData), 'default')
+
+    def test_reads_outside_requests_go_to_primary(self):
+        self.assertEqual(router.db_for_read(PushedData), 'default')
+        self.assertEqual(list(PushedData.objects.values_list('title', flat=True)), ['Primary'])
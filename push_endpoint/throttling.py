@@ -0,0 +1,109 @@
+## per-source token bucket throttling of pushes and DOI lookups
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+from push_endpoint.models import SourceLimit, ThrottleBucket
+
+REQUESTS = ThrottleBucket.REQUESTS
+ITEMS = ThrottleBucket.ITEMS
+DOI_LOOKUPS = ThrottleBucket.DOI_LOOKUPS
+
+# (tokens per second, burst) of every source for each kind of load, None
+# turns a kind off. Overridden per source by SourceLimit in the admin.
+RATES = getattr(settings, 'PUSHED_DATA_THROTTLE_RATES', {
+    REQUESTS: (5, 50),
+    ITEMS: (500, 10000),
+    DOI_LOOKUPS: (50, 1000),
+})
+
+# Retry-After of a source whose rate or burst is 0, which blocks it until
+# an admin raises it
+BLOCKED_WAIT = 60 * 60
+
+# SourceLimit fields overriding the rate and burst of each kind
+OVERRIDES = {
+    REQUESTS: ('requests_per_second', 'request_burst'),
+    ITEMS: ('items_per_second', 'item_burst'),
+    DOI_LOOKUPS: ('doi_lookups_per_second', 'doi_lookup_burst'),
+}
+
+
+def get_limit(source):
+    try:
+        return SourceLimit.objects.get(source=source)
+    except SourceLimit.DoesNotExist:
+        return None
+
+
+def get_rate(scope, limit=None):
+    """ (rate, burst) of a kind of load for a source's SourceLimit, or None
+    when it is not throttled. A rate or burst of 0 blocks it.
+    """
+    if limit is not None and limit.exempt:
+        return None
+    rate, burst = RATES.get(scope) or (None, None)
+    if limit is not None:
+        rate_field, burst_field = OVERRIDES[scope]
+        rate = getattr(limit, rate_field) if getattr(limit, rate_field) is not None else rate
+        burst = getattr(limit, burst_field) if getattr(limit, burst_field) is not None else burst
+    if rate is None or burst is None:
+        return None
+    return rate, burst
+
+
+def consume(source, scope, cost=1, limit=None):
+    """ Charge cost to source's budget for scope. Return None when it is
+    admitted, else the seconds to wait before it would be.
+    """
+    if cost <= 0 or source is None or not source.is_authenticated():
+        return None
+    rate = get_rate(scope, get_limit(source) if limit is None else limit)
+    if rate is None:
+        return None
+    if min(rate) <= 0:
+        return BLOCKED_WAIT
+    return ThrottleBucket.objects.take(source, scope, cost, *rate)
+
+
+def admit(source, scope, cost=1):
+    """ Charge cost to source's budget for scope, raising Throttled, a 429
+    with Retry-After, when it is spent
+    """
+    wait = consume(source, scope, cost)
+    if wait is not None:
+        raise exceptions.Throttled(wait)
+
+
+class SourceThrottle(BaseThrottle):
+    """ Throttle the writes of each authenticated source, reads are served
+    from the response cache and are not counted
+    """
+    scope = None
+
+    def cost(self, request, view):
+        return 1
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS:
+            return True
+        self.wait_time = consume(request.user, self.scope, self.cost(request, view))
+        return self.wait_time is None
+
+    def wait(self):
+        return self.wait_time
+
+
+class RequestThrottle(SourceThrottle):
+    scope = REQUESTS
+
+
+class ItemThrottle(SourceThrottle):
+    """ Charge a push by its number of records, before any of them is
+    validated
+    """
+    scope = ITEMS
+
+    def cost(self, request, view):
+        return len(request.data) if isinstance(request.data, list) else 1
@@ -5,8 +5,14 @@ from push_endpoint import views
 from rest_framework.routers import DefaultRouter, SimpleRouter, Route
 
 urlpatterns = [
-    url(r'^pushed_data/$', views.DataList.as_view()),
+    url(r'^pushed_data/$', views.DataList.as_view(), name='data-list'),
+    url(r'^pushed_data/stream/$', views.DataStream.as_view(), name='data-stream'),
+    url(r'^pushed_data/export\.(?P<export_format>csv|jsonl)$', views.DataExport.as_view(), name='data-export'),
+    url(r'^pushed_data/stats/$', views.DailyStats.as_view(), name='data-stats'),
+    url(r'^pushed_data/tags/$', views.TagFacets.as_view(), name='tag-facets'),
+    url(r'^pushed_data/batches/(?P<pk>[0-9]+)/$', views.BatchDetail.as_view(), name='batch-detail'),
     url(r'^pushed_data/(?P<pk>[0-9]+)/$', views.DataDetail.as_view(), name='data-detail'),
+    url(r'^changes/$', views.ChangeList.as_view(), name='change-list'),
     url(r'^users/$', views.UserList.as_view()),
     url(r'^users/(?P<pk>[0-9]+)/$', views.UserDetail.as_view(), name='user-detail')
 ]
@@ -32,3 +38,7 @@ router.register(r'pushed_data/', views.DataList.as_view(), base_name='pushed-dat
 urlpatterns = format_suffix_patterns(urlpatterns)
 
 urlpatterns += router.urls
+
+urlpatterns += [
+    url(r'^metrics$', views.metrics_exposition, name='metrics')
+]
@@ -0,0 +1,9 @@
+# sqlite allows 999 parameters per query, keep __in lookups below that
+IN_BATCH_SIZE = 500
+
+
+def chunks(items, size=IN_BATCH_SIZE):
+    """ Split a list into consecutive lists of at most size items
+    """
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
@@ -1,23 +1,74 @@
 ## custom validators
 from rest_framework import serializers
 
-import requests
-
-DOI_URL = 'https://dx.doi.org/'
+from push_endpoint import doi_cache
+from push_endpoint.models import PushedData
 
 
 class ValidDOI(object):
+    def set_context(self, serializer):
+        ''' bulk requests resolve every DOI up front, see DataList '''
+        context = serializer.context
+        self.resolutions = context.get('doi_resolutions', {})
+        # lookups are charged to the source, queued pushes have no request
+        self.source = context.get('source') or getattr(context.get('request'), 'user', None)
+
     def __call__(self, value):
         ''' value is the serialized data to be validated '''
 
         doi = value.get('doi')
+        if doi is None:
+            # a partial update leaving the DOI as it is
+            return
+
+        resolves = getattr(self, 'resolutions', {}).get(doi_cache.normalize(doi))
+        if resolves is None:
+            resolves = doi_cache.resolve(doi, source=getattr(self, 'source', None))
+
+        if not resolves:
+            raise serializers.ValidationError('DOI does not resolve, please enter a valid DOI')
+
+
+class UniqueDOIPerSource(object):
+    message = 'This source has already pushed this DOI, push it with ?upsert=true to update it'
 
-        if doi.startswith(DOI_URL):
-            request_url = doi
+    def set_context(self, serializer):
+        ''' bulk requests look up the source's existing DOIs up front, see DataList '''
+        context = serializer.context
+        # bulk updates pass the whole queryset as the instance
+        self.instance = serializer.instance if isinstance(serializer.instance, PushedData) else None
+        if self.instance is not None:
+            self.source_id = self.instance.source_id
         else:
-            request_url = DOI_URL + doi
+            # queued pushes are validated outside of a request
+            source = context.get('source') or getattr(context.get('request'), 'user', None)
+            self.source_id = getattr(source, 'pk', None)
+        self.existing = context.get('existing_dois')
+        self.seen = context.get('seen_dois')
+        self.upsert = context.get('upsert', False)
 
-        response = requests.get(request_url)
+    def __call__(self, value):
+        doi = value.get('doi')
+        if doi is None:
+            return
 
-        if response.status_code == 404:
-            raise serializers.ValidationError('DOI does not resolve, please enter a valid DOI')
+        if self.seen is not None:
+            if doi in self.seen:
+                raise serializers.ValidationError('DOI appears more than once in this push')
+            self.seen.add(doi)
+
+        if self.upsert or self.source_id is None:
+            return
+
+        # bulk updates carry the id of the row being changed, as ingest.bulk_update reads it
+        try:
+            pk = int(value['id'])
+        except (KeyError, TypeError, ValueError):
+            pk = getattr(self.instance, 'pk', None)
+        if self.existing is not None:
+            taken = doi in self.existing and self.existing[doi] != pk
+        else:
+            taken = PushedData.objects.filter(source_id=self.source_id, doi=doi).exclude(pk=pk).exists()
+
+        if taken:
+            raise serializers.ValidationError(self.message)
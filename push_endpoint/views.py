@@ -1,67 +1,443 @@
+import json
+import itertools
+from collections import OrderedDict
+
 from rest_framework import generics
+from rest_framework import status
 from rest_framework import permissions
+from rest_framework.views import APIView
 from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 from django.contrib.auth.models import User
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ParseError, PermissionDenied
+from rest_framework.templatetags.rest_framework import replace_query_param
+from rest_framework.utils.encoders import JSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db.models import Prefetch
+from django.utils import six
 
 from dateutil.parser import parse
 
-from push_endpoint.models import PushedData
+from push_endpoint import export
+from push_endpoint import ingest
+from push_endpoint import metrics
+from push_endpoint import pagination
+from push_endpoint import pending
+from push_endpoint import response_cache
+from push_endpoint import search
+from push_endpoint import tags
+from push_endpoint import throttling
+from push_endpoint import doi_cache
+from push_endpoint.models import Change, DailyCount, PushBatch, PushedData, Tag
+from push_endpoint.utils import chunks
+from push_endpoint.mixins import ConditionalGetMixin, fingerprint
+from push_endpoint.negotiation import IgnoreClientContentNegotiation
+from push_endpoint.parsers import MessagePackParser
+from push_endpoint.renderers import MessagePackRenderer
 from push_endpoint.serializers import UserSerializer
 from push_endpoint.permissions import IsOwnerOrReadOnly
 from push_endpoint.serializers import PushedDataSerializer
+from push_endpoint.serializers import DATE_INDEX, READ_COLUMNS, serialize_rows
 
 from rest_framework_bulk import ListBulkCreateUpdateDestroyAPIView
 
 
-class DataList(ListBulkCreateUpdateDestroyAPIView):
+UPSERT_PARAM = 'upsert'
+ASYNC_PARAM = 'async'
+
+# pushed data is also sent and read as MessagePack, chosen by Content-Type
+# and Accept (or ?format=msgpack)
+DATA_RENDERERS = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (MessagePackRenderer,)
+DATA_PARSERS = tuple(api_settings.DEFAULT_PARSER_CLASSES) + (MessagePackParser,)
+
+
+def filter_dates(queryset, query_params, field='dateUpdated'):
+    """ Narrow pushed data to the from and to dates in the query params
+    """
+    filter = {}
+
+    from_date = query_params.get('from')
+    to_date = query_params.get('to')
+
+    if from_date:
+        filter[field + '__gte'] = parse(from_date)
+
+    if to_date:
+        filter[field + '__lte'] = parse(to_date)
+
+    return queryset.filter(**filter)
+
+
+class DataList(ConditionalGetMixin, ListBulkCreateUpdateDestroyAPIView):
     """
     List all pushed data, or push to the API
     """
     serializer_class = PushedDataSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    throttle_classes = (throttling.RequestThrottle, throttling.ItemThrottle)
+    renderer_classes = DATA_RENDERERS
+    parser_classes = DATA_PARSERS
+
+    def get_validators(self):
+        """ Fingerprint the response cache key, which holds the generation
+        every write bumps and the query, so the ETag changes with any write
+        and costs no query of PushedData, on a cache hit or a deep page.
+
+        No Last-Modified: there is no cheap date a delete moves forward.
+        """
+        etag = fingerprint(
+            response_cache.make_key(self.request), self.request.META.get('HTTP_ACCEPT'), self.format_kwarg
+        )
+        return etag, None
+
+    def get_serializer_context(self):
+        context = super(DataList, self).get_serializer_context()
+        context['doi_resolutions'] = getattr(self, 'doi_resolutions', {})
+        context['existing_dois'] = getattr(self, 'existing_dois', None)
+        context['seen_dois'] = getattr(self, 'seen_dois', None)
+        context['upsert'] = self.upsert_requested()
+        return context
+
+    def upsert_requested(self):
+        return self.request.query_params.get(UPSERT_PARAM) in ('true', '1')
+
+    def async_requested(self):
+        return self.request.query_params.get(ASYNC_PARAM) in ('true', '1')
+
+    def resolve_dois(self, data):
+        """ Resolve every DOI in a bulk payload concurrently, and find the
+        ones the source already pushed, before the per-item validation
+        runs, so the validators only have to look them up
+        """
+        if isinstance(data, list):
+            dois = [
+                item.get('doi') for item in data
+                if isinstance(item, dict) and isinstance(item.get('doi'), six.string_types)
+            ]
+            self.doi_resolutions = doi_cache.resolve_many(dois, source=self.request.user)
+            self.existing_dois = ingest.existing_dois(self.request.user, dois)
+            self.seen_dois = set()
+
+    def create(self, request, *args, **kwargs):
+        """ Push one record or a list of them. With ?upsert=true records
+        are keyed on their DOI: new ones are inserted, changed ones updated
+        and unchanged ones skipped, and the response holds the counts.
+
+        With ?async=true the records are queued as they are and the
+        response is a 202 pointing at the batch status, the process_pushes
+        command validates and writes them.
+        """
+        if self.async_requested():
+            records = request.data if isinstance(request.data, list) else [request.data]
+            batch = pending.enqueue(records, request.user, upsert=self.upsert_requested())
+            location = reverse('batch-detail', kwargs={'pk': batch.pk}, request=request)
+            return Response(
+                OrderedDict([('batch', batch.pk), ('status', batch.status), ('url', location)]),
+                status=status.HTTP_202_ACCEPTED, headers={'Location': location}
+            )
+
+        self.resolve_dois(request.data)
+        if not self.upsert_requested():
+            return super(DataList, self).create(request, *args, **kwargs)
+
+        many = isinstance(request.data, list)
+        serializer = self.get_serializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        rows = serializer.validated_data if many else [serializer.validated_data]
+        return Response(ingest.upsert(rows, source=request.user))
+
+    def bulk_update(self, request, *args, **kwargs):
+        """ Update a list of records, each with its id, in one transaction.
+        Only the source of every record may update them.
+        """
+        partial = kwargs.pop('partial', False)
+        self.resolve_dois(request.data)
+        serializer = self.get_serializer(data=request.data, many=True, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        self.perform_bulk_update(serializer)
+        return Response(serializer.data)
+
+    def perform_bulk_update(self, serializer):
+        serializer.instance = ingest.bulk_update(serializer.validated_data, source=self.request.user)
+
+    def bulk_destroy(self, request, *args, **kwargs):
+        """ Delete the records pushed between the from and to dates. A
+        source deletes its own records, staff may name another source with
+        ?source= (a username).
+        """
+        params = request.query_params
+        if not (params.get('from') or params.get('to')):
+            raise ParseError('Bulk deletes need a from or to date')
+
+        username = params.get('source')
+        if username and username != request.user.username and not request.user.is_staff:
+            raise PermissionDenied('Records can only be deleted by their source.')
+
+        # filter on the column, a join would keep the DELETE from being one statement
+        source_id = request.user.pk
+        if username:
+            source_id = User.objects.filter(username=username).values_list('id', flat=True).first()
+        queryset = filter_dates(PushedData.objects.filter(source_id=source_id), params)
+
+        return Response({'deleted': ingest.bulk_delete(queryset) if source_id is not None else 0})
 
     def perform_create(self, serializer):
         serializer.save(source=self.request.user)
 
+    def perform_bulk_create(self, serializer):
+        serializer.instance = ingest.bulk_insert(serializer.validated_data, source=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        """ List pushed data, from the response cache when possible.
+
+        Pages through the data by (dateUpdated, id) when the client asks
+        for a cursor, ?cursor= on the first request. ?q= searches the text
+        fields through the full-text index, best matches first, a page at
+        a time. Rows are read with values_list and built by serialize_rows
+        instead of the serializer.
+        """
+        if request.accepted_renderer.format in response_cache.CACHEABLE_FORMATS:
+            self.cache_key = response_cache.make_key(request)
+            cached = response_cache.lookup(self.cache_key)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        query = request.query_params.get(search.QUERY_PARAM, '').strip()
+        if query:
+            page, next_url = search.paginate_ranked(
+                search.search(queryset, query).values_list(*READ_COLUMNS), request
+            )
+            return Response(OrderedDict([
+                ('next', next_url),
+                ('results', serialize_rows(page))
+            ]))
+
+        if pagination.CURSOR_PARAM in request.query_params:
+            page, next_url = pagination.paginate_keyset(
+                queryset.values_list(*READ_COLUMNS), request,
+                position=lambda row: (row[DATE_INDEX], row[0])
+            )
+            return Response(OrderedDict([
+                ('next', next_url),
+                ('results', serialize_rows(page))
+            ]))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            # page number pagination works on model instances
+            return Response(self.get_pagination_serializer(page).data)
+
+        return Response(serialize_rows(queryset.values_list(*READ_COLUMNS)))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(DataList, self).finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'cache_key', None) and isinstance(response, Response) and response.status_code == 200:
+            response_cache.store(self.cache_key, response.render())
+        return response
+
     def get_queryset(self):
-        """ Return queryset based on from and to kwargs
+        """ Return queryset based on from, to and tags kwargs
         """
-        filter = {}
-        queryset = PushedData.objects.all()
+        queryset = filter_dates(PushedData.objects.select_related('source'), self.request.QUERY_PARAMS)
+        return tags.filter_tags(queryset, self.request.QUERY_PARAMS)
 
-        from_date = self.request.QUERY_PARAMS.get('from')
-        to_date = self.request.QUERY_PARAMS.get('to')
 
-        if from_date:
-            filter['dateUpdated__gte'] = parse(from_date)
+class BatchDetail(generics.RetrieveAPIView):
+    """
+    Progress of a push queued with ?async=true, and the errors of the
+    records that failed validation
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return PushBatch.objects.filter(source=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(pending.batch_status(self.get_object()))
+
+
+class TagFacets(APIView):
+    """
+    The most used tags and how many records carry each, optionally for
+    one source (a username), the from and to dates and the records
+    carrying the tags in tags
+    """
+    scope_params = ('source', 'from', 'to', tags.TAGS_PARAM)
+
+    def get(self, request, format=None):
+        params = request.query_params
+        queryset = Tag.objects.all()
+
+        if any(params.get(param) for param in self.scope_params):
+            data = tags.filter_tags(filter_dates(PushedData.objects.all(), params), params)
+            if params.get('source'):
+                data = data.filter(source__username=params['source'])
+            queryset = queryset.filter(data__in=data.values('id'))
+
+        return Response([
+            OrderedDict([('tag', name), ('count', count)])
+            for name, count in tags.facets(queryset, tags.get_limit(params))
+        ])
+
+
+class DailyStats(APIView):
+    """
+    Records pushed per source per day, optionally for one source (a
+    username) and the from and to dates. Read from the DailyCount rollups,
+    so the cost follows the number of days and not of records.
+    """
+    def get(self, request, format=None):
+        params = request.query_params
+        queryset = filter_dates(DailyCount.objects.filter(count__gt=0), params, field='day')
+        if params.get('source'):
+            queryset = queryset.filter(source__username=params['source'])
+
+        days = [
+            OrderedDict([('day', day), ('source', source), ('count', count)])
+            for day, source, count in queryset.order_by('day', 'source__username')
+            .values_list('day', 'source__username', 'count')
+        ]
+        return Response(OrderedDict([
+            ('total', sum(day['count'] for day in days)),
+            ('days', days)
+        ]))
+
+
+class ChangeList(APIView):
+    """
+    Every create, update and delete of pushed data after the sequence
+    number in ?since=, oldest first and page_size at a time. Creates and
+    updates carry the record as it is now, deletes are tombstones. Sync by
+    asking again with since set to the last sequence number seen.
+    """
+    since_param = 'since'
 
-        if to_date:
-            filter['dateUpdated__lte'] = parse(to_date)
+    def get(self, request, format=None):
+        try:
+            since = int(request.query_params.get(self.since_param, 0))
+        except ValueError:
+            raise ParseError('since must be a sequence number')
+        page_size = pagination.get_page_size(request)
 
-        queryset = queryset.filter(**filter)
+        changes = list(
+            Change.objects.filter(pk__gt=since).order_by('pk')
+            .values_list('pk', 'action', 'data_id', 'source__username', 'date')[:page_size]
+        )
 
-        return queryset
+        records = {}
+        for batch in chunks(set(change[2] for change in changes if change[1] != Change.DELETE)):
+            for record in serialize_rows(PushedData.objects.filter(pk__in=batch).values_list(*READ_COLUMNS)):
+                records[record['id']] = record
 
+        last = changes[-1][0] if changes else since
+        next_url = None
+        if len(changes) == page_size:
+            next_url = replace_query_param(request.build_absolute_uri(), self.since_param, last)
 
-class DataDetail(generics.RetrieveUpdateDestroyAPIView):
+        return Response(OrderedDict([
+            ('last', last),
+            ('next', next_url),
+            ('changes', [
+                OrderedDict([
+                    ('seq', seq), ('action', action), ('id', data_id), ('source', source), ('date', date),
+                    # None for a tombstone, or a record deleted since
+                    ('data', records.get(data_id))
+                ])
+                for seq, action, data_id, source, date in changes
+            ])
+        ]))
+
+
+class DataStream(APIView):
+    """
+    Push newline-delimited JSON, one record per line. Records are read,
+    validated and saved in chunks, and the response streams back one
+    result line per record followed by a summary line.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    # records are charged a chunk at a time as they are read, see ingest_lines
+    throttle_classes = (throttling.RequestThrottle,)
+    # the results are always newline-delimited JSON
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def post(self, request, format=None):
+        # read the raw body line by line instead of letting a parser load it.
+        # The first line is read before the response starts, so a compressed
+        # body that does not decode gets its 400 or 413.
+        lines = iter(request.stream or [])
+        first = list(itertools.islice(lines, 1))
+        context = {'request': request, 'format': format, 'view': self}
+        results = ingest.ingest_lines(itertools.chain(first, lines), request.user, context)
+
+        return StreamingHttpResponse(
+            (json.dumps(result, cls=JSONEncoder) + '\n' for result in results),
+            content_type='application/x-ndjson'
+        )
+
+
+class DataExport(APIView):
+    """
+    Export all pushed data matching the from and to filters as JSON lines
+    or CSV, streamed in batches so memory stays flat however many rows match
+    """
+    # the URL picks the format, Accept: text/csv included
+    content_negotiation_class = IgnoreClientContentNegotiation
+    content_types = {
+        'csv': 'text/csv',
+        'jsonl': 'application/x-ndjson'
+    }
+
+    def get(self, request, export_format, format=None):
+        queryset = filter_dates(PushedData.objects.all(), request.query_params)
+        rows = export.iter_rows(queryset)
+        lines = export.csv_lines(rows) if export_format == 'csv' else export.jsonl_lines(rows)
+
+        response = StreamingHttpResponse(lines, content_type=self.content_types[export_format])
+        response['Content-Disposition'] = 'attachment; filename="pushed_data.{}"'.format(export_format)
+        return response
+
+
+class DataDetail(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update or delete pushed data
     """
-    queryset = PushedData.objects.all()
+    # the serializer shows source.username
+    queryset = PushedData.objects.select_related('source')
     serializer_class = PushedDataSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly)
+    throttle_classes = (throttling.RequestThrottle, throttling.ItemThrottle)
+    renderer_classes = DATA_RENDERERS
+    parser_classes = DATA_PARSERS
+
+    def get_validators(self):
+        pk = self.kwargs[self.lookup_field]
+        modified = self.get_queryset().filter(pk=pk).values_list('dateModified', flat=True).first()
+        if modified is None:
+            return None, None
+
+        etag = fingerprint(pk, modified.isoformat(), self.request.META.get('HTTP_ACCEPT'), self.format_kwarg)
+        return etag, modified
+
+
+# every user's data links come from one extra query, and only need ids
+USERS_WITH_DATA = User.objects.prefetch_related(
+    Prefetch('data', queryset=PushedData.objects.only('id', 'source'))
+)
 
 
 class UserList(generics.ListAPIView):
-    queryset = User.objects.all()
+    queryset = USERS_WITH_DATA
     serializer_class = UserSerializer
 
 
 class UserDetail(generics.RetrieveAPIView):
-    queryset = User.objects.all()
+    queryset = USERS_WITH_DATA
     serializer_class = UserSerializer
 
 
@@ -71,3 +447,10 @@ def api_root(request, format=None):
         'users': reverse('user-list', request=request, format=format),
         'data': reverse('data-list', request=request, format=format)
     })
+
+
+def metrics_exposition(request):
+    """ Prometheus scrape target, the metrics of every worker process when
+    PROMETHEUS_MULTIPROC_DIR is set
+    """
+    return HttpResponse(metrics.exposition(), content_type=metrics.CONTENT_TYPE_LATEST)
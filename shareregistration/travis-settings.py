@@ -44,6 +44,10 @@ INSTALLED_APPS = (
 ACCOUNT_ACTIVATION_DAYS = 7
 
 MIDDLEWARE_CLASSES = (
+    'push_endpoint.middleware.CompressionMiddleware',
+    'push_endpoint.middleware.ProfilingMiddleware',
+    'push_endpoint.middleware.MetricsMiddleware',
+    'push_endpoint.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -68,6 +72,17 @@ DATABASES = {
     }
 }
 
+# read replicas, aliases in DATABASES. Reads of GET requests go to one of
+# them, writes and the reads of clients that wrote in the last
+# DATABASE_PIN_SECONDS go to 'default'. Try it locally with a second sqlite
+# file: add a 'replica' alias naming a copy of the primary file, and copy it
+# again whenever the replica should catch up.
+DATABASE_ROUTERS = ['push_endpoint.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+DATABASE_PIN_SECONDS = 10
+# writes to these tables, sessions saved during a GET say, do not pin
+DATABASE_UNPINNED_TABLES = ('django_session', 'auth_user')
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.7/topics/i18n/
 
@@ -102,3 +117,56 @@ TEMPLATE_DIRS = [os.path.join(BASE_DIR, 'templates')]
 REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
+
+# DOI resolution cache, times in seconds
+DOI_CACHE_POSITIVE_TTL = 60 * 60 * 24 * 30
+DOI_CACHE_NEGATIVE_TTL = 60 * 60
+DOI_CACHE_MAX_ENTRIES = 100000
+# new entries a process stores before it checks the size against the max
+DOI_CACHE_EVICT_INTERVAL = 100
+# concurrent DOI lookups for a single bulk push
+DOI_RESOLVER_WORKERS = 10
+# where DOIs are resolved, point a server at the stub printed by the loadtest
+# command to load test it over HTTP
+DOI_RESOLVER_URL = 'https://dx.doi.org/'
+# rows per INSERT when a bulk push is written with bulk_create
+PUSHED_DATA_BATCH_SIZE = 500
+# records validated and inserted together by pushed_data/stream/
+PUSHED_DATA_STREAM_CHUNK_SIZE = 500
+# pushed_data/?cursor= keyset pagination
+PUSHED_DATA_PAGE_SIZE = 10
+PUSHED_DATA_MAX_PAGE_SIZE = 1000
+# rows fetched per query by pushed_data/export.csv and export.jsonl
+PUSHED_DATA_EXPORT_CHUNK_SIZE = 1000
+
+# cache of rendered DataList responses, invalidated on every write. Point
+# it at a shared backend (e.g. FileBasedCache) with several worker processes
+PUSHED_DATA_CACHE = 'default'
+PUSHED_DATA_CACHE_TIMEOUT = 300
+# pushes queued with pushed_data/?async=true, see the process_pushes command
+PUSHED_DATA_QUEUE_CHUNK_SIZE = 500
+PUSHED_DATA_QUEUE_CLAIM_TIMEOUT = 600
+# tags returned by pushed_data/tags/, and the most a ?limit= can ask for
+PUSHED_DATA_FACET_LIMIT = 20
+PUSHED_DATA_MAX_FACET_LIMIT = 1000
+# response compression and compressed request bodies, sizes in bytes
+PUSHED_DATA_COMPRESS_MIN_SIZE = 1024
+PUSHED_DATA_COMPRESS_LEVEL = 6
+PUSHED_DATA_MAX_BODY_SIZE = 100 * 1024 * 1024
+# per-source token buckets, (tokens per second, burst) for push requests,
+# pushed records and outbound DOI lookups. Shared by every process through
+# the database, overridden per source with a SourceLimit in the admin
+PUSHED_DATA_THROTTLE_RATES = {
+    'requests': (5, 50),
+    'items': (500, 10000),
+    'doi_lookups': (50, 1000),
+}
+# Server-Timing breakdown of every request, and cProfile dumps of a sampled
+# share of the requests slower than PROFILING_THRESHOLD milliseconds, written
+# to PROFILING_DIR when it is set
+PROFILING_DIR = None
+PROFILING_SAMPLE_RATE = 0.01
+PROFILING_THRESHOLD = 1000
+# /metrics sums the samples every worker process writes to files here. Set
+# it when the server runs several processes, to a directory emptied on start
+PROMETHEUS_MULTIPROC_DIR = None